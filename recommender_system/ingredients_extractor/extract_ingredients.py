@@ -2,16 +2,16 @@ import os
 import json
 import re
 from rest_framework.response import Response
-import requests
 import time
 
+from ollama_llm.client import OllamaBusy, async_ollama, ollama
+
 # Load local LLM model from Ollama server
-# LLM Model: deepseek-r1:8b
-OLLAMA_URL = "http://localhost:11434/api/generate"
+# Model, URL and timeouts: ollama_llm.client (OLLAMA_MODEL, OLLAMA_BASE_URL, OLLAMA_TIMEOUT)
 
-def extract_ingredients_from_meal(meal_text: str):
+def build_ingredient_prompt(meal_text: str):
     # Create detailed prompt for ingredient extraction
-    prompt = f"""
+    return f"""
     You are a professional nutrition expert. Analyze the meal: "{meal_text}" and extract ALL individual ingredients.
 
     For each ingredient, provide:
@@ -52,30 +52,60 @@ def extract_ingredients_from_meal(meal_text: str):
         ]
     }}
     """
-   
+
+
+def parse_ingredients(raw_output):
+    # Clean and extract JSON from the response
+    if raw_output:
+        # Try to find JSON pattern in the response
+        json_match = re.search(r'\{.*\}', raw_output, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(0)
+            # Parse JSON to validate it
+            parsed_json = json.loads(json_str)
+            return parsed_json
+        else:
+            # Fallback: return empty ingredients if no JSON found
+            return {"ingredients": []}
+    else:
+        return {"ingredients": []}
+
+
+def extract_ingredients_from_meal(meal_text: str):
+    prompt = build_ingredient_prompt(meal_text)
+    raw_output = None
+
     try:
         # Ollama API call
         raw_output = get_ollama_response(prompt)["response"]
+        return parse_ingredients(raw_output)
 
-        # Clean and extract JSON from the response
-        if raw_output:
-            # Try to find JSON pattern in the response
-            json_match = re.search(r'\{.*\}', raw_output, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                # Parse JSON to validate it
-                parsed_json = json.loads(json_str)
-                return parsed_json
-            else:
-                # Fallback: return empty ingredients if no JSON found
-                return {"ingredients": []}
-        else:
-            return {"ingredients": []}
-           
     except json.JSONDecodeError as e:
         print(f"Error parsing JSON response: {e}")
         print(f"Raw response: {raw_output}")
         return {"ingredients": []}
+    except OllamaBusy:
+        raise
+    except Exception as e:
+        print(f"Error calling Ollama API: {e}")
+        return {"ingredients": []}
+
+
+async def aextract_ingredients_from_meal(meal_text: str):
+    # Same as above for the async view; the Ollama call is awaited
+    prompt = build_ingredient_prompt(meal_text)
+    raw_output = None
+
+    try:
+        raw_output = (await aget_ollama_response(prompt))["response"]
+        return parse_ingredients(raw_output)
+
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON response: {e}")
+        print(f"Raw response: {raw_output}")
+        return {"ingredients": []}
+    except OllamaBusy:
+        raise
     except Exception as e:
         print(f"Error calling Ollama API: {e}")
         return {"ingredients": []}
@@ -83,26 +113,31 @@ def extract_ingredients_from_meal(meal_text: str):
 
 # Ollama 
 def get_ollama_response(prompt):
-    payload = {
-            "model": "deepseek-r1:8b",
-            "prompt": prompt,
-            "stream": False
-    }
+    try:
+        start = time.time()  # start timer
+        data = ollama.generate(prompt)
+
+        latency_ms = (time.time() - start) * 1000  # convert to milliseconds
+        print(f"\nLatency: {latency_ms:.2f} ms\n")
+
+        return data
+    except OllamaBusy:
+        raise
+    except Exception:
+        return Exception
+
 
+async def aget_ollama_response(prompt):
     try:
         start = time.time()  # start timer
-        ollama_response = requests.post(
-            OLLAMA_URL,
-            json=payload,
-            timeout=30
-        )
-        ollama_response.raise_for_status()
+        data = await async_ollama.generate(prompt)
 
         latency_ms = (time.time() - start) * 1000  # convert to milliseconds
         print(f"\nLatency: {latency_ms:.2f} ms\n")
 
-        data = ollama_response.json()
         return data
+    except OllamaBusy:
+        raise
     except Exception:
         return Exception
 
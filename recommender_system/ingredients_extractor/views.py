@@ -1,10 +1,11 @@
 from django.shortcuts import render
 import os
 import json
-from rest_framework.views import APIView
-from rest_framework.response import Response
 from rest_framework import status
-from .extract_ingredients import extract_ingredients_from_meal
+
+from ollama_llm.scheduler import OllamaBusy
+from recommender_system.async_views import AsyncAPIView, ParseError, json_response, request_data
+from .extract_ingredients import aextract_ingredients_from_meal
 
 
 FOOD_GROUPS = {
@@ -18,16 +19,20 @@ FOOD_GROUPS = {
 }
 
 
-class MealToIngredientAPIView(APIView):
-    def post(self, request):
-        meal_text = request.data.get("meal_text", "")
-
+class MealToIngredientAPIView(AsyncAPIView):
+    async def post(self, request):
         try:
+            meal_text = request_data(request).get("meal_text", "")
+
             if meal_text:
-                data = extract_ingredients_from_meal(meal_text)
+                data = await aextract_ingredients_from_meal(meal_text)
                 
-            return Response(data)
+            return json_response(data)
 
+        except ParseError as e:
+            return json_response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except OllamaBusy:
+            raise
         except Exception as e:
             print("General error:", e)
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return json_response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
@@ -0,0 +1,325 @@
+# Shared Ollama HTTP client for every app (rag, ollama_llm, ingredients_extractor)
+# and start_server.py.
+#
+# One keep-alive connection pool per process instead of a new TCP connection
+# per requests.post(), with model / URL / timeout configuration in one place
+# and the same retry rules for the sync and async clients. Generations take a
+# slot from ollama_llm.scheduler first; embeddings are short and bypass it.
+# Every request asks Ollama to keep its model loaded for OLLAMA_KEEP_ALIVE and
+# reports load times to ollama_llm.residency.
+# Kept free of Django imports.
+import asyncio
+import json
+import os
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .residency import cold_starts
+from .scheduler import OllamaBusy, scheduler
+
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "deepseek-r1:8b")
+OLLAMA_EMBEDDING_MODEL = os.environ.get("OLLAMA_EMBEDDING_MODEL", "nomic-embed-text:v1.5")
+
+# Seconds; the read timeout bounds a whole non-streaming generation
+OLLAMA_TIMEOUT = float(os.environ.get("OLLAMA_TIMEOUT", "30"))
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Streamed RAG answers (reasoning included) run well past OLLAMA_TIMEOUT
+OLLAMA_CHAIN_TIMEOUT = float(os.environ.get("OLLAMA_CHAIN_TIMEOUT", "300"))
+
+# Retries cover refused/reset connections and 5xx answers (e.g. while Ollama
+# is loading a model); a read timeout is not retried, the model was busy
+OLLAMA_RETRIES = int(os.environ.get("OLLAMA_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", "0.5"))
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", "16"))
+
+# Seconds Ollama keeps a model loaded after its last request (-1: forever);
+# Ollama's own default is 5 minutes, after which the next call pays a cold load
+OLLAMA_KEEP_ALIVE = int(os.environ.get("OLLAMA_KEEP_ALIVE", "1800"))
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class OllamaError(RuntimeError):
+    pass
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def record(self, seconds, retries, failed):
+        with self._lock:
+            self.requests += 1
+            self.retries += retries
+            self.errors += int(failed)
+            self.seconds += seconds
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "avg_ms": round(self.seconds / self.requests * 1000, 2) if self.requests else 0.0,
+            }
+
+
+def _generate_payload(prompt, model, stream, options, extra):
+    payload = {"model": model or OLLAMA_MODEL, "prompt": prompt, "stream": stream}
+    if options:
+        payload["options"] = options
+    payload["keep_alive"] = OLLAMA_KEEP_ALIVE
+    payload.update(extra)
+    return payload
+
+
+def _embed_payload(texts, model, keep_alive=OLLAMA_KEEP_ALIVE):
+    return {"model": model or OLLAMA_EMBEDDING_MODEL, "input": texts, "keep_alive": keep_alive}
+
+
+def _load_payload(model, kind, keep_alive):
+    # A generate request without a prompt only loads the model (keep_alive=0
+    # unloads it); embed needs some input
+    if kind == "embed":
+        return "/api/embed", _embed_payload(".", model, keep_alive)
+    return "/api/generate", {"model": model, "keep_alive": keep_alive}
+
+
+# ======= SYNC =======
+class OllamaClient:
+    def __init__(self, base_url=OLLAMA_BASE_URL, model=OLLAMA_MODEL, timeout=OLLAMA_TIMEOUT,
+                 retries=OLLAMA_RETRIES, pool_size=OLLAMA_POOL_SIZE):
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        # Retries are ours (below), so the adapter only pools
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats = _Stats()
+
+    def _post(self, path, payload, timeout=None, stream=False):
+        url = f"{self.base_url}{path}"
+        timeout = (OLLAMA_CONNECT_TIMEOUT, timeout or self.timeout)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url, json=payload, timeout=timeout, stream=stream)
+                if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                    response.close()
+                    raise requests.ConnectionError(f"{response.status_code} from Ollama")
+                response.raise_for_status()
+                self.stats.record(time.perf_counter() - start, attempt, False)
+                return response
+            except requests.ConnectionError as e:
+                if attempt < self.retries:
+                    time.sleep(OLLAMA_RETRY_BACKOFF * 2 ** attempt)
+                    attempt += 1
+                    continue
+                self.stats.record(time.perf_counter() - start, attempt, True)
+                raise OllamaError(f"Ollama request failed: {e}")
+            except requests.exceptions.Timeout:
+                self.stats.record(time.perf_counter() - start, attempt, True)
+                raise OllamaError("Ollama request timed out")
+            except requests.exceptions.RequestException as e:
+                self.stats.record(time.perf_counter() - start, attempt, True)
+                raise OllamaError(f"Ollama request failed: {e}")
+
+    def generate(self, prompt, model=None, options=None, timeout=None, **extra):
+        """Full /api/generate response (response, eval_count, durations, ...)."""
+        payload = _generate_payload(prompt, model or self.model, False, options, extra)
+        with scheduler.slot():
+            data = self._post("/api/generate", payload, timeout).json()
+        cold_starts.observe_response(payload["model"], data)
+        return data
+
+    def generate_text(self, prompt, **kwargs):
+        return self.generate(prompt, **kwargs).get("response", "").strip()
+
+    def stream_generate(self, prompt, model=None, options=None, timeout=None, **extra):
+        """Yields the /api/generate stream chunks (dicts) as they arrive."""
+        payload = _generate_payload(prompt, model or self.model, True, options, extra)
+        # The slot is held until the stream is consumed (or closed)
+        with scheduler.slot():
+            response = self._post("/api/generate", payload, timeout, stream=True)
+            cold_starts.touch(payload["model"])
+            with response:
+                try:
+                    for line in response.iter_lines():
+                        if line:
+                            chunk = json.loads(line)
+                            if chunk.get("done"):
+                                cold_starts.observe_response(payload["model"], chunk)
+                            yield chunk
+                except requests.exceptions.RequestException as e:
+                    raise OllamaError(f"Ollama stream failed: {e}")
+
+    def stream_text(self, prompt, **kwargs):
+        """Yields only the generated text pieces; closing it ends the generation."""
+        stream = self.stream_generate(prompt, **kwargs)
+        try:
+            for chunk in stream:
+                if chunk.get("response"):
+                    yield chunk["response"]
+        finally:
+            stream.close()
+
+    def embed(self, texts, model=None, timeout=None):
+        payload = _embed_payload(texts, model)
+        data = self._post("/api/embed", payload, timeout).json()
+        cold_starts.observe_response(payload["model"], data)
+        return data["embeddings"]
+
+    def load_model(self, model, kind="generate", keep_alive=OLLAMA_KEEP_ALIVE, timeout=OLLAMA_CHAIN_TIMEOUT):
+        """Loads (or keeps loaded) a model without generating; bypasses the scheduler."""
+        path, payload = _load_payload(model, kind, keep_alive)
+        self._post(path, payload, timeout).close()
+
+    def close(self):
+        self.session.close()
+
+
+# ======= ASYNC =======
+class AsyncOllamaClient:
+    """Same API as OllamaClient, awaitable. One httpx pool per event loop."""
+
+    def __init__(self, base_url=OLLAMA_BASE_URL, model=OLLAMA_MODEL, timeout=OLLAMA_TIMEOUT,
+                 retries=OLLAMA_RETRIES, pool_size=OLLAMA_POOL_SIZE):
+        self.base_url = base_url
+        self.model = model
+        self.timeout = timeout
+        self.retries = retries
+        self.pool_size = pool_size
+        self._clients = weakref.WeakKeyDictionary()
+        self.stats = _Stats()
+
+    def _client(self):
+        # An httpx.AsyncClient must not be shared across event loops
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            )
+            self._clients[loop] = client
+        return client
+
+    async def _send(self, path, payload, timeout=None, stream=False):
+        import httpx
+
+        client = self._client()
+        timeout = httpx.Timeout(timeout or self.timeout, connect=OLLAMA_CONNECT_TIMEOUT)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                request = client.build_request("POST", path, json=payload, timeout=timeout)
+                response = await client.send(request, stream=stream)
+                if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                    await response.aclose()
+                    raise httpx.ConnectError(f"{response.status_code} from Ollama")
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                self.stats.record(time.perf_counter() - start, attempt, False)
+                return response
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError) as e:
+                if attempt < self.retries:
+                    await asyncio.sleep(OLLAMA_RETRY_BACKOFF * 2 ** attempt)
+                    attempt += 1
+                    continue
+                self.stats.record(time.perf_counter() - start, attempt, True)
+                raise OllamaError(f"Ollama request failed: {e}")
+            except httpx.TimeoutException:
+                self.stats.record(time.perf_counter() - start, attempt, True)
+                raise OllamaError("Ollama request timed out")
+            except httpx.HTTPError as e:
+                self.stats.record(time.perf_counter() - start, attempt, True)
+                raise OllamaError(f"Ollama request failed: {e}")
+
+    async def generate(self, prompt, model=None, options=None, timeout=None, **extra):
+        payload = _generate_payload(prompt, model or self.model, False, options, extra)
+        async with scheduler.aslot():
+            response = await self._send("/api/generate", payload, timeout)
+        data = response.json()
+        cold_starts.observe_response(payload["model"], data)
+        return data
+
+    async def generate_text(self, prompt, **kwargs):
+        return (await self.generate(prompt, **kwargs)).get("response", "").strip()
+
+    async def stream_generate(self, prompt, model=None, options=None, timeout=None, **extra):
+        import httpx
+
+        payload = _generate_payload(prompt, model or self.model, True, options, extra)
+        async with scheduler.aslot():
+            response = await self._send("/api/generate", payload, timeout, stream=True)
+            cold_starts.touch(payload["model"])
+            try:
+                async for line in response.aiter_lines():
+                    if line:
+                        chunk = json.loads(line)
+                        if chunk.get("done"):
+                            cold_starts.observe_response(payload["model"], chunk)
+                        yield chunk
+            except httpx.HTTPError as e:
+                raise OllamaError(f"Ollama stream failed: {e}")
+            finally:
+                await response.aclose()
+
+    async def stream_text(self, prompt, **kwargs):
+        stream = self.stream_generate(prompt, **kwargs)
+        try:
+            async for chunk in stream:
+                if chunk.get("response"):
+                    yield chunk["response"]
+        finally:
+            await stream.aclose()
+
+    async def embed(self, texts, model=None, timeout=None):
+        payload = _embed_payload(texts, model)
+        response = await self._send("/api/embed", payload, timeout)
+        data = response.json()
+        cold_starts.observe_response(payload["model"], data)
+        return data["embeddings"]
+
+    async def load_model(self, model, kind="generate", keep_alive=OLLAMA_KEEP_ALIVE, timeout=OLLAMA_CHAIN_TIMEOUT):
+        path, payload = _load_payload(model, kind, keep_alive)
+        await (await self._send(path, payload, timeout)).aclose()
+
+    async def aclose(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+# Process-wide clients
+ollama = OllamaClient()
+async_ollama = AsyncOllamaClient()
+
+
+def client_stats():
+    from .residency import residency
+
+    return {
+        "sync": ollama.stats.as_dict(),
+        "async": async_ollama.stats.as_dict(),
+        "scheduler": scheduler.stats(),
+        "residency": residency.stats(),
+    }
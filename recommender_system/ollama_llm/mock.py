@@ -0,0 +1,318 @@
+# Stand-in for the Ollama HTTP API, for load tests without a GPU.
+#
+# Serves /api/generate, /api/chat (streaming and not), /api/embed and
+# /api/tags with canned answers shaped like the real ones: the four-section
+# caregiver layout (English or Traditional Chinese), ingredient JSON, and
+# numbered translation replies. Latency, token rate, parallelism, model load
+# time and failures are configurable (MockConfig). Run it with
+# `python manage.py mock_ollama`. Kept free of Django imports.
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+MOCK_ANSWER = """Summary:
+The meal is low in protein and fiber compared with the recommended daily intake. Energy intake is also below target.
+
+Key Health Concerns:
+- Insufficient protein for maintaining muscle mass
+- Low fiber intake may cause constipation
+
+Dietary Issues Observed:
+- Meals are mostly refined starch
+- Few vegetables and fruits
+
+Caregiver Action Steps:
+1. Add an egg or tofu to each meal.
+2. Serve a portion of soft cooked vegetables at lunch and dinner.
+3. Offer water regularly throughout the day.
+"""
+
+MOCK_ANSWER_TR_CN = """摘要：
+此餐的蛋白質與膳食纖維低於每日建議攝取量。熱量攝取也低於目標。
+
+主要健康問題：
+- 蛋白質不足，難以維持肌肉量
+- 膳食纖維攝取不足可能導致便秘
+
+觀察到的飲食問題：
+- 餐點多為精緻澱粉
+- 蔬菜與水果很少
+
+照顧者行動步驟：
+1. 每餐加入一顆蛋或豆腐。
+2. 午餐和晚餐提供一份煮軟的蔬菜。
+3. 全天定時提供飲水。
+"""
+
+MOCK_INGREDIENTS = {
+    "ingredients": [
+        {"name": "chicken", "food_group": "豆魚蛋肉類", "nutrients": ["Protein", "Fats"]},
+        {"name": "broccoli", "food_group": "蔬菜類", "nutrients": ["Water", "Total Fiber"]},
+        {"name": "garlic", "food_group": "調味品類", "nutrients": []},
+    ]
+}
+
+MOCK_REASONING = "Let me compare the meal with the recommended intake and pick the most important gaps first. "
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, token_rate=40.0, embed_latency=0.01, embed_dim=768, parallel=4,
+                 load_seconds=0.0, fail_rate=0.0, fail_status=500, drop_rate=0.0, think_tokens=0, seed=None):
+        self.latency = latency              # seconds before the first token (prompt evaluation)
+        self.token_rate = token_rate        # generated tokens per second per request; 0: no delay
+        self.embed_latency = embed_latency  # seconds per /api/embed call
+        self.embed_dim = embed_dim          # must match the FAISS index (nomic-embed-text: 768)
+        self.parallel = parallel            # requests generating at once, like OLLAMA_NUM_PARALLEL
+        self.load_seconds = load_seconds    # cold model load, until keep_alive expires
+        self.fail_rate = fail_rate          # fraction of requests answered with fail_status
+        self.fail_status = fail_status
+        self.drop_rate = drop_rate          # fraction of streams cut off halfway
+        self.think_tokens = think_tokens    # deepseek-r1 style <think> block before the answer
+        self.random = random.Random(seed)
+
+
+def _tokens(text):
+    # Roughly one token per word, whitespace kept with the word before it
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+def _answer_for(prompt, config):
+    if "extract ALL individual ingredients" in prompt:
+        return json.dumps(MOCK_INGREDIENTS, ensure_ascii=False, indent=2)
+    if prompt.startswith("Translate each numbered line"):
+        lines = re.findall(r"^(\d+)\. (.*)$", prompt, re.MULTILINE)
+        return "\n".join(f"{n}. 譯：{text}" for n, text in lines)
+    answer = MOCK_ANSWER_TR_CN if "Traditional Chinese" in prompt else MOCK_ANSWER
+    if config.think_tokens:
+        reasoning = (MOCK_REASONING * (config.think_tokens // 20 + 1)).split(" ")[:config.think_tokens]
+        answer = "<think>\n" + " ".join(reasoning) + "\n</think>\n\n" + answer
+    return answer
+
+
+def _apply_limits(tokens, options):
+    if options.get("num_predict") and options["num_predict"] > 0:
+        tokens = tokens[:options["num_predict"]]
+    text = "".join(tokens)
+    for stop in options.get("stop") or []:
+        if stop in text:
+            text = text[:text.index(stop)]
+            tokens = _tokens(text)
+    return tokens
+
+
+def mock_embedding(text, dim):
+    # Deterministic per text, unit length
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class MockStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, key):
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockOllama"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # One token per write; do not let Nagle batch them
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self._send_json({"models": [{"name": name} for name in sorted(self.server.loaded)]})
+        if self.path == "/api/version":
+            return self._send_json({"version": "mock"})
+        if self.path == "/mock/stats":
+            return self._send_json(self.server.stats.as_dict())
+        self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._send_json({"error": "invalid JSON"}, 400)
+
+        self.server.stats.count(self.path)
+        if self.config.random.random() < self.config.fail_rate:
+            self.server.stats.count("failed")
+            return self._send_json({"error": "mock failure"}, self.config.fail_status)
+
+        load_ns = self.server.load(body.get("model", ""), body.get("keep_alive"))
+        if self.path == "/api/embed":
+            return self._embed(body, load_ns)
+        if self.path == "/api/generate" and "prompt" not in body:
+            # Load / unload request
+            return self._send_json({"model": body.get("model"), "response": "", "done": True,
+                                    "done_reason": "load" if body.get("keep_alive") != 0 else "unload"})
+        if self.path in ("/api/generate", "/api/chat"):
+            return self._generate(body, load_ns)
+        self._send_json({"error": "not found"}, 404)
+
+    def _embed(self, body, load_ns):
+        texts = body.get("input") or ""
+        texts = [texts] if isinstance(texts, str) else texts
+        time.sleep(self.config.embed_latency)
+        self._send_json({
+            "model": body.get("model"),
+            "embeddings": [mock_embedding(text, self.config.embed_dim) for text in texts],
+            "load_duration": load_ns,
+            "total_duration": load_ns + int(self.config.embed_latency * 1e9),
+        })
+
+    def _generate(self, body, load_ns):
+        chat = self.path == "/api/chat"
+        if chat:
+            prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages") or [])
+        else:
+            prompt = body.get("prompt", "")
+        tokens = _apply_limits(_tokens(_answer_for(prompt, self.config)), body.get("options") or {})
+        drop_at = len(tokens) // 2 if self.config.random.random() < self.config.drop_rate else None
+        delay = 1.0 / self.config.token_rate if self.config.token_rate > 0 else 0.0
+
+        # Requests beyond `parallel` queue, as in Ollama
+        with self.server.slots:
+            started = time.perf_counter()
+            time.sleep(self.config.latency)
+            if not body.get("stream", True):
+                time.sleep(delay * len(tokens))
+                text = "".join(tokens)
+                done = self._final(body, tokens, load_ns, started)
+                if chat:
+                    done["message"] = {"role": "assistant", "content": text}
+                else:
+                    done["response"] = text
+                return self._send_json(done)
+            self._stream(body, tokens, load_ns, started, chat, drop_at, delay)
+
+    def _final(self, body, tokens, load_ns, started):
+        return {
+            "model": body.get("model"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "done": True, "done_reason": "stop",
+            "eval_count": len(tokens), "prompt_eval_count": len(_tokens(str(body.get("prompt") or body.get("messages")))),
+            "load_duration": load_ns, "total_duration": load_ns + int((time.perf_counter() - started) * 1e9),
+            "eval_duration": int(len(tokens) / self.config.token_rate * 1e9) if self.config.token_rate > 0 else 0,
+        }
+
+    def _stream(self, body, tokens, load_ns, started, chat, drop_at, delay):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        if drop_at is not None:
+            self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(data):
+            line = (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+            self.wfile.flush()
+
+        sent = 0
+        try:
+            for token in tokens:
+                if sent == drop_at:
+                    self.server.stats.count("dropped")
+                    self.close_connection = True
+                    return
+                chunk = {"model": body.get("model"), "done": False}
+                if chat:
+                    chunk["message"] = {"role": "assistant", "content": token}
+                else:
+                    chunk["response"] = token
+                send(chunk)
+                sent += 1
+                if delay:
+                    time.sleep(delay)
+            done = self._final(body, tokens, load_ns, started)
+            if chat:
+                done["message"] = {"role": "assistant", "content": ""}
+            else:
+                done["response"] = ""
+            send(done)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            self.server.stats.count("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream (early stop): stop generating, like Ollama
+            self.server.stats.count("aborted_by_client")
+            self.close_connection = True
+
+
+class MockOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once; the default listen backlog (5) resets them
+    request_queue_size = 1024
+
+    def __init__(self, address, config=None):
+        super().__init__(address, _Handler)
+        self.config = config or MockConfig()
+        self.slots = threading.Semaphore(max(1, self.config.parallel))
+        self.stats = MockStats()
+        self._loaded = {}   # model -> expiry (time.time())
+        self._load_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        now = time.time()
+        with self._load_lock:
+            return [model for model, expires in self._loaded.items() if expires > now]
+
+    def load(self, model, keep_alive):
+        """Simulates model residency; returns the load duration in ns."""
+        keep_alive = 300 if keep_alive is None else float(keep_alive)
+        with self._load_lock:
+            if keep_alive == 0:
+                self._loaded.pop(model, None)
+                return 0
+            cold = self._loaded.get(model, 0) <= time.time()
+            if cold and self.config.load_seconds:
+                # One load at a time, as on a single GPU
+                time.sleep(self.config.load_seconds)
+                self.stats.count("cold_loads")
+            self._loaded[model] = float("inf") if keep_alive < 0 else time.time() + keep_alive
+        return int(self.config.load_seconds * 1e9) if cold else 0
+
+
+def serve(host="127.0.0.1", port=11435, config=None):
+    server = MockOllamaServer((host, port), config)
+    print(f"[INFO] Mock Ollama listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,322 @@
+# Output budgets and format-aware early stopping for streamed generations.
+#
+# deepseek-r1 opens with a <think> block and often keeps writing after the
+# fixed caregiver layout ("... Caregiver Action Steps: 1. 2. 3."), all of it
+# generated on the GPU and then thrown away. OutputGuard consumes a token
+# stream, drops reasoning blocks as they arrive, and ends the stream (closing
+# the connection, which makes Ollama stop generating) as soon as the last
+# numbered step is written or the stage's answer budget is spent. num_predict
+# and stop sequences are passed to Ollama as a hard cap on top of that.
+#
+# Chat templates may pre-fill "<think>", in which case only the closing tag
+# shows up and everything before it was reasoning. Streamed text is therefore
+# held back until that is settled: a think tag is seen, the stream ends, or
+# OLLAMA_THINK_HOLDBACK answer tokens have passed without one.
+#
+# Token counts are stream chunks: Ollama sends one token per chunk.
+# Kept free of Django imports.
+import hashlib
+import os
+import re
+import threading
+from collections import Counter
+
+
+# Hard cap per generation, reasoning included
+OLLAMA_NUM_PREDICT = int(os.environ.get("OLLAMA_NUM_PREDICT", "2048"))
+# Answer tokens after the reasoning block; ~140 words plus headings
+OLLAMA_ANSWER_TOKENS = int(os.environ.get("OLLAMA_ANSWER_TOKENS", "320"))
+# Trailers the format forbids; "|"-separated, "\n" allowed. They also apply
+# inside the reasoning block, so keep them to text that never appears there.
+OLLAMA_STOP_SEQUENCES = [
+    stop.replace("\\n", "\n")
+    for stop in os.environ.get("OLLAMA_STOP_SEQUENCES", "\\n\\nNote:|\\n\\nDisclaimer").split("|")
+    if stop
+]
+# "0" keeps budgets and reasoning stripping but never ends a stream early
+OLLAMA_EARLY_STOP = os.environ.get("OLLAMA_EARLY_STOP", "1") != "0"
+# Tokens held back while a closing </think> could still turn them into
+# reasoning; 0 streams at once (models that never reason)
+OLLAMA_THINK_HOLDBACK = int(os.environ.get("OLLAMA_THINK_HOLDBACK", "256"))
+
+THINK_OPEN, THINK_CLOSE = "<think>", "</think>"
+
+
+class OutputBudget:
+    def __init__(self, num_predict=OLLAMA_NUM_PREDICT, answer_tokens=None, steps=None,
+                 stop=OLLAMA_STOP_SEQUENCES, early_stop=OLLAMA_EARLY_STOP):
+        self.num_predict = num_predict
+        self.answer_tokens = answer_tokens
+        # Number of the last numbered step that completes the layout (None: no layout)
+        self.steps = steps
+        self.stop = list(stop or [])
+        self.early_stop = early_stop
+
+    def options(self):
+        """Ollama generation options enforcing the hard limits."""
+        options = {}
+        if self.num_predict:
+            options["num_predict"] = self.num_predict
+        if self.stop:
+            options["stop"] = self.stop
+        return options
+
+    def fingerprint(self):
+        raw = repr((self.num_predict, self.answer_tokens, self.steps, self.stop, self.early_stop))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:12]
+
+
+# Translated answers take roughly twice the tokens for the same content
+STAGE_BUDGETS = {
+    "answer": OutputBudget(answer_tokens=OLLAMA_ANSWER_TOKENS, steps=3),
+    "answer-tr-cn": OutputBudget(answer_tokens=OLLAMA_ANSWER_TOKENS * 2, steps=3),
+    "summarize": OutputBudget(answer_tokens=OLLAMA_ANSWER_TOKENS, steps=3),
+    "translate": OutputBudget(answer_tokens=OLLAMA_ANSWER_TOKENS * 2, steps=3),
+    # Numbered lists of unseen sentences (rag.translation): no layout, only num_predict
+    "translate-segments": OutputBudget(),
+    # Free-form prompts: reasoning is stripped, no layout or answer budget
+    "text": OutputBudget(stop=None),
+}
+
+
+def budget_for(stage):
+    return STAGE_BUDGETS[stage]
+
+
+def budgets_fingerprint():
+    return "output:" + "".join(STAGE_BUDGETS[stage].fingerprint() for stage in sorted(STAGE_BUDGETS))
+
+
+def _steps_pattern(steps):
+    # "1." ... "2." ... "<steps>." with the last step's line terminated; also
+    # matches full-width digits/punctuation and "1、" in Chinese output
+    def item(n):
+        digit = f"[{n}{chr(0xFF10 + n)}]"
+        return rf"^[ \t]*{digit}[.．、)）]"
+    head = r".*?".join(item(n) for n in range(1, steps))
+    return re.compile(rf"{head}.*?{item(steps)}[ \t]*\S[^\n]*\n", re.MULTILINE | re.DOTALL)
+
+
+class OutputGuard:
+    """Incremental consumer for one generation: feed() chunks, read .text."""
+
+    def __init__(self, budget, stage="text", holdback=OLLAMA_THINK_HOLDBACK):
+        self.budget = budget
+        self.stage = stage
+        self.holdback = holdback
+        self._pattern = _steps_pattern(budget.steps) if budget.steps else None
+        self._pending = ""   # possible partial <think>/</think> tag
+        self._in_think = False
+        # False while text could still turn out to be pre-filled reasoning
+        self._settled = holdback <= 0
+        self._released = 0   # length of self.text handed out by feed()/flush()
+        self.text = ""
+        self.generated_tokens = 0
+        self.kept_tokens = 0
+        self.stopped = None   # why the stream was ended early
+
+    @property
+    def done(self):
+        return self.stopped is not None
+
+    def feed(self, chunk):
+        """Returns the answer text that is safe to pass on ("" while inside or possibly inside reasoning)."""
+        if self.done or not chunk:
+            return ""
+        self.generated_tokens += 1
+        emitted = self._strip(self._pending + chunk)
+        if emitted:
+            self.kept_tokens += 1
+            # No leading whitespace left over from the closed reasoning block
+            if not self.text:
+                emitted = emitted.lstrip()
+            self.text += emitted
+            self._check_stop(emitted)
+        if self.done or self.kept_tokens >= self.holdback:
+            self._settled = True
+        return self._release()
+
+    def _check_stop(self, emitted):
+        if not self.budget.early_stop:
+            return
+        if self._pattern is not None and "\n" in emitted:
+            match = self._pattern.search(self.text)
+            if match:
+                self.text = self.text[:match.end()].rstrip()
+                self.stopped = "sections_complete"
+                return
+        if self.budget.answer_tokens and self.kept_tokens >= self.budget.answer_tokens:
+            self.stopped = "answer_budget"
+
+    def _release(self):
+        if not self._settled:
+            return ""
+        text = self.text[self._released:]
+        self._released = len(self.text)
+        return text
+
+    def _strip(self, text):
+        out = []
+        while text:
+            if self._in_think:
+                end = text.find(THINK_CLOSE)
+                if end < 0:
+                    self._pending = _partial_tag(text, THINK_CLOSE)
+                    return "".join(out)
+                text = text[end + len(THINK_CLOSE):]
+                self._in_think = False
+                continue
+            start = text.find(THINK_OPEN)
+            close = text.find(THINK_CLOSE)
+            if 0 <= close and (start < 0 or close < start):
+                if not self._settled:
+                    # Pre-filled "<think>": everything held back so far was reasoning
+                    self.kept_tokens = 0
+                    self.text = ""
+                    out = []
+                    self._settled = True
+                else:
+                    # Text has been passed on already: only drop the stray tag
+                    out.append(text[:close])
+                text = text[close + len(THINK_CLOSE):]
+                continue
+            if start < 0:
+                self._pending = _partial_tag(text, THINK_OPEN) or _partial_tag(text, THINK_CLOSE)
+                out.append(text[:len(text) - len(self._pending)])
+                return "".join(out)
+            out.append(text[:start])
+            text = text[start + len(THINK_OPEN):]
+            self._in_think = True
+            # The model writes its own tags, so nothing before this was reasoning
+            self._settled = True
+        self._pending = ""
+        return "".join(out)
+
+    def flush(self):
+        """Text still held back, once the stream has ended."""
+        if not (self._in_think or self.done):
+            self.text += self._pending
+        self._pending = ""
+        self._settled = True
+        return self._release()
+
+    def finish(self):
+        self.flush()
+        self.text = self.text.strip()
+        return self.text
+
+    def report(self):
+        return {
+            "stage": self.stage,
+            "generated_tokens": self.generated_tokens,
+            "kept_tokens": self.kept_tokens,
+            # Reasoning, trailers and anything else that never reached the caller
+            "discarded_tokens": self.generated_tokens - self.kept_tokens,
+            "stopped": self.stopped or "end_of_stream",
+        }
+
+
+def _partial_tag(text, tag):
+    # Longest suffix of text that is a prefix of tag
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if tag.startswith(text[-size:]):
+            return text[-size:]
+    return ""
+
+
+# ======= STATS =======
+class OutputStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, report):
+        print(f"[INFO] LLM output ({report['stage']}): generated {report['generated_tokens']} tokens, "
+              f"kept {report['kept_tokens']}, stopped: {report['stopped']}")
+        with self._lock:
+            stage = self._stages.setdefault(report["stage"], Counter())
+            stage["calls"] += 1
+            for key in ("generated_tokens", "kept_tokens", "discarded_tokens"):
+                stage[key] += report[key]
+            stage["stopped_" + report["stopped"]] += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: dict(counts) for stage, counts in self._stages.items()}
+
+
+output_stats = OutputStats()
+
+
+# ======= CONSUMERS =======
+def consume(chunks, stage="text", budget=None):
+    """Drains a text-chunk iterator through an OutputGuard; returns the kept answer."""
+    guard = OutputGuard(budget or budget_for(stage), stage)
+    try:
+        for chunk in chunks:
+            guard.feed(chunk)
+            if guard.done:
+                break
+    finally:
+        # Closing the stream drops the connection, so Ollama stops generating
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    text = guard.finish()
+    output_stats.record(guard.report())
+    return text
+
+
+async def aconsume(chunks, stage="text", budget=None):
+    guard = OutputGuard(budget or budget_for(stage), stage)
+    try:
+        async for chunk in chunks:
+            guard.feed(chunk)
+            if guard.done:
+                break
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    text = guard.finish()
+    output_stats.record(guard.report())
+    return text
+
+
+def guarded_stream(chunks, stage="text", budget=None):
+    """Like consume(), but yields the kept text as it arrives."""
+    guard = OutputGuard(budget or budget_for(stage), stage)
+    try:
+        for chunk in chunks:
+            text = guard.feed(chunk)
+            if text:
+                yield text
+            if guard.done:
+                break
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    pending = guard.flush()
+    if pending:
+        yield pending
+    output_stats.record(guard.report())
+
+
+async def aguarded_stream(chunks, stage="text", budget=None):
+    guard = OutputGuard(budget or budget_for(stage), stage)
+    try:
+        async for chunk in chunks:
+            text = guard.feed(chunk)
+            if text:
+                yield text
+            if guard.done:
+                break
+    finally:
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
+    pending = guard.flush()
+    if pending:
+        yield pending
+    output_stats.record(guard.report())
@@ -0,0 +1,164 @@
+# Keeps the chat and embedding models loaded in Ollama.
+#
+# After keep_alive expires (Ollama's default is 5 minutes), or when the GPU
+# evicts a model for another one, the next request pays a multi-second load
+# and can run into the client timeout. ResidencyManager loads both models at
+# process start and then pings any model that has been idle for
+# OLLAMA_PING_INTERVAL seconds, which also re-loads it right away if it was
+# evicted. Every request carries OLLAMA_KEEP_ALIVE (ollama_llm.client).
+#
+# cold_starts records which calls (requests and pings) found their model not
+# loaded, with cold vs warm latency. Kept free of Django imports.
+import collections
+import os
+import threading
+import time
+
+
+OLLAMA_PING_INTERVAL = float(os.environ.get("OLLAMA_PING_INTERVAL", "120"))   # seconds; 0 disables pings
+# A call whose model load takes longer than this counts as a cold start
+OLLAMA_COLD_LOAD_MS = float(os.environ.get("OLLAMA_COLD_LOAD_MS", "500"))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class ColdStartStats:
+    def __init__(self, history=1000):
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self._latency = collections.defaultdict(lambda: {"cold": collections.deque(maxlen=history),
+                                                         "warm": collections.deque(maxlen=history)})
+        self.events = collections.deque(maxlen=50)
+
+    def touch(self, model):
+        with self._lock:
+            self._last_used[model] = time.time()
+
+    def idle_seconds(self, model):
+        with self._lock:
+            last = self._last_used.get(model)
+        return None if last is None else time.time() - last
+
+    def observe(self, model, load_ms, total_ms, source="request"):
+        """load_ms: Ollama's load_duration (or the wall time of a load request)."""
+        cold = load_ms >= OLLAMA_COLD_LOAD_MS
+        with self._lock:
+            self._last_used[model] = time.time()
+            self._latency[model]["cold" if cold else "warm"].append(total_ms)
+            if cold:
+                self.events.append({
+                    "model": model, "source": source, "load_ms": round(load_ms, 1),
+                    "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                })
+        if cold:
+            print(f"[WARN] Ollama cold start ({source}): {model} took {load_ms / 1000:.1f}s to load")
+        return cold
+
+    def observe_response(self, model, data):
+        # /api/generate, /api/chat and /api/embed report durations in nanoseconds
+        if "load_duration" in data and "total_duration" in data:
+            self.observe(model, data["load_duration"] / 1e6, data["total_duration"] / 1e6)
+        else:
+            self.touch(model)
+
+    def as_dict(self):
+        with self._lock:
+            models = {}
+            for model, latency in self._latency.items():
+                cold, warm = list(latency["cold"]), list(latency["warm"])
+                models[model] = {
+                    "cold": len(cold),
+                    "warm": len(warm),
+                    "cold_ms": {"p50": round(_percentile(cold, 50), 1), "max": round(max(cold), 1) if cold else 0.0},
+                    "warm_ms": {"p50": round(_percentile(warm, 50), 1), "p95": round(_percentile(warm, 95), 1)},
+                }
+            return {"latency": models, "recent_cold_starts": list(self.events)}
+
+
+cold_starts = ColdStartStats()
+
+
+class ResidencyManager:
+    def __init__(self, models=None, interval=OLLAMA_PING_INTERVAL):
+        # (model, "generate" | "embed"); defaults to the client's models, which
+        # are read on first use because ollama_llm.client imports this module
+        self._models = models
+        self.interval = interval
+        self.loads = collections.Counter()
+        self.failures = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def models(self):
+        if self._models is None:
+            from .client import OLLAMA_EMBEDDING_MODEL, OLLAMA_MODEL
+
+            self._models = [(OLLAMA_MODEL, "generate"), (OLLAMA_EMBEDDING_MODEL, "embed")]
+        return self._models
+
+    def _load(self, model, kind, source):
+        from .client import OllamaError, ollama
+
+        start = time.perf_counter()
+        try:
+            ollama.load_model(model, kind)
+        except OllamaError as e:
+            self.failures[model] += 1
+            print(f"[WARN] Ollama {source} for {model} failed: {e}")
+            return None
+        # A load request does no generation: its wall time is the load time
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.loads[model] += 1
+        cold_starts.observe(model, elapsed_ms, elapsed_ms, source=source)
+        return round(elapsed_ms, 1)
+
+    def warm(self):
+        """Loads every model now; returns the load time per model in ms."""
+        return {model: self._load(model, kind, "warmup") for model, kind in self.models}
+
+    def ping(self):
+        # Models used within the interval are kept alive by that traffic already
+        pinged = {}
+        for model, kind in self.models:
+            idle = cold_starts.idle_seconds(model)
+            if idle is None or idle >= self.interval:
+                pinged[model] = self._load(model, kind, "ping")
+        return pinged
+
+    def _run(self, warm):
+        if warm:
+            print("[INFO] Ollama models warmed (ms):", self.warm())
+        while self.interval > 0 and not self._stop.wait(self.interval):
+            self.ping()
+
+    def start(self, warm=True):
+        """Warms the models and keeps them resident from a daemon thread; idempotent."""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(warm,), name="ollama-residency", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {
+            "models": [model for model, _ in self.models],
+            "ping_interval_s": self.interval,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "loads": dict(self.loads),
+            "failures": dict(self.failures),
+            **cold_starts.as_dict(),
+        }
+
+
+# Process-wide manager; started by RAG_WARMUP=1 (rag.apps) and start_server.py
+residency = ResidencyManager()
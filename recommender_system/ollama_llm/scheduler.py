@@ -0,0 +1,312 @@
+# Admission control in front of the (single) Ollama instance.
+#
+# Every generation -- RAG chains, summarise/translate passes, ingredient
+# extraction, the raw prompt endpoint -- takes a slot here first. At most
+# OLLAMA_MAX_CONCURRENCY generations run at once; the rest wait in a bounded
+# queue per priority lane. Interactive (caregiver-facing) requests are always
+# granted before batch jobs, and batch work may never hold every slot.
+#
+# Instead of letting requests pile up until they hit the HTTP timeout and get
+# retried, a request that cannot be served in time is rejected up front:
+#   queue full                                   -> OllamaBusy(status=429)
+#   expected wait > OLLAMA_ADMISSION_BUDGET      -> OllamaBusy(status=503)
+#   waited past its expected wait
+#     + OLLAMA_QUEUE_TIMEOUT in queue            -> OllamaBusy(status=503)
+# each with a Retry-After estimate. The expected wait comes from the observed
+# time a slot is held, so it follows the real generation length. Slots are shared by threads and event
+# loops of one process; with several server processes the limit is per
+# process. Kept free of Django imports.
+import asyncio
+import collections
+import contextlib
+import contextvars
+import math
+import os
+import threading
+import time
+
+
+LANES = ("interactive", "batch")
+
+OLLAMA_MAX_CONCURRENCY = max(1, int(os.environ.get("OLLAMA_MAX_CONCURRENCY", "2")))
+# Batch work leaves at least one slot free for interactive requests
+OLLAMA_BATCH_CONCURRENCY = max(1, int(os.environ.get("OLLAMA_BATCH_CONCURRENCY", str(max(1, OLLAMA_MAX_CONCURRENCY - 1)))))
+OLLAMA_MAX_QUEUE = int(os.environ.get("OLLAMA_MAX_QUEUE", "16"))
+OLLAMA_MAX_BATCH_QUEUE = int(os.environ.get("OLLAMA_MAX_BATCH_QUEUE", "8"))
+# Longest expected wait (seconds) a new request is queued for; a full RAG
+# generation takes tens of seconds, so this spans several of them
+OLLAMA_ADMISSION_BUDGET = float(os.environ.get("OLLAMA_ADMISSION_BUDGET", "120"))
+# Seconds a queued request may wait beyond its expected wait (or at all, before
+# any service time has been observed)
+OLLAMA_QUEUE_TIMEOUT = float(os.environ.get("OLLAMA_QUEUE_TIMEOUT", "10"))
+
+# Lane of the current request (set per request by the Django middleware)
+_lane = contextvars.ContextVar("ollama_lane", default="interactive")
+# True while this context holds a slot: nested calls (a multi-pass chain's
+# second pass) reuse it instead of waiting for a second one
+_holding = contextvars.ContextVar("ollama_slot_held", default=False)
+
+
+class OllamaBusy(RuntimeError):
+    def __init__(self, message, status=429, retry_after=1):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def current_lane():
+    return _lane.get()
+
+
+@contextlib.contextmanager
+def use_lane(lane):
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane {lane!r}; expected one of {LANES}")
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+@contextlib.contextmanager
+def own_slot():
+    """Generations started here take a slot of their own even when the caller holds one (fan-out tasks)."""
+    token = _holding.set(False)
+    try:
+        yield
+    finally:
+        _holding.reset(token)
+
+
+class _Waiter:
+    __slots__ = ("lane", "enqueued", "event", "loop", "future", "granted")
+
+    def __init__(self, lane, loop=None):
+        self.lane = lane
+        self.enqueued = time.perf_counter()
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.granted = False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Scheduler:
+    def __init__(self, concurrency=OLLAMA_MAX_CONCURRENCY, batch_concurrency=OLLAMA_BATCH_CONCURRENCY,
+                 max_queue=OLLAMA_MAX_QUEUE, max_batch_queue=OLLAMA_MAX_BATCH_QUEUE,
+                 queue_timeout=OLLAMA_QUEUE_TIMEOUT, admission_budget=OLLAMA_ADMISSION_BUDGET):
+        self.concurrency = concurrency
+        self.lane_concurrency = {"interactive": concurrency, "batch": min(batch_concurrency, concurrency)}
+        self.max_queue = {"interactive": max_queue, "batch": max_batch_queue}
+        self.queue_timeout = queue_timeout
+        self.admission_budget = admission_budget
+        self._lock = threading.Lock()
+        self._queues = {lane: collections.deque() for lane in LANES}
+        self._active = {lane: 0 for lane in LANES}
+        # Moving average of how long a slot is held; drives Retry-After
+        self._service_seconds = None
+        self._waits = {lane: collections.deque(maxlen=1000) for lane in LANES}
+        self._counts = {lane: collections.Counter() for lane in LANES}
+
+    # ======= ADMISSION (lock held) =======
+    def _can_start(self, lane):
+        if sum(self._active.values()) >= self.concurrency:
+            return False
+        return self._active[lane] < self.lane_concurrency[lane]
+
+    def _ahead_of(self, lane):
+        # Waiters that would be served before a new request in this lane
+        ahead = 0
+        for other in LANES:
+            ahead += len(self._queues[other])
+            if other == lane:
+                return ahead
+        return ahead
+
+    def _expected_wait(self, lane):
+        if self._service_seconds is None:
+            return None
+        slots = self.lane_concurrency[lane]
+        return math.ceil((self._ahead_of(lane) + 1) / slots) * self._service_seconds
+
+    def _retry_after(self, lane):
+        wait = self._expected_wait(lane)
+        return max(1, math.ceil(wait)) if wait is not None else 1
+
+    def _admit(self, lane):
+        """None to run now; else the seconds to wait in the queue. Raises OllamaBusy to reject."""
+        if self._ahead_of(lane) == 0 and self._can_start(lane):
+            self._start(lane, 0.0)
+            return None
+        if len(self._queues[lane]) >= self.max_queue[lane]:
+            self._reject(lane, "queue_full")
+            raise OllamaBusy(f"LLM queue full ({lane})", status=429, retry_after=self._retry_after(lane))
+        wait = self._expected_wait(lane)
+        if wait is not None and wait > self.admission_budget:
+            self._reject(lane, "expected_wait")
+            raise OllamaBusy(f"LLM busy: expected wait {wait:.1f}s ({lane})", status=503,
+                             retry_after=self._retry_after(lane))
+        return (wait or 0.0) + self.queue_timeout
+
+    def _start(self, lane, waited):
+        self._active[lane] += 1
+        self._counts[lane]["admitted"] += 1
+        self._waits[lane].append(waited)
+
+    def _reject(self, lane, reason):
+        self._counts[lane][reason] += 1
+        print(f"[WARN] Ollama scheduler rejected a request in the {lane} lane ({reason}); "
+              f"active {sum(self._active.values())}/{self.concurrency}, "
+              f"queued {', '.join(f'{name} {len(queue)}' for name, queue in self._queues.items())}")
+
+    def _grant_next(self):
+        now = time.perf_counter()
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and self._can_start(lane):
+                waiter = queue.popleft()
+                waiter.granted = True
+                self._start(lane, now - waiter.enqueued)
+                if waiter.loop is None:
+                    waiter.event.set()
+                else:
+                    waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+    def _release(self, lane, held):
+        with self._lock:
+            self._active[lane] -= 1
+            if held is not None:
+                self._service_seconds = held if self._service_seconds is None else 0.8 * self._service_seconds + 0.2 * held
+            self._grant_next()
+
+    def _timed_out(self, waiter):
+        # Lock held. False when the slot was granted while the timeout fired
+        if waiter.granted:
+            return False
+        self._queues[waiter.lane].remove(waiter)
+        self._reject(waiter.lane, "timeout")
+        return True
+
+    def check(self, lane=None):
+        """Fail fast (OllamaBusy) when a request in this lane would be rejected, without queueing it."""
+        lane = lane or current_lane()
+        with self._lock:
+            if len(self._queues[lane]) >= self.max_queue[lane]:
+                self._reject(lane, "queue_full")
+                raise OllamaBusy(f"LLM queue full ({lane})", status=429, retry_after=self._retry_after(lane))
+
+    # ======= SYNC =======
+    def acquire(self, lane):
+        with self._lock:
+            timeout = self._admit(lane)
+            if timeout is None:
+                return
+            waiter = _Waiter(lane)
+            self._queues[lane].append(waiter)
+        if waiter.event.wait(timeout):
+            return
+        with self._lock:
+            if self._timed_out(waiter):
+                raise OllamaBusy(f"LLM queue wait exceeded {timeout:.1f}s ({lane})", status=503,
+                                 retry_after=self._retry_after(lane))
+
+    @contextlib.contextmanager
+    def slot(self, lane=None):
+        if _holding.get():
+            yield
+            return
+        lane = lane or current_lane()
+        self.acquire(lane)
+        token = _holding.set(True)
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            _holding.reset(token)
+            # Failed calls say little about service time
+            self._release(lane, None if failed else time.perf_counter() - start)
+
+    # ======= ASYNC =======
+    async def aacquire(self, lane):
+        with self._lock:
+            timeout = self._admit(lane)
+            if timeout is None:
+                return
+            waiter = _Waiter(lane, loop=asyncio.get_running_loop())
+            self._queues[lane].append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if self._timed_out(waiter):
+                    raise OllamaBusy(f"LLM queue wait exceeded {timeout:.1f}s ({lane})", status=503,
+                                     retry_after=self._retry_after(lane))
+        except asyncio.CancelledError:
+            # Client went away while queued: give the slot back (or the place in line)
+            with self._lock:
+                if not waiter.granted:
+                    self._queues[lane].remove(waiter)
+                    raise
+            self._release(lane, None)
+            raise
+
+    @contextlib.asynccontextmanager
+    async def aslot(self, lane=None):
+        if _holding.get():
+            yield
+            return
+        lane = lane or current_lane()
+        await self.aacquire(lane)
+        token = _holding.set(True)
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            _holding.reset(token)
+            self._release(lane, None if failed else time.perf_counter() - start)
+
+    # ======= METRICS =======
+    def stats(self):
+        with self._lock:
+            lanes = {}
+            for lane in LANES:
+                waits = sorted(self._waits[lane])
+                counts = self._counts[lane]
+                lanes[lane] = {
+                    "active": self._active[lane],
+                    "queued": len(self._queues[lane]),
+                    "max_queue": self.max_queue[lane],
+                    "admitted": counts["admitted"],
+                    "rejected": {reason: counts[reason] for reason in ("queue_full", "expected_wait", "timeout")},
+                    "wait_ms": {
+                        "p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                        "p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                        "max": round(waits[-1] * 1000, 1) if waits else 0.0,
+                    },
+                }
+            return {
+                "concurrency": self.concurrency,
+                "active": sum(self._active.values()),
+                "queued": sum(len(queue) for queue in self._queues.values()),
+                "queue_timeout_s": self.queue_timeout,
+                "admission_budget_s": self.admission_budget,
+                "avg_service_ms": round(self._service_seconds * 1000, 1) if self._service_seconds is not None else None,
+                "lanes": lanes,
+            }
+
+
+# Process-wide scheduler shared by the sync and async clients and the RAG chains
+scheduler = Scheduler()
@@ -1,29 +1,15 @@
-import requests
+from .client import async_ollama, ollama
+from .output import aconsume, budget_for, consume
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
-OLLAMA_MODEL = "deepseek-r1:8b"
 
-def get_ollama_llm_response(prompt: str) -> str:
-    payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": False
-    }
+def get_ollama_llm_response(prompt: str, stage: str = "text") -> str:
+    # Pooled keep-alive client; raises OllamaError (a RuntimeError) on timeout or failure.
+    # Streamed through the stage's output budget: reasoning is dropped and the
+    # generation ends once the answer is complete (ollama_llm.output).
+    budget = budget_for(stage)
+    return consume(ollama.stream_text(prompt, options=budget.options()), stage, budget)
 
-    try:
-        response = requests.post(
-            OLLAMA_URL,
-            json=payload,
-            timeout=30
-        )
-        response.raise_for_status()
-
-        data = response.json()
-        return data.get("response", "").strip()
-
-    except requests.exceptions.Timeout:
-        raise RuntimeError("Ollama request timed out")
-
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"Ollama request failed: {e}")
 
+async def aget_ollama_llm_response(prompt: str, stage: str = "text") -> str:
+    budget = budget_for(stage)
+    return await aconsume(async_ollama.stream_text(prompt, options=budget.options()), stage, budget)
@@ -1,3 +1,492 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.test import SimpleTestCase
+
+from .client import AsyncOllamaClient, OllamaClient, OllamaError, _generate_payload
+from .mock import MOCK_ANSWER, MOCK_ANSWER_TR_CN, MockConfig, MockOllamaServer, mock_embedding
+from .output import OutputBudget, OutputGuard, consume, guarded_stream
+from .residency import ColdStartStats, ResidencyManager
+from .scheduler import OllamaBusy, Scheduler
+
+
+class ScriptedServer(ThreadingHTTPServer):
+    """Answers each POST with the next scripted status (200 once the script runs out)."""
+
+    daemon_threads = True
+
+    def __init__(self, script=(), delay=0.0):
+        super().__init__(("127.0.0.1", 0), _ScriptedHandler)
+        self.script = list(script)
+        self.delay = delay
+        self.payloads = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def next_status(self, payload):
+        with self._lock:
+            self.payloads.append(payload)
+            return self.script.pop(0) if self.script else 200
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _ScriptedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+        status = self.server.next_status(payload)
+        time.sleep(self.server.delay)
+        if payload.get("stream"):
+            lines = [{"response": "Hello", "done": False}, {"response": " world", "done": False},
+                     {"response": "", "done": True, "eval_count": 2}]
+            body = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        else:
+            body = json.dumps({"response": " ok ", "done": True} if status == 200 else {"error": "busy"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and went away
+            pass
+
+
+@mock.patch("ollama_llm.client.OLLAMA_RETRY_BACKOFF", 0)
+class OllamaClientTests(SimpleTestCase):
+    def serve(self, script=(), delay=0.0):
+        server = ScriptedServer(script, delay)
+        self.addCleanup(server.stop)
+        return server
+
+    def test_generate_payload_keeps_model_loaded(self):
+        payload = _generate_payload("hi", "m", False, {"num_predict": 5}, {"think": False})
+        self.assertEqual(payload["model"], "m")
+        self.assertEqual(payload["options"], {"num_predict": 5})
+        self.assertIn("keep_alive", payload)
+        self.assertFalse(payload["think"])
+
+    def test_retries_5xx_then_succeeds(self):
+        server = self.serve([503, 502])
+        client = OllamaClient(base_url=server.url, retries=2)
+        self.assertEqual(client.generate_text("hi"), "ok")
+        self.assertEqual(len(server.payloads), 3)
+        self.assertEqual(client.stats.as_dict()["retries"], 2)
+
+    def test_gives_up_after_retries(self):
+        server = self.serve([500, 500, 500])
+        client = OllamaClient(base_url=server.url, retries=1)
+        with self.assertRaises(OllamaError):
+            client.generate_text("hi")
+        self.assertEqual(len(server.payloads), 2)
+        self.assertEqual(client.stats.as_dict()["errors"], 1)
+
+    def test_client_errors_are_not_retried(self):
+        server = self.serve([400])
+        client = OllamaClient(base_url=server.url, retries=2)
+        with self.assertRaises(OllamaError):
+            client.generate_text("hi")
+        self.assertEqual(len(server.payloads), 1)
+
+    def test_timeout_is_not_retried(self):
+        server = self.serve(delay=0.5)
+        client = OllamaClient(base_url=server.url, retries=2, timeout=0.1)
+        with self.assertRaisesMessage(OllamaError, "timed out"):
+            client.generate_text("hi")
+        self.assertEqual(len(server.payloads), 1)
+
+    def test_connection_refused_raises_ollama_error(self):
+        server = self.serve()
+        url = server.url
+        server.stop()
+        with self.assertRaises(OllamaError):
+            OllamaClient(base_url=url, retries=1).generate_text("hi")
+
+    def test_stream_text(self):
+        server = self.serve()
+        client = OllamaClient(base_url=server.url)
+        self.assertEqual("".join(client.stream_text("hi")), "Hello world")
+        self.assertTrue(server.payloads[0]["stream"])
+
+
+@mock.patch("ollama_llm.client.OLLAMA_RETRY_BACKOFF", 0)
+class AsyncOllamaClientTests(SimpleTestCase):
+    def serve(self, script=(), delay=0.0):
+        server = ScriptedServer(script, delay)
+        self.addCleanup(server.stop)
+        return server
+
+    def run_async(self, client, coroutine_fn):
+        async def main():
+            try:
+                return await coroutine_fn()
+            finally:
+                await client.aclose()
+
+        return asyncio.run(main())
+
+    def test_retries_5xx_then_succeeds(self):
+        server = self.serve([503])
+        client = AsyncOllamaClient(base_url=server.url, retries=2)
+        self.assertEqual(self.run_async(client, lambda: client.generate_text("hi")), "ok")
+        self.assertEqual(len(server.payloads), 2)
+
+    def test_gives_up_after_retries(self):
+        server = self.serve([504, 504])
+        client = AsyncOllamaClient(base_url=server.url, retries=1)
+        with self.assertRaises(OllamaError):
+            self.run_async(client, lambda: client.generate_text("hi"))
+        self.assertEqual(len(server.payloads), 2)
+
+    def test_timeout_is_not_retried(self):
+        server = self.serve(delay=0.5)
+        client = AsyncOllamaClient(base_url=server.url, retries=2, timeout=0.1)
+        with self.assertRaisesMessage(OllamaError, "timed out"):
+            self.run_async(client, lambda: client.generate_text("hi"))
+        self.assertEqual(len(server.payloads), 1)
+
+    def test_stream_text(self):
+        server = self.serve()
+        client = AsyncOllamaClient(base_url=server.url)
+
+        async def collect():
+            return "".join([piece async for piece in client.stream_text("hi")])
+
+        self.assertEqual(self.run_async(client, collect), "Hello world")
+
+
+@mock.patch("builtins.print")
+class SchedulerTests(SimpleTestCase):
+    def scheduler(self, **kwargs):
+        options = {"concurrency": 1, "batch_concurrency": 1, "max_queue": 4, "max_batch_queue": 2,
+                   "queue_timeout": 5, "admission_budget": 120}
+        options.update(kwargs)
+        return Scheduler(**options)
+
+    def test_nested_slots_reuse_the_outer_slot(self, _print):
+        scheduler = self.scheduler()
+        with scheduler.slot():
+            with scheduler.slot():
+                self.assertEqual(scheduler.stats()["active"], 1)
+            # The inner exit must not clear the outer holder's flag
+            with scheduler.slot():
+                self.assertEqual(scheduler.stats()["active"], 1)
+        self.assertEqual(scheduler.stats()["active"], 0)
+        self.assertEqual(scheduler.stats()["lanes"]["interactive"]["admitted"], 1)
+
+    def test_long_generations_still_queue_within_the_budget(self, _print):
+        scheduler = self.scheduler()
+        # A deepseek-r1 answer holds its slot for ~40 s, far over queue_timeout
+        scheduler._service_seconds = 40.0
+
+        async def main():
+            scheduler.acquire("interactive")
+            waiter = asyncio.ensure_future(scheduler.aacquire("interactive"))
+            await asyncio.sleep(0.01)
+            self.assertEqual(scheduler.stats()["queued"], 1)
+            scheduler._release("interactive", None)
+            await asyncio.wait_for(waiter, 1)
+            scheduler._release("interactive", None)
+
+        asyncio.run(main())
+        self.assertEqual(scheduler.stats()["lanes"]["interactive"]["rejected"]["expected_wait"], 0)
+
+    def test_expected_wait_over_budget_is_rejected(self, _print):
+        scheduler = self.scheduler(admission_budget=60)
+        scheduler._service_seconds = 40.0
+        scheduler.acquire("interactive")
+
+        async def main():
+            # Position 1 waits ~40 s; position 2 would wait ~80 s
+            first = asyncio.ensure_future(scheduler.aacquire("interactive"))
+            await asyncio.sleep(0.01)
+            with self.assertRaises(OllamaBusy) as busy:
+                await scheduler.aacquire("interactive")
+            first.cancel()
+            return busy.exception
+
+        exception = asyncio.run(main())
+        self.assertEqual(exception.status, 503)
+        self.assertEqual(exception.retry_after, 80)
+
+    def test_full_queue_is_rejected(self, _print):
+        scheduler = self.scheduler(max_queue=1)
+        scheduler.acquire("interactive")
+
+        async def main():
+            first = asyncio.ensure_future(scheduler.aacquire("interactive"))
+            await asyncio.sleep(0.01)
+            with self.assertRaises(OllamaBusy) as busy:
+                await scheduler.aacquire("interactive")
+            first.cancel()
+            await asyncio.sleep(0.01)
+            return busy.exception
+
+        self.assertEqual(asyncio.run(main()).status, 429)
+        # The cancelled waiter gave up its place in line
+        self.assertEqual(scheduler.stats()["queued"], 0)
+
+    def test_queue_timeout_without_a_service_estimate(self, _print):
+        scheduler = self.scheduler(queue_timeout=0.05)
+        scheduler.acquire("interactive")
+        with self.assertRaises(OllamaBusy) as busy:
+            scheduler.acquire("interactive")
+        self.assertEqual(busy.exception.status, 503)
+        self.assertEqual(scheduler.stats()["lanes"]["interactive"]["rejected"]["timeout"], 1)
+
+    def test_batch_never_takes_the_last_slot(self, _print):
+        scheduler = self.scheduler(concurrency=2, batch_concurrency=1, queue_timeout=0.05)
+        scheduler.acquire("batch")
+        with self.assertRaises(OllamaBusy):
+            scheduler.acquire("batch")
+        scheduler.acquire("interactive")
+        self.assertEqual(scheduler.stats()["active"], 2)
+
+    def test_interactive_is_granted_before_batch(self, _print):
+        scheduler = self.scheduler()
+        order = []
+
+        async def wait(lane):
+            await scheduler.aacquire(lane)
+            order.append(lane)
+            scheduler._release(lane, None)
+
+        async def main():
+            scheduler.acquire("interactive")
+            batch = asyncio.ensure_future(wait("batch"))
+            await asyncio.sleep(0.01)
+            interactive = asyncio.ensure_future(wait("interactive"))
+            await asyncio.sleep(0.01)
+            scheduler._release("interactive", None)
+            await asyncio.gather(batch, interactive)
+
+        asyncio.run(main())
+        self.assertEqual(order, ["interactive", "batch"])
+
+
+ANSWER = "Summary:\nLow protein.\n\nCaregiver Action Steps:\n1. Add an egg.\n2. Add tofu.\n3. Offer water.\n"
+
+
+@mock.patch("builtins.print")
+class OutputGuardTests(SimpleTestCase):
+    def guard(self, holdback=8, **budget):
+        return OutputGuard(OutputBudget(**budget), "text", holdback=holdback)
+
+    def stream(self, guard, chunks):
+        streamed = "".join(guard.feed(chunk) for chunk in chunks) + guard.flush()
+        return streamed, guard.finish()
+
+    def test_strips_think_block_split_across_chunks(self, _print):
+        streamed, text = self.stream(self.guard(), ["<thi", "nk>plan the ", "answer</th", "ink>\n\nHello", " world"])
+        self.assertEqual(streamed, "Hello world")
+        self.assertEqual(text, "Hello world")
+
+    def test_prefilled_think_is_never_streamed(self, _print):
+        guard = self.guard()
+        self.assertEqual(guard.feed("I should "), "")
+        self.assertEqual(guard.feed("compare intakes."), "")
+        streamed, text = self.stream(guard, ["</think>", "\nHello", " world"])
+        self.assertEqual(streamed, "Hello world")
+        self.assertEqual(text, "Hello world")
+        self.assertEqual(guard.report()["kept_tokens"], 2)
+
+    def test_holdback_releases_text_without_tags(self, _print):
+        guard = self.guard(holdback=3)
+        self.assertEqual(guard.feed("a "), "")
+        self.assertEqual(guard.feed("b "), "")
+        self.assertEqual(guard.feed("c "), "a b c ")
+        # A stray closing tag after text went out is dropped, not a reset
+        streamed, text = self.stream(guard, ["d</think>", " e"])
+        self.assertEqual(streamed, "d e")
+        self.assertEqual(text, "a b c d e")
+
+    def test_streamed_text_matches_final_text(self, _print):
+        for holdback in (0, 2, 100):
+            guard = self.guard(holdback=holdback)
+            streamed, text = self.stream(guard, ["<think>x</think>", "Hi ", "the", "re<", "br>"])
+            self.assertEqual(streamed.strip(), text)
+            self.assertEqual(text, "Hi there<br>")
+
+    def test_stops_after_last_step(self, _print):
+        guard = self.guard(steps=3)
+        chunks = [line + "\n" for line in ANSWER.split("\n")] + ["Note: extra trailer\n"]
+        streamed, text = self.stream(guard, chunks)
+        self.assertEqual(guard.stopped, "sections_complete")
+        self.assertTrue(text.endswith("3. Offer water."))
+        self.assertNotIn("Note", streamed)
+
+    def test_answer_budget(self, _print):
+        guard = self.guard(answer_tokens=3)
+        streamed, text = self.stream(guard, ["a ", "b ", "c ", "d "])
+        self.assertEqual(guard.stopped, "answer_budget")
+        self.assertEqual(text, "a b c")
+
+    def test_early_stop_off_keeps_everything(self, _print):
+        guard = self.guard(answer_tokens=1, early_stop=False)
+        self.assertEqual(self.stream(guard, ["a ", "b"])[1], "a b")
+        self.assertIsNone(guard.stopped)
+
+    def test_options(self, _print):
+        self.assertEqual(OutputBudget(num_predict=10, stop=["\n\nNote:"]).options(),
+                         {"num_predict": 10, "stop": ["\n\nNote:"]})
+        self.assertEqual(OutputBudget(num_predict=0, stop=None).options(), {})
+
+    def test_consumers_close_the_stream(self, _print):
+        closed = []
+
+        def chunks():
+            try:
+                yield from ["<think>r</think>", "a ", "b ", "c ", "d "]
+            finally:
+                closed.append(True)
+
+        budget = OutputBudget(answer_tokens=2)
+        self.assertEqual(consume(chunks(), budget=budget), "a b")
+        self.assertEqual("".join(guarded_stream(chunks(), budget=budget)), "a b ")
+        self.assertEqual(closed, [True, True])
+
+
+@mock.patch("builtins.print")
+@mock.patch("ollama_llm.residency.OLLAMA_COLD_LOAD_MS", 50)
+class ResidencyTests(SimpleTestCase):
+    def setUp(self):
+        self.server = MockOllamaServer(("127.0.0.1", 0), MockConfig(load_seconds=0.1, embed_dim=4))
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        client = OllamaClient(base_url=f"http://127.0.0.1:{self.server.server_address[1]}")
+        self.stats = ColdStartStats()
+        for target, value in (("ollama_llm.client.ollama", client), ("ollama_llm.residency.cold_starts", self.stats)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.manager = ResidencyManager([("chat", "generate"), ("embed", "embed")], interval=60)
+
+    def test_observe_splits_cold_and_warm(self, _print):
+        self.assertTrue(self.stats.observe("m", 80, 900))
+        self.assertFalse(self.stats.observe("m", 1, 100))
+        latency = self.stats.as_dict()["latency"]["m"]
+        self.assertEqual((latency["cold"], latency["warm"]), (1, 1))
+        self.assertEqual(latency["cold_ms"]["max"], 900)
+        self.assertEqual(self.stats.as_dict()["recent_cold_starts"][0]["model"], "m")
+
+    def test_observe_response_uses_nanosecond_durations(self, _print):
+        self.stats.observe_response("m", {"load_duration": 2e8, "total_duration": 3e8})
+        self.assertEqual(self.stats.as_dict()["latency"]["m"]["cold"], 1)
+        # Stream chunks without durations only mark the model as used
+        self.stats.observe_response("other", {"response": "x"})
+        self.assertLess(self.stats.idle_seconds("other"), 1)
+        self.assertNotIn("other", self.stats.as_dict()["latency"])
+
+    def test_warm_loads_every_model_once(self, _print):
+        loads = self.manager.warm()
+        self.assertEqual(set(loads), {"chat", "embed"})
+        self.assertEqual(sorted(self.server.loaded), ["chat", "embed"])
+        self.assertEqual(self.server.stats.as_dict()["cold_loads"], 2)
+        self.assertEqual(self.stats.as_dict()["latency"]["chat"]["cold"], 1)
+
+    def test_ping_skips_recently_used_models(self, _print):
+        self.manager.warm()
+        self.assertEqual(self.manager.ping(), {})
+        with mock.patch.object(self.stats, "idle_seconds", return_value=120):
+            pinged = self.manager.ping()
+        self.assertEqual(set(pinged), {"chat", "embed"})
+        # Still resident: the pings were warm
+        self.assertEqual(self.server.stats.as_dict()["cold_loads"], 2)
+        self.assertEqual(self.manager.stats()["loads"], {"chat": 2, "embed": 2})
+
+    def test_failed_load_is_counted(self, _print):
+        self.server.config.fail_rate = 1.0
+        with mock.patch("ollama_llm.client.OLLAMA_RETRY_BACKOFF", 0):
+            self.assertEqual(self.manager.warm(), {"chat": None, "embed": None})
+        self.assertEqual(self.manager.stats()["failures"], {"chat": 1, "embed": 1})
+
+
+class MockOllamaTests(SimpleTestCase):
+    def serve(self, **config):
+        options = {"latency": 0, "token_rate": 0, "embed_latency": 0, "embed_dim": 8, "seed": 1}
+        options.update(config)
+        server = MockOllamaServer(("127.0.0.1", 0), MockConfig(**options))
+        threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+    def test_answers_in_the_caregiver_layout(self):
+        server, url = self.serve()
+        client = OllamaClient(base_url=url)
+        self.assertEqual(client.generate_text("Review the patient information"), MOCK_ANSWER.strip())
+        self.assertEqual("".join(client.stream_text("Answer in Traditional Chinese")), MOCK_ANSWER_TR_CN)
+        self.assertEqual(server.stats.as_dict()["completed"], 1)
+
+    def test_numbered_translation_reply(self):
+        _, url = self.serve()
+        reply = OllamaClient(base_url=url).generate_text("Translate each numbered line below\n1. Eat.\n2. Drink.")
+        self.assertEqual(reply, "1. 譯：Eat.\n2. 譯：Drink.")
+
+    def test_num_predict_and_stop_limit_the_answer(self):
+        _, url = self.serve()
+        client = OllamaClient(base_url=url)
+        self.assertEqual(len("".join(client.stream_text("q", options={"num_predict": 3})).split()), 3)
+        text = client.generate_text("q", options={"stop": ["Key Health"]})
+        self.assertTrue(text.startswith("Summary:"))
+        self.assertNotIn("Key Health", text)
+
+    def test_think_block(self):
+        _, url = self.serve(think_tokens=5)
+        text = OllamaClient(base_url=url).generate_text("q")
+        self.assertTrue(text.startswith("<think>"))
+        self.assertIn("</think>\n\nSummary:", text)
+
+    def test_chat(self):
+        _, url = self.serve()
+        data = requests.post(f"{url}/api/chat", json={"model": "m", "stream": False,
+                                                      "messages": [{"role": "user", "content": "q"}]}).json()
+        self.assertEqual(data["message"]["content"], MOCK_ANSWER)
+
+    def test_embeddings_are_deterministic_unit_vectors(self):
+        _, url = self.serve()
+        vectors = OllamaClient(base_url=url).embed(["a", "b", "a"])
+        self.assertEqual(vectors[0], vectors[2])
+        self.assertNotEqual(vectors[0], vectors[1])
+        self.assertAlmostEqual(math.fsum(x * x for x in vectors[1]), 1.0, places=5)
+        self.assertEqual(vectors[1], mock_embedding("b", 8))
+
+    def test_keep_alive_load_and_unload(self):
+        server, url = self.serve()
+        client = OllamaClient(base_url=url)
+        client.load_model("m")
+        self.assertEqual(requests.get(f"{url}/api/tags").json(), {"models": [{"name": "m"}]})
+        client.load_model("m", keep_alive=0)
+        self.assertEqual(server.loaded, [])
+
+    def test_injected_failures(self):
+        server, url = self.serve(fail_rate=1.0, fail_status=503)
+        response = requests.post(f"{url}/api/generate", json={"model": "m", "prompt": "q", "stream": False})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(server.stats.as_dict()["failed"], 1)
+
+    def test_dropped_stream(self):
+        server, url = self.serve(drop_rate=1.0)
+        with self.assertRaises(OllamaError):
+            list(OllamaClient(base_url=url).stream_text("q"))
+        self.assertEqual(server.stats.as_dict()["dropped"], 1)
@@ -1,8 +1,9 @@
 from django.urls import path
-from .views import GetOllamaLLMResponseView
+from .views import GetOllamaLLMResponseView, OllamaStatusView
 
 urlpatterns = [
     path("prompt/", GetOllamaLLMResponseView.as_view()),
+    path("status/", OllamaStatusView.as_view()),
 ]
 
 
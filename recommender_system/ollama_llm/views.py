@@ -1,49 +1,42 @@
 from django.shortcuts import render
-
 from rest_framework.views import APIView
 from rest_framework.response import Response
-import requests
+
+from recommender_system.async_views import AsyncAPIView, ParseError, json_response, request_data
+from .client import OllamaError, async_ollama, client_stats
 
 # Load local LLM model from Ollama server
-# LLM Model: deepseek-r1:8b
-OLLAMA_URL = "http://localhost:11434/api/generate"
+# Model, URL and timeouts: ollama_llm.client (OLLAMA_MODEL, OLLAMA_BASE_URL, OLLAMA_TIMEOUT)
 
 
-class GetOllamaLLMResponseView(APIView):
-    def post(self, request):
-        prompt = request.data.get("prompt")
+class GetOllamaLLMResponseView(AsyncAPIView):
+    async def post(self, request):
+        try:
+            data = request_data(request)
+        except ParseError as e:
+            return json_response({"error": str(e)}, status=400)
+        prompt = data.get("prompt") if isinstance(data, dict) else None
 
         if not prompt:
-            return Response(
+            return json_response(
                 {"error": "Prompt is required."},
                 status=400
             )
 
-        payload = {
-            "model": "deepseek-r1:8b",
-            "prompt": prompt,
-            "stream": False
-        }
-
         try:
-            ollama_response = requests.post(
-                OLLAMA_URL,
-                json=payload,
-                timeout=30
-            )
-            ollama_response.raise_for_status()
-
-            data = ollama_response.json()
+            data = await async_ollama.generate(prompt)
             llm_output = data.get("response", "")
 
-            return Response({"response": llm_output})
+            return json_response({"response": llm_output})
 
-        except requests.exceptions.RequestException as e:
-            return Response(
+        except OllamaError as e:
+            return json_response(
                 {"error": str(e)},
                 status=500
             )
-        
 
 
-        
+# Scheduler queue depth / wait times and client counters
+class OllamaStatusView(APIView):
+    def get(self, request):
+        return Response(client_stats())
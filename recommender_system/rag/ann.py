@@ -0,0 +1,71 @@
+# Approximate-nearest-neighbour index builders for the DRI vector store.
+import json
+import os
+
+import faiss
+import numpy as np
+
+
+INDEX_TYPES = ("flat", "ivf-flat", "hnsw", "ivf-pq")
+
+# Search-time parameters saved next to index.faiss, applied on load
+SEARCH_PARAMS_FILE = "index_params.json"
+
+
+def build_ann_index(vectors, index_type, metric=faiss.METRIC_L2, nlist=256, hnsw_m=32,
+                    ef_construction=200, pq_m=16, pq_bits=8, train_size=None):
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+
+    if index_type == "flat":
+        index = faiss.IndexFlat(dim, metric)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+    elif index_type in ("ivf-flat", "ivf-pq"):
+        # faiss wants ~39 training points per centroid
+        nlist = max(1, min(nlist, count // 39 or 1))
+        quantizer = faiss.IndexFlat(dim, metric)
+        if index_type == "ivf-flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, metric)
+        else:
+            if dim % pq_m:
+                raise ValueError(f"pq_m={pq_m} must divide the embedding dimension {dim}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits, metric)
+    else:
+        raise ValueError(f"Unknown index type {index_type!r}; choose from {', '.join(INDEX_TYPES)}")
+
+    if not index.is_trained:
+        sample = vectors
+        if train_size and train_size < count:
+            rows = np.random.default_rng(0).choice(count, train_size, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(sample)
+
+    index.add(vectors)
+    return index
+
+
+def apply_search_params(index, params):
+    """`params` like "nprobe=16,efSearch=64"; unknown names for the index type raise."""
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+    return index
+
+
+def read_search_params(db_path):
+    path = os.path.join(db_path, SEARCH_PARAMS_FILE)
+    if not os.path.exists(path):
+        return ""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("search_params", "")
+
+
+def write_search_params(db_path, index_type, build_params, search_params):
+    with open(os.path.join(db_path, SEARCH_PARAMS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"index_type": index_type, "build_params": build_params, "search_params": search_params}, f, indent=2)
+
+
+def index_memory_bytes(index):
+    # Serialized size tracks the resident footprint of codes, lists and graph links
+    return int(faiss.serialize_index(index).nbytes)
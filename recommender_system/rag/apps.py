@@ -1,6 +1,18 @@
+import os
+
 from django.apps import AppConfig
 
 
 class RagConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag'
+
+    def ready(self):
+        # Opt-in warmup so migrate/test runs never touch the index or Ollama
+        if os.environ.get("RAG_WARMUP") == "1":
+            from ollama_llm.residency import residency
+            from .provider import provider
+
+            provider.warmup_in_background()
+            # Load both Ollama models now and keep them loaded between requests
+            residency.start()
@@ -0,0 +1,146 @@
+# Micro-batching for the per-request query path.
+#
+# Under concurrent load every request embeds its own query (one Ollama
+# /api/embed call each) and runs its own FAISS search. MicroBatcher collects
+# the items submitted from request threads within a short window (or until
+# max_batch items), hands them to one batched call, and fans the results
+# back out to the waiting callers. While all batch slots are busy, new items
+# keep queueing, so batches grow with the load instead of calls piling up.
+#
+# Callers block on submit(), so it is meant for worker threads (sync views,
+# asyncio.to_thread), never for an event loop thread. Kept free of Django
+# imports.
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# RAG_QUERY_BATCH=1 batches query embedding and dense search across requests
+QUERY_BATCH = os.environ.get("RAG_QUERY_BATCH", "0") == "1"
+QUERY_BATCH_WINDOW_MS = float(os.environ.get("RAG_QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_MAX = int(os.environ.get("RAG_QUERY_BATCH_MAX", "16"))
+# Batches in flight at once (embed calls to Ollama)
+QUERY_BATCH_CONCURRENCY = int(os.environ.get("RAG_QUERY_BATCH_CONCURRENCY", "2"))
+
+
+class MicroBatcher:
+    """submit(item) -> fn([items])[i], with items from concurrent callers sharing one fn call."""
+
+    def __init__(self, fn, max_batch=QUERY_BATCH_MAX, window_ms=QUERY_BATCH_WINDOW_MS,
+                 concurrency=QUERY_BATCH_CONCURRENCY, name="batcher"):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.window = max(0.0, window_ms) / 1000
+        self.concurrency = max(1, concurrency)
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._pid = None   # the collector thread does not survive a fork
+        self._queue = None
+        _batchers.add(self)
+
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.wait_seconds = 0.0    # submit -> batch call started
+        self.call_seconds = 0.0
+        self.failures = 0
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._slots = threading.Semaphore(self.concurrency)
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=self.name)
+            threading.Thread(target=self._collect, name=f"{self.name}-collector", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _after_fork(self):
+        # Forked child: the lock may have been held by a parent thread that is
+        # gone, and the queued items belong to callers that are gone too
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def submit(self, item):
+        if self._pid != os.getpid():
+            self._start()
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result()
+
+    # ======= COLLECTOR =======
+    def _collect(self):
+        while True:
+            # Wait for a free slot first: items arriving meanwhile join the next batch
+            self._slots.acquire()
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.perf_counter()
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        started = time.perf_counter()
+        try:
+            results = self.fn([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name}: {len(results)} results for {len(batch)} items")
+        except BaseException as e:
+            with self._lock:
+                self.failures += 1
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+            finished = time.perf_counter()
+            with self._lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+                self.wait_seconds += sum(started - submitted for _, _, submitted in batch)
+                self.call_seconds += finished - started
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                # Time an item waited for its batch: the latency batching adds
+                "avg_wait_ms": round(self.wait_seconds / self.items * 1000, 3) if self.items else 0.0,
+                "avg_call_ms": round(self.call_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+                "failures": self.failures,
+            }
+
+
+_batchers = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for batcher in list(_batchers):
+        batcher._after_fork()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def query_batcher_from_env(engine):
+    """Batches engine.search_with_scores() calls, or None when RAG_QUERY_BATCH is off."""
+    if not QUERY_BATCH:
+        return None
+    return MicroBatcher(engine.search_with_scores_many, name="query-batch")
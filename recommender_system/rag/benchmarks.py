@@ -0,0 +1,97 @@
+# Helpers shared by the rag bench_* management commands.
+# Worker functions live here (not in the commands) so spawned processes can import them.
+import os
+import time
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def memory_status():
+    # Linux only: RSS split into anonymous/file-backed pages, plus PSS, which
+    # divides shared pages between the processes mapping them
+    status = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "RssAnon", "RssFile"):
+                status[key] = int(value.split()[0]) / 1024
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    status["Pss"] = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return status
+
+
+def shared_index_worker(db_path, mmap, searches, barrier, results):
+    import numpy as np
+    from rag.provider import read_faiss_index, read_vectors
+
+    before = memory_status()
+    start = time.perf_counter()
+    index = read_faiss_index(db_path, mmap=mmap)
+    vectors = read_vectors(db_path, mmap=mmap)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    # A flat search touches every page of the index, like steady-state traffic would
+    queries = np.random.default_rng(os.getpid()).standard_normal((searches, index.d)).astype("float32")
+    index.search(queries, 10)
+    if vectors is not None:
+        float(np.asarray(vectors[:: max(1, len(vectors) // 256)]).sum())
+
+    # Measure while every worker is alive so shared pages are split between them
+    barrier.wait()
+    after = memory_status()
+    results.put({"pid": os.getpid(), "load_ms": load_ms, "before": before, "after": after})
+    barrier.wait()
+
+
+def docstore_load_worker(db_path, mode, lookups, results):
+    import pickle
+    import random
+
+    # Import the libraries both formats need first, so only the data is measured
+    import langchain_community.docstore.in_memory  # noqa: F401
+    import rag.docstore  # noqa: F401
+
+    before = memory_status()
+    start = time.perf_counter()
+    if mode == "pickle":
+        with open(os.path.join(db_path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+    else:
+        from rag.docstore import ColumnarDocstore
+
+        docstore = ColumnarDocstore(db_path)
+        index_to_docstore_id = docstore.index_to_docstore_id()
+    load_ms = (time.perf_counter() - start) * 1000
+    after = memory_status()
+
+    # MMR hands back k=10 chunks per query
+    ids = [index_to_docstore_id[position] for position in range(len(index_to_docstore_id))]
+    rng = random.Random(0)
+    timings = []
+    for _ in range(lookups):
+        batch = rng.sample(ids, min(10, len(ids)))
+        start = time.perf_counter()
+        for doc_id in batch:
+            docstore.search(doc_id).page_content
+        timings.append((time.perf_counter() - start) * 1000)
+
+    results.put({
+        "mode": mode,
+        "load_ms": load_ms,
+        "rss_mb": after["VmRSS"] - before["VmRSS"],
+        "lookup_p50_ms": percentile(timings, 50),
+        "lookup_p99_ms": percentile(timings, 99),
+    })
@@ -0,0 +1,128 @@
+# English + Traditional Chinese answers from one RAG generation, pipelined.
+#
+# The English answer is streamed and cut into its four sections as they
+# complete; each finished section is translated in its own task while the
+# model is still writing the next one. Only the last section's translation
+# runs after the English generation, so the wall-clock time approaches the
+# English generation time instead of English + whole-text translation.
+#
+# The English stream holds the request's slot; every translation call takes
+# its own slot in the batch lane, so the scheduler counts each generation on
+# Ollama and translations never starve interactive requests. With a single
+# slot (OLLAMA_MAX_CONCURRENCY=1) a translation could only queue behind the
+# English stream until OLLAMA_QUEUE_TIMEOUT, so the sections are held and
+# translated once the stream has released it.
+import asyncio
+import os
+import re
+import time
+
+from ollama_llm.output import aguarded_stream
+from ollama_llm.scheduler import own_slot, scheduler, use_lane
+from .services import (
+    RAG_PROMPT_TEMPLATE, _cache_version, astream_answer, atranslate_text_with_ollama, rag_prompt, response_cache,
+)
+
+
+SECTIONS = ("Summary", "Key Health Concerns", "Dietary Issues Observed", "Caregiver Action Steps")
+# Section translations waiting for or holding a batch slot per request; they overlap the
+# English generation only when the scheduler has a batch slot free (OLLAMA_MAX_CONCURRENCY > 1)
+BILINGUAL_CONCURRENCY = int(os.environ.get("RAG_BILINGUAL_CONCURRENCY", "2"))
+
+# "Summary:", "**Key Health Concerns:**", "## Caregiver Action Steps"
+_HEADER = re.compile(
+    r"^[ \t]*(?:#+[ \t]*)?\**[ \t]*(" + "|".join(re.escape(name) for name in SECTIONS) + r")[ \t]*\**[ \t]*[:：]?[ \t]*\**[ \t]*$",
+    re.IGNORECASE,
+)
+
+
+class SectionSplitter:
+    """Incremental: feed() text chunks, get back the sections completed so far."""
+
+    def __init__(self):
+        self.text = ""
+        self._line = ""       # current, not yet terminated line
+        self._section = ""    # lines of the section being written
+
+    def feed(self, chunk):
+        done = []
+        self.text += chunk
+        self._line += chunk
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            # A new heading completes the previous section
+            if _HEADER.match(line) and self._section.strip():
+                done.append(self._section.strip())
+                self._section = ""
+            self._section += line + "\n"
+        return done
+
+    def finish(self):
+        last = (self._section + self._line).strip()
+        self._section = self._line = ""
+        return [last] if last else []
+
+
+async def agenerate_bilingual(question, semantic=False):
+    """{"en": ..., "tr-cn": ..., "timings": {...}}; a full scheduler queue raises OllamaBusy."""
+    started = time.perf_counter()
+    await asyncio.to_thread(response_cache.ensure_version, _cache_version())
+    cached = await asyncio.to_thread(response_cache.get, question, "bilingual", semantic)
+    if cached is not None:
+        return dict(cached, timings={"cached": True, "total_ms": round((time.perf_counter() - started) * 1000, 1)})
+
+    limit = asyncio.Semaphore(BILINGUAL_CONCURRENCY)
+    section_ms = []
+
+    async def translate(section):
+        async with limit:
+            start = time.perf_counter()
+            try:
+                # Not the English stream's slot: each translation call is admitted on its own
+                with own_slot(), use_lane("batch"):
+                    return await atranslate_text_with_ollama(section)
+            finally:
+                section_ms.append((time.perf_counter() - start) * 1000)
+
+    splitter = SectionSplitter()
+    overlap = scheduler.concurrency > 1
+    held = []   # sections waiting for the English stream's slot
+    tasks = []
+    try:
+        async with scheduler.aslot():
+            prompt = await asyncio.to_thread(rag_prompt, question, RAG_PROMPT_TEMPLATE)
+            async for chunk in aguarded_stream(astream_answer(prompt, "answer"), "answer"):
+                for section in splitter.feed(chunk):
+                    if overlap:
+                        tasks.append(asyncio.create_task(translate(section)))
+                    else:
+                        held.append(section)
+        # Released before waiting, so queued translations can use this slot
+        for section in held + splitter.finish():
+            tasks.append(asyncio.create_task(translate(section)))
+        english_done = time.perf_counter()
+        translated = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    # splitter.text is the guarded answer: reasoning dropped, cut after the last step
+    result = {"en": splitter.text.strip(), "tr-cn": "\n\n".join(part.strip() for part in translated)}
+    await asyncio.to_thread(response_cache.set, question, result, "bilingual", semantic)
+
+    finished = time.perf_counter()
+    timings = {
+        "cached": False,
+        "sections": len(tasks),
+        "english_ms": round((english_done - started) * 1000, 1),
+        # Translation time left after the English answer was complete
+        "tail_ms": round((finished - english_done) * 1000, 1),
+        "total_ms": round((finished - started) * 1000, 1),
+        # English first, then every section one after the other
+        "sequential_ms": round((english_done - started) * 1000 + sum(section_ms), 1),
+    }
+    print(f"[INFO] Bilingual answer: {timings['sections']} sections, english {timings['english_ms']} ms, "
+          f"total {timings['total_ms']} ms (sequential {timings['sequential_ms']} ms)")
+    return dict(result, timings=timings)
+
@@ -0,0 +1,217 @@
+# Response cache for the RAG chain.
+# Kept free of Django imports so start_server.py can use it too.
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_question(question: str) -> str:
+    # Case and whitespace differences should not cause a cache miss
+    return re.sub(r"\s+", " ", str(question)).strip().lower()
+
+
+def corpus_fingerprint(db_path: str) -> str:
+    # Changes whenever the vector store files on disk are replaced
+    parts = []
+    if os.path.isdir(db_path):
+        for name in sorted(os.listdir(db_path)):
+            stat = os.stat(os.path.join(db_path, name))
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def prompt_fingerprint(*templates) -> str:
+    text = "\n".join(str(template) for template in templates)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size", "namespace", "vector")
+
+    def __init__(self, value, expires_at, size, namespace, vector):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+        self.namespace = namespace
+        self.vector = vector
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of final LLM responses keyed on the normalized question.
+
+    If `embed_fn` and `similarity_threshold` are given, a lookup made with
+    semantic=True falls back, on an exact-key miss, to the most similar
+    question in the same namespace that was also stored with semantic=True
+    (cosine similarity >= threshold). Only free-text questions should opt in:
+    two patients' generated queries differ in a few numbers and embed almost
+    identically, so a similarity hit would hand one patient's recommendation
+    to another.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024, ttl_seconds=3600,
+                 embed_fn=None, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = ""
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def semantic_enabled(self):
+        return self.embed_fn is not None and self.similarity_threshold is not None
+
+    def make_key(self, question, namespace=""):
+        raw = f"{namespace}\x00{normalize_question(question)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # ======= LOOKUP =======
+    def get(self, question, namespace="", semantic=False):
+        key = self.make_key(question, namespace)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at <= now:
+                    self._remove(key)
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry.value
+
+            if not (semantic and self.semantic_enabled):
+                self.misses += 1
+                return None
+
+        # Embedding happens outside the lock; it is a network call
+        vector = self._embed(question)
+
+        with self._lock:
+            match = self._nearest(vector, namespace, now)
+            if match is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(match)
+            self.semantic_hits += 1
+            return self._entries[match].value
+
+    def set(self, question, value, namespace="", semantic=False):
+        size = len(value.encode("utf-8")) if isinstance(value, str) else len(repr(value))
+        if size > self.max_bytes:
+            return
+
+        # Entries without a vector are only ever returned for their exact key
+        vector = self._embed(question) if semantic and self.semantic_enabled else None
+        key = self.make_key(question, namespace)
+        expires_at = time.monotonic() + self.ttl_seconds
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, expires_at, size, namespace, vector)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    # ======= INVALIDATION =======
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def ensure_version(self, version):
+        # Drop everything once the corpus or prompt the answers came from changes
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            had_version = bool(self._version)
+            self._version = version
+            self._entries.clear()
+            self._bytes = 0
+            if had_version:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "semantic_enabled": self.semantic_enabled,
+                "similarity_threshold": self.similarity_threshold,
+            }
+
+    # ======= HELPERS =======
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def _embed(self, question):
+        try:
+            vector = np.asarray(self.embed_fn(normalize_question(question)), dtype=np.float32)
+        except Exception as e:
+            print(f"Response cache embedding failed: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _nearest(self, vector, namespace, now):
+        if vector is None:
+            return None
+
+        keys, vectors = [], []
+        for key, entry in self._entries.items():
+            if entry.namespace == namespace and entry.vector is not None and entry.expires_at > now:
+                keys.append(key)
+                vectors.append(entry.vector)
+        if not keys:
+            return None
+
+        scores = np.stack(vectors) @ vector
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity_threshold else None
+
+
+def cache_from_env(embed_fn=None):
+    # RAG_CACHE_SIMILARITY enables embedding-similarity hits for free-text
+    # questions (off by default; keep it strict, e.g. 0.99)
+    threshold = os.environ.get("RAG_CACHE_SIMILARITY")
+    return ResponseCache(
+        max_entries=int(os.environ.get("RAG_CACHE_MAX_ENTRIES", "256")),
+        max_bytes=int(os.environ.get("RAG_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+        ttl_seconds=float(os.environ.get("RAG_CACHE_TTL", "3600")),
+        embed_fn=embed_fn if threshold else None,
+        similarity_threshold=float(threshold) if threshold else None,
+    )
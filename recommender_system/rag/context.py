@@ -0,0 +1,168 @@
+# Token-budgeted context assembly for the RAG prompt.
+#
+# Replaces joining all k retrieved chunks: chunks are taken best-first, the
+# overlap between neighbouring splitter chunks is cut, near-duplicates are
+# dropped, the low-score tail is trimmed relative to the score distribution,
+# and assembly stops at a token budget. Kept Django-free for start_server.py.
+import os
+import re
+import threading
+
+import numpy as np
+
+from .sparse import tokenize
+
+
+# Latin words / numbers, single CJK ideographs, other non-space symbols
+_TOKEN_ESTIMATE_RE = re.compile(r"[A-Za-z]+|[0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]|[^\sA-Za-z0-9]")
+
+# Overlaps shorter than this are left alone (splitter overlap is ~200 chars)
+MIN_OVERLAP_CHARS = 40
+
+
+def estimate_tokens(text):
+    # No tokenizer for the Ollama models is available here. Long English words
+    # split into ~1.3 subword tokens, CJK characters and symbols into ~1.
+    total = 0.0
+    for piece in _TOKEN_ESTIMATE_RE.findall(text):
+        total += 1.3 if len(piece) > 4 and piece.isalpha() else 1.0
+    return int(round(total))
+
+
+def _shingles(text, size=3):
+    tokens = tokenize(text)
+    if len(tokens) < size:
+        return set(tokens)
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def _overlap(left, right):
+    """Length of the longest suffix of `left` that is a prefix of `right`."""
+    probe = right[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = left.find(probe, max(0, len(left) - len(right)))
+    while start != -1:
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start = left.find(probe, start + 1)
+    return 0
+
+
+class ContextAssembler:
+    def __init__(self, max_tokens=1200, min_chunks=2, tail_std=0.5, duplicate_threshold=0.8,
+                 separator="\n\n"):
+        self.max_tokens = max_tokens
+        self.min_chunks = min_chunks
+        self.tail_std = tail_std
+        self.duplicate_threshold = duplicate_threshold
+        self.separator = separator
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.last = {}
+
+    def fingerprint(self):
+        # Part of the response cache version: different settings, different prompts
+        return f"context:{self.max_tokens}:{self.min_chunks}:{self.tail_std}:{self.duplicate_threshold}"
+
+    # ======= ASSEMBLY =======
+    def assemble(self, scored_docs):
+        """`scored_docs` is [(Document, score or None)] best first; returns (context, report)."""
+        texts = [doc.page_content for doc, _ in scored_docs]
+        tokens_in = estimate_tokens(self.separator.join(texts))
+
+        keep = self._trim_tail([score for _, score in scored_docs])
+
+        chosen, chosen_shingles = [], []
+        dropped = {"tail": len(texts) - keep, "duplicate": 0, "budget": 0}
+        used = 0
+        for text in texts[:keep]:
+            text = self._strip_overlap(text, chosen)
+            shingles = _shingles(text)
+            if not shingles or self._is_duplicate(shingles, chosen_shingles):
+                dropped["duplicate"] += 1
+                continue
+
+            cost = estimate_tokens(text) + (1 if chosen else 0)
+            if used + cost > self.max_tokens and chosen:
+                # A smaller chunk further down may still fit
+                dropped["budget"] += 1
+                continue
+            chosen.append(text)
+            chosen_shingles.append(shingles)
+            used += cost
+
+        context = self.separator.join(chosen)
+        tokens_out = estimate_tokens(context)
+        report = {
+            "chunks_in": len(texts),
+            "chunks_out": len(chosen),
+            "dropped": dropped,
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "tokens_saved": tokens_in - tokens_out,
+        }
+
+        with self._lock:
+            self.requests += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+            self.last = report
+        return context, report
+
+    def _trim_tail(self, scores):
+        # Keep chunks scoring above mean - tail_std * std of this result list,
+        # so a flat distribution keeps everything and a steep one keeps the head
+        if self.tail_std is None or len(scores) <= self.min_chunks or any(s is None for s in scores):
+            return len(scores)
+        values = np.asarray(scores, dtype=np.float64)
+        cutoff = values.mean() - self.tail_std * values.std()
+        keep = int(np.count_nonzero(values >= cutoff))
+        return max(keep, self.min_chunks)
+
+    def _strip_overlap(self, text, chosen):
+        # Consecutive splitter chunks repeat ~chunk_overlap characters at the seam
+        for previous in chosen:
+            overlap = _overlap(previous, text)
+            if overlap:
+                text = text[overlap:].lstrip()
+            overlap = _overlap(text, previous)
+            if overlap:
+                text = text[:-overlap].rstrip()
+        return text
+
+    def _is_duplicate(self, shingles, chosen_shingles):
+        for other in chosen_shingles:
+            # Containment rather than Jaccard: a chunk mostly inside a kept one adds nothing
+            if len(shingles & other) / min(len(shingles), len(other)) >= self.duplicate_threshold:
+                return True
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_tokens": self.max_tokens,
+                "requests": self.requests,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+                "tokens_saved": self.tokens_in - self.tokens_out,
+                "avg_tokens_saved": round((self.tokens_in - self.tokens_out) / self.requests, 1) if self.requests else 0.0,
+                "last": dict(self.last),
+            }
+
+
+def context_assembler_from_env():
+    # RAG_CONTEXT_TOKENS=0 restores plain concatenation of all k chunks
+    max_tokens = int(os.environ.get("RAG_CONTEXT_TOKENS", "1200"))
+    if max_tokens <= 0:
+        return None
+    tail_std = os.environ.get("RAG_CONTEXT_TAIL_STD", "0.5")
+    return ContextAssembler(
+        max_tokens=max_tokens,
+        min_chunks=int(os.environ.get("RAG_CONTEXT_MIN_CHUNKS", "2")),
+        tail_std=float(tail_std) if tail_std else None,
+        duplicate_threshold=float(os.environ.get("RAG_CONTEXT_DUPLICATE", "0.8")),
+    )
@@ -0,0 +1,191 @@
+# Pickle-free, lazily read docstore for the FAISS vector store.
+#
+# Layout inside the vector store directory:
+#   docstore.json         {"format": 1, "count": n}
+#   docstore.ids.npy      fixed-width bytes (n,): docstore ids in FAISS index order
+#   docstore.offsets.npy  int64 (n, 4): text_start, text_len, metadata_start, metadata_len
+#   docstore.blob         utf-8 chunk text and JSON metadata, back to back
+#
+# Everything is memory-mapped; nothing per chunk is materialised at load time.
+# The FAISS wrapper is handed index positions as docstore ids, so a search
+# turns straight into a slice of the blob without any id -> row dictionary.
+import json
+import mmap
+import os
+from collections.abc import Mapping
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+
+HEADER_FILE = "docstore.json"
+IDS_FILE = "docstore.ids.npy"
+OFFSETS_FILE = "docstore.offsets.npy"
+BLOB_FILE = "docstore.blob"
+FORMAT_VERSION = 1
+
+
+def has_columnar_docstore(db_path):
+    return os.path.exists(os.path.join(db_path, HEADER_FILE))
+
+
+def encode_document(doc):
+    text = doc.page_content.encode("utf-8")
+    metadata = json.dumps(doc.metadata or {}, ensure_ascii=False, default=str).encode("utf-8")
+    return text, metadata
+
+
+def write_columnar_docstore(db_path, items):
+    """`items` yields (docstore_id, Document) in FAISS index order."""
+    return write_raw_docstore(db_path, ((doc_id, *encode_document(doc)) for doc_id, doc in items))
+
+
+def write_raw_docstore(db_path, items):
+    """`items` yields (docstore_id, text_bytes, metadata_bytes) in FAISS index order."""
+    count, renames = stage_raw_docstore(db_path, items)
+    for tmp_path, path in renames:
+        os.replace(tmp_path, path)
+    return count
+
+
+def stage_raw_docstore(db_path, items):
+    """
+    Writes the docstore files under temporary names and returns
+    (count, [(tmp_path, path), ...]); the caller os.replace()s them in that
+    order, together with whatever else has to change at the same time.
+    """
+    ids = []
+    offsets = []
+    position = 0
+
+    blob_path = os.path.join(db_path, BLOB_FILE)
+    with open(blob_path + ".tmp", "wb") as blob:
+        for doc_id, text, metadata in items:
+            blob.write(text)
+            blob.write(metadata)
+            offsets.append((position, len(text), position + len(text), len(metadata)))
+            position += len(text) + len(metadata)
+            ids.append(str(doc_id))
+
+    ids_path = os.path.join(db_path, IDS_FILE)
+    np.save(ids_path + ".tmp.npy", np.asarray([doc_id.encode("utf-8") for doc_id in ids], dtype=np.bytes_))
+
+    offsets_path = os.path.join(db_path, OFFSETS_FILE)
+    np.save(offsets_path + ".tmp.npy", np.asarray(offsets, dtype=np.int64).reshape(-1, 4))
+
+    header_path = os.path.join(db_path, HEADER_FILE)
+    with open(header_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"format": FORMAT_VERSION, "count": len(ids)}, f)
+
+    # The header goes last: readers only trust the files once it is in place
+    return len(ids), [
+        (blob_path + ".tmp", blob_path),
+        (ids_path + ".tmp.npy", ids_path),
+        (offsets_path + ".tmp.npy", offsets_path),
+        (header_path + ".tmp", header_path),
+    ]
+
+
+class PositionIds(Mapping):
+    """index_to_docstore_id stand-in: index position i maps to docstore key i."""
+
+    def __init__(self, count):
+        self.count = count
+
+    def __getitem__(self, position):
+        position = int(position)
+        if not 0 <= position < self.count:
+            raise KeyError(position)
+        return position
+
+    def __iter__(self):
+        return iter(range(self.count))
+
+    def __len__(self):
+        return self.count
+
+
+class ColumnarDocstore(Docstore):
+    """Read-only docstore backed by the files written by write_columnar_docstore."""
+
+    def __init__(self, db_path):
+        with open(os.path.join(db_path, HEADER_FILE), encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported docstore format: {header.get('format')}")
+
+        self.count = header["count"]
+        self._ids = np.load(os.path.join(db_path, IDS_FILE), mmap_mode="r")
+        self._offsets = np.load(os.path.join(db_path, OFFSETS_FILE), mmap_mode="r")
+        self._rows = None
+
+        self._blob_file = open(os.path.join(db_path, BLOB_FILE), "rb")
+        size = os.fstat(self._blob_file.fileno()).st_size
+        self._blob = mmap.mmap(self._blob_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return self.count
+
+    def index_to_docstore_id(self):
+        return PositionIds(self.count)
+
+    def doc_id(self, row):
+        return self._ids[row].decode("utf-8")
+
+    def search(self, search):
+        # Index positions come from PositionIds; original string ids still work
+        if isinstance(search, (int, np.integer)):
+            row = int(search) if 0 <= search < self.count else None
+        else:
+            if self._rows is None:
+                self._rows = {self.doc_id(row): row for row in range(self.count)}
+            row = self._rows.get(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.get(row)
+
+    def get(self, row):
+        _, text, metadata = self.raw(row)
+        return Document(page_content=text.decode("utf-8"), metadata=json.loads(metadata), id=self.doc_id(row))
+
+    def raw(self, row):
+        # Undecoded bytes, for rewriting the store without building Documents
+        text_start, text_len, meta_start, meta_len = (int(value) for value in self._offsets[row])
+        return (
+            self.doc_id(row),
+            self._blob[text_start:text_start + text_len],
+            self._blob[meta_start:meta_start + meta_len],
+        )
+
+    def doc_ids(self):
+        return [doc_id.decode("utf-8") for doc_id in self._ids]
+
+    def delete(self, ids):
+        # ValueError, as FAISS.add_texts raises for a docstore it cannot add to
+        raise ValueError("ColumnarDocstore is read-only; rebuild it with write_columnar_docstore")
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+        self._blob_file.close()
+
+
+def iter_documents(db_path):
+    """Yield (docstore_id, Document) in FAISS index order from either docstore format."""
+    if has_columnar_docstore(db_path):
+        docstore = ColumnarDocstore(db_path)
+        try:
+            for row in range(docstore.count):
+                yield docstore.doc_id(row), docstore.get(row)
+        finally:
+            docstore.close()
+        return
+
+    import pickle
+
+    with open(os.path.join(db_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    for position in range(len(index_to_docstore_id)):
+        doc_id = index_to_docstore_id[position]
+        yield doc_id, docstore.search(doc_id)
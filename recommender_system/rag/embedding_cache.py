@@ -0,0 +1,183 @@
+# Caching wrapper around an embeddings client (e.g. OllamaEmbeddings).
+# Kept free of Django imports so start_server.py can use it too.
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    return hashlib.sha256(f"{model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class SqliteVectorStore:
+    """On-disk tier: one row of float32 bytes per (model, text) hash."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            # Stay well below sqlite's bound-parameter limit
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model_name, items):
+        rows = [
+            (key, model_name, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+            for key, vector in items
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Two-tier cache (in-process LRU, then sqlite) in front of `embeddings`.
+    Only texts missing from both tiers reach the wrapped client.
+    """
+
+    def __init__(self, embeddings, model_name, cache_path=None, max_memory_entries=4096):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_memory_entries = max_memory_entries
+        self.disk = SqliteVectorStore(cache_path) if cache_path else None
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+
+    # ======= EMBEDDINGS INTERFACE =======
+    def embed_query(self, text):
+        return self._embed([text], self.embeddings.embed_query)[0]
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts), None)
+
+    # ======= CACHE =======
+    def _embed(self, texts, single_fn):
+        keys = [embedding_key(self.model_name, text) for text in texts]
+        vectors = [None] * len(texts)
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    vectors[i] = vector
+                    self.memory_hits += 1
+
+        pending = [i for i, vector in enumerate(vectors) if vector is None]
+        if pending and self.disk is not None:
+            stored = self.disk.get_many([keys[i] for i in pending])
+            for i in pending:
+                vector = stored.get(keys[i])
+                if vector is not None:
+                    vectors[i] = vector
+                    self._remember(keys[i], vector)
+                    self.disk_hits += 1
+            pending = [i for i in pending if vectors[i] is None]
+
+        if pending:
+            # Identical texts in one batch are embedded once
+            unique = list(OrderedDict.fromkeys(texts[i] for i in pending))
+            start = time.perf_counter()
+            if single_fn is not None and len(unique) == 1:
+                computed = [single_fn(unique[0])]
+            else:
+                computed = self.embeddings.embed_documents(unique)
+            elapsed = time.perf_counter() - start
+
+            by_text = dict(zip(unique, computed))
+            for i in pending:
+                vectors[i] = by_text[texts[i]]
+
+            new_items = [(embedding_key(self.model_name, text), by_text[text]) for text in unique]
+            for key, vector in new_items:
+                self._remember(key, vector)
+            if self.disk is not None:
+                self.disk.put_many(self.model_name, new_items)
+
+            with self._lock:
+                self.misses += len(unique)
+                self.miss_seconds += elapsed
+
+        return vectors
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            avg_miss_ms = (self.miss_seconds / self.misses * 1000) if self.misses else 0.0
+            return {
+                "model": self.model_name,
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "avg_miss_ms": round(avg_miss_ms, 2),
+                "saved_ms": round(hits * avg_miss_ms, 2),
+            }
+
+
+def cached_embeddings_from_env(embeddings, model_name, default_dir):
+    # RAG_EMBEDDING_CACHE_PATH="" keeps the cache in memory only
+    cache_path = os.environ.get(
+        "RAG_EMBEDDING_CACHE_PATH", os.path.join(default_dir, "embedding_cache.sqlite3")
+    )
+    cached = CachedEmbeddings(
+        embeddings,
+        model_name,
+        max_memory_entries=int(os.environ.get("RAG_EMBEDDING_CACHE_ENTRIES", "4096")),
+    )
+    if cache_path:
+        try:
+            cached.disk = SqliteVectorStore(cache_path)
+        except sqlite3.Error as e:
+            print(f"[WARN] Embedding disk cache disabled ({cache_path}): {e}")
+    return cached
@@ -0,0 +1,195 @@
+# Incremental corpus ingestion for the dietary_reference_intakes vector store.
+#
+# Source files are chunked in parallel and every chunk is identified by a
+# content hash (of its file title and text), which doubles as its docstore id.
+# Only chunks whose hash is not in the index yet are embedded; chunks that
+# disappeared from the source are removed. Ownership is per (source, hash):
+# a chunk two sources share stays in the index until neither has it. The
+# flat FAISS index, vectors.npy, the columnar docstore and the sparse index
+# are written under temporary names and swapped in together.
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+from .docstore import (
+    ColumnarDocstore, encode_document, has_columnar_docstore, iter_documents, stage_raw_docstore,
+)
+from .sparse import SparseIndex, has_sparse_index
+
+
+SUPPORTED_SUFFIXES = (".txt", ".md", ".pdf")
+
+
+def discover_files(source_dir):
+    paths = []
+    for root, _, names in os.walk(source_dir):
+        for name in names:
+            if name.lower().endswith(SUPPORTED_SUFFIXES):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def read_text(path):
+    if path.lower().endswith(".pdf"):
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise RuntimeError(f"pypdf is required to ingest {path} (pip install pypdf)")
+        return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def chunk_hash(title, text):
+    return hashlib.sha256(f"{title}\x00{text}".encode("utf-8")).hexdigest()
+
+
+def chunk_file(path, source_dir, chunk_size, chunk_overlap):
+    # Runs in a worker process
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    title = os.path.relpath(path, source_dir)[:200]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [
+        {"title": title, "chunk_index": i, "text": text, "content_hash": chunk_hash(title, text)}
+        for i, text in enumerate(splitter.split_text(read_text(path)))
+    ]
+
+
+def chunk_files(paths, source_dir, chunk_size=1000, chunk_overlap=200, workers=None):
+    chunks = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(chunk_file, path, source_dir, chunk_size, chunk_overlap) for path in paths]
+        for future in futures:
+            chunks.extend(future.result())
+
+    # The same text twice in one file is stored once
+    unique = {}
+    for chunk in chunks:
+        unique.setdefault(chunk["content_hash"], chunk)
+    return list(unique.values())
+
+
+def embed_texts(embedder, texts, batch_size=64, workers=2):
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    # One Ollama /api/embed call per batch, a few batches in flight at once
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(embedder.embed_documents, batches))
+    return np.asarray([vector for batch in results for vector in batch], dtype=np.float32)
+
+
+def indexed_ids(db_path):
+    if not os.path.exists(os.path.join(db_path, "index.faiss")):
+        return []
+    if has_columnar_docstore(db_path):
+        return ColumnarDocstore(db_path).doc_ids()
+    return [doc_id for doc_id, _ in iter_documents(db_path)]
+
+
+def indexed_vectors(db_path, ids):
+    """Stored embeddings of the chunks with these docstore ids, by id."""
+    wanted = set(ids)
+    if not wanted:
+        return {}
+    rows = [(row, doc_id) for row, doc_id in enumerate(indexed_ids(db_path)) if doc_id in wanted]
+    index = faiss.read_index(os.path.join(db_path, "index.faiss"))
+    return {doc_id: index.reconstruct(row) for row, doc_id in rows}
+
+
+def chunk_document(chunk, source):
+    return Document(
+        page_content=chunk["text"],
+        metadata={
+            "source": source,
+            "title": chunk["title"],
+            "chunk_index": chunk["chunk_index"],
+            "content_hash": chunk["content_hash"],
+        },
+    )
+
+
+def apply_changes(db_path, remove_ids, new_chunks, new_vectors, source):
+    """Remove `remove_ids` and append `new_chunks` to the vector store, all files replaced at once."""
+    os.makedirs(db_path, exist_ok=True)
+    index_path = os.path.join(db_path, "index.faiss")
+    vectors_path = os.path.join(db_path, "vectors.npy")
+
+    docstore = None
+    ids, raw_row = [], None   # docstore ids and (id, text, metadata) bytes, by index row
+    if os.path.exists(index_path):
+        index = faiss.read_index(index_path)
+        if not isinstance(index, faiss.IndexFlat):
+            raise RuntimeError(
+                "Incremental ingestion needs the flat index; ingest into it and rebuild "
+                "ANN indexes with `manage.py build_ann_index`"
+            )
+        if has_columnar_docstore(db_path):
+            docstore = ColumnarDocstore(db_path)
+            ids, raw_row = docstore.doc_ids(), docstore.raw
+        else:
+            # Pickle docstore: staged in the pickle-free format with the other files,
+            # so the conversion is part of the same swap
+            stored = [(doc_id, *encode_document(doc)) for doc_id, doc in iter_documents(db_path)]
+            ids, raw_row = [doc_id for doc_id, _, _ in stored], stored.__getitem__
+    else:
+        index = faiss.IndexFlatL2(new_vectors.shape[1])
+
+    renames = []
+    try:
+        if len(new_vectors) and new_vectors.shape[1] != index.d:
+            raise RuntimeError(f"Embedding dimension {new_vectors.shape[1]} does not match the index ({index.d})")
+
+        removed_rows = [row for row, doc_id in enumerate(ids) if doc_id in remove_ids]
+        removed = set(removed_rows)
+        kept_rows = [row for row in range(len(ids)) if row not in removed]
+
+        # IndexFlat.remove_ids compacts in order, so kept rows stay aligned with the docstore
+        if removed_rows:
+            index.remove_ids(np.asarray(removed_rows, dtype=np.int64))
+        if len(new_vectors):
+            index.add(new_vectors)
+        faiss.write_index(index, index_path + ".tmp")
+        renames.append((index_path + ".tmp", index_path))
+
+        if os.path.exists(vectors_path):
+            old_vectors = np.load(vectors_path, mmap_mode="r")
+            vectors = np.concatenate([np.asarray(old_vectors[kept_rows], dtype=np.float32),
+                                      new_vectors.reshape(-1, index.d)])
+            np.save(vectors_path + ".tmp.npy", vectors)
+            renames.append((vectors_path + ".tmp.npy", vectors_path))
+
+        texts = []
+
+        def raw_items():
+            for row in kept_rows:
+                item = raw_row(row)
+                texts.append(bytes(item[1]).decode("utf-8"))
+                yield item
+            for chunk in new_chunks:
+                texts.append(chunk["text"])
+                yield (chunk["content_hash"], *encode_document(chunk_document(chunk, source)))
+
+        _, docstore_renames = stage_raw_docstore(db_path, raw_items())
+        if has_sparse_index(db_path):
+            renames.extend(SparseIndex.build(texts).stage(db_path))
+        # The docstore header last: it is what readers check first
+        renames.extend(docstore_renames)
+    except BaseException:
+        for tmp_path, _ in renames:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        raise
+    finally:
+        if docstore is not None:
+            docstore.close()
+
+    for tmp_path, path in renames:
+        os.replace(tmp_path, path)
+    return index.ntotal
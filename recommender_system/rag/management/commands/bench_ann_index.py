@@ -0,0 +1,62 @@
+# rag/management/commands/bench_ann_index.py
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rag.ann import apply_search_params, index_memory_bytes, read_search_params
+from rag.benchmarks import percentile
+from rag.provider import provider, read_faiss_index, read_vectors
+
+
+class Command(BaseCommand):
+    help = "Report recall@k vs the flat index, p50/p99 search latency and memory for ANN vector stores"
+
+    def add_arguments(self, parser):
+        parser.add_argument("candidates", nargs="+", help="Vector store directories built by build_ann_index")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Flat (exact) vector store directory")
+        parser.add_argument("--k", type=int, default=10, help="Neighbours per query")
+        parser.add_argument("--queries", type=int, default=500, help="Queries to run")
+        parser.add_argument("--params", nargs="*", default=[],
+                            help='Search-time parameter sweeps, e.g. "nprobe=8" "nprobe=32" "efSearch=128"')
+
+    def handle(self, *args, **options):
+        k = options["k"]
+        flat = read_faiss_index(options["db_path"])
+        vectors = read_vectors(options["db_path"], mmap=True)
+        if vectors is None:
+            vectors = flat.reconstruct_n(0, flat.ntotal)
+
+        # Queries near real chunks, like questions that match the corpus
+        rng = np.random.default_rng(0)
+        rows = rng.choice(len(vectors), options["queries"], replace=len(vectors) < options["queries"])
+        queries = np.asarray(vectors[np.sort(rows)], dtype=np.float32)
+        queries += rng.normal(0, queries.std() * 0.5, queries.shape).astype(np.float32)
+
+        _, truth = flat.search(queries, k)
+
+        self.stdout.write(f"{flat.ntotal} vectors, d={flat.d}, k={k}, {len(queries)} queries")
+        self.stdout.write("%-36s %-16s %9s %9s %9s %10s" % ("index", "params", "recall", "p50 ms", "p99 ms", "memory MB"))
+        self._report("flat", flat, "", queries, truth, k)
+
+        for path in options["candidates"]:
+            index = read_faiss_index(path)
+            for params in options["params"] or [read_search_params(path)]:
+                try:
+                    apply_search_params(index, params)
+                except RuntimeError:
+                    continue  # parameter does not apply to this index type
+                self._report(path, index, params, queries, truth, k)
+
+    def _report(self, name, index, params, queries, truth, k):
+        timings, recalls = [], []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            _, found = index.search(query[None, :], k)
+            timings.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(set(found[0]) & set(expected)) / k)
+
+        self.stdout.write("%-36s %-16s %9.3f %9.3f %9.3f %10.1f" % (
+            name[-36:], params or "-", float(np.mean(recalls)),
+            percentile(timings, 50), percentile(timings, 99), index_memory_bytes(index) / 1024 / 1024,
+        ))
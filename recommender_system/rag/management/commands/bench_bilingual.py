@@ -0,0 +1,54 @@
+# rag/management/commands/bench_bilingual.py
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ollama_llm.client import OllamaError
+from rag import services
+from rag.benchmarks import percentile
+from rag.bilingual import agenerate_bilingual
+from rag.translation import SqliteTranslationStore, TranslationMemory
+
+from .bench_pipeline import SAMPLE_QUESTION
+
+
+class Command(BaseCommand):
+    help = "Wall-clock time of English-then-translate vs the pipelined bilingual answer"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3, help="Runs per variant")
+        parser.add_argument("--memory", action="store_true",
+                            help="Translate through an empty translation memory per run (default: whole-text prompts)")
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self._bench(options["runs"], options["memory"]))
+        except OllamaError as e:
+            raise CommandError(str(e))
+
+    async def _bench(self, runs, memory):
+        configured = services.get_translation_memory()
+        version = configured.version if configured is not None else ""
+        rows = {"sequential": [], "pipelined": []}
+        english = []
+        for _ in range(runs):
+            for variant in rows:
+                # Every run starts from nothing cached, so both variants generate and translate
+                services.invalidate_response_cache()
+                services.set_translation_memory(
+                    TranslationMemory(SqliteTranslationStore(":memory:"), version) if memory else None
+                )
+                start = time.perf_counter()
+                if variant == "sequential":
+                    text = await services.arun_pipeline(SAMPLE_QUESTION, mode="single-pass")
+                    english.append(time.perf_counter() - start)
+                    await services.atranslate_text_with_ollama(text)
+                else:
+                    await agenerate_bilingual(SAMPLE_QUESTION)
+                rows[variant].append(time.perf_counter() - start)
+
+        self.stdout.write("%-11s %9s %9s" % ("variant", "p50 s", "max s"))
+        self.stdout.write("%-11s %9.2f %9.2f" % ("english", percentile(english, 50), max(english)))
+        for variant, timings in rows.items():
+            self.stdout.write("%-11s %9.2f %9.2f" % (variant, percentile(timings, 50), max(timings)))
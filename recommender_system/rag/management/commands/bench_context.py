@@ -0,0 +1,101 @@
+# rag/management/commands/bench_context.py
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from ollama_llm.client import OllamaError, ollama
+from rag.benchmarks import percentile
+from rag.context import ContextAssembler, estimate_tokens
+from rag.docstore import ColumnarDocstore, has_columnar_docstore
+from rag.provider import LLM_MODEL, RETRIEVER_SEARCH_KWARGS, format_docs, provider, read_faiss_index, read_vectors
+from rag.retrieval import RetrievalEngine
+
+
+class Command(BaseCommand):
+    help = "Prompt tokens of plain k-chunk concatenation vs the token-budgeted context assembler"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=200, help="Queries sampled from corpus chunks")
+        parser.add_argument("--k", type=int, default=RETRIEVER_SEARCH_KWARGS["k"])
+        parser.add_argument("--budgets", type=int, nargs="*", default=[600, 1200, 2000], help="Token budgets to compare")
+        parser.add_argument("--tail-std", type=float, default=0.5)
+        parser.add_argument("--noise", type=float, default=1.0,
+                            help="Query-vector noise relative to the corpus spread (stands in for paraphrase)")
+        parser.add_argument("--ttft", type=int, default=0,
+                            help="Also time prompt prefill on Ollama for this many queries per mode")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        db_path = options["db_path"]
+        if not has_columnar_docstore(db_path):
+            raise CommandError("Run `manage.py export_docstore` first")
+
+        index = read_faiss_index(db_path)
+        vectors = read_vectors(db_path, mmap=True)
+        if vectors is None:
+            vectors = index.reconstruct_n(0, index.ntotal)
+        docstore = ColumnarDocstore(db_path)
+        engine = RetrievalEngine(index, docstore, docstore.index_to_docstore_id(), None, vectors=vectors)
+
+        # Each query is a noisy copy of one chunk's vector; that chunk is the one the answer needs
+        rng = random.Random(0)
+        noise = np.random.default_rng(0)
+        cases = []
+        for row in rng.sample(range(index.ntotal), min(options["queries"], index.ntotal)):
+            vector = np.asarray(vectors[row], dtype=np.float32)
+            vector = vector + noise.normal(0, float(np.std(vector)) * options["noise"], vector.shape).astype(np.float32)
+            scored = engine.search_by_vector(vector / np.linalg.norm(vector), k=options["k"])
+            cases.append((docstore.get(row).page_content, scored))
+
+        modes = [("all", None)] + [
+            (f"budget={budget}", ContextAssembler(max_tokens=budget, tail_std=options["tail_std"]))
+            for budget in options["budgets"]
+        ]
+        contexts = {}
+
+        self.stdout.write("%-12s %10s %10s %9s %9s %12s" % ("mode", "tokens p50", "tokens p99", "saved %", "chunks", "assemble ms"))
+        baseline = None
+        for name, assembler in modes:
+            tokens, chunks, timings, kept = [], [], [], []
+            contexts[name] = []
+            for source_text, scored in cases:
+                start = time.perf_counter()
+                if assembler is None:
+                    context = format_docs([doc for doc, _ in scored])
+                    chunk_count = len(scored)
+                else:
+                    context, report = assembler.assemble(scored)
+                    chunk_count = report["chunks_out"]
+                timings.append((time.perf_counter() - start) * 1000)
+                tokens.append(estimate_tokens(context))
+                chunks.append(chunk_count)
+                # Quality proxy: the answer-bearing chunk (or the bulk of it) made it into the prompt
+                kept.append(source_text[:200] in context)
+                contexts[name].append(context)
+
+            total = sum(tokens)
+            baseline = baseline or total
+            self.stdout.write("%-12s %10d %10d %9.1f %9.1f %12.3f" % (
+                name, percentile(tokens, 50), percentile(tokens, 99),
+                100 * (1 - total / baseline), np.mean(chunks), percentile(timings, 50),
+            ))
+            self.stdout.write(f"{'':12} source chunk kept: {np.mean(kept):.3f}")
+
+        if options["ttft"]:
+            self._bench_prefill(contexts, options["ttft"])
+
+    def _bench_prefill(self, contexts, count):
+        # num_predict=1 makes total time ~ prefill time, i.e. time to first token
+        self.stdout.write(f"\nPrefill on {LLM_MODEL} ({count} prompts per mode):")
+        for name, items in contexts.items():
+            timings = []
+            for context in items[:count]:
+                prompt = f"Question:\nWhat should the caregiver change?\n\nContext:\n{context}"
+                try:
+                    data = ollama.generate(prompt, options={"num_predict": 1}, timeout=300)
+                except OllamaError as e:
+                    raise CommandError(str(e))
+                timings.append(data.get("prompt_eval_duration", 0) / 1e6)
+            self.stdout.write("%-12s prefill p50 %8.1f ms  p99 %8.1f ms" % (name, percentile(timings, 50), percentile(timings, 99)))
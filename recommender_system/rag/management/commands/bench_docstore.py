@@ -0,0 +1,34 @@
+# rag/management/commands/bench_docstore.py
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.benchmarks import docstore_load_worker
+from rag.docstore import has_columnar_docstore
+from rag.provider import provider
+
+
+class Command(BaseCommand):
+    help = "Compare load time, resident memory and 10-chunk lookup latency of index.pkl vs the columnar docstore"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lookups", type=int, default=200, help="10-chunk lookups to time")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        db_path = options["db_path"]
+        if not has_columnar_docstore(db_path):
+            raise CommandError("No columnar docstore found; run `manage.py export_docstore` first")
+
+        # Each mode runs in a fresh process so memory numbers are not polluted by the other
+        ctx = multiprocessing.get_context("spawn")
+        self.stdout.write("%-9s %10s %10s %14s %14s" % ("docstore", "load ms", "RSS MB", "lookup p50 ms", "lookup p99 ms"))
+        for mode in ("pickle", "columnar"):
+            results = ctx.Queue()
+            process = ctx.Process(target=docstore_load_worker, args=(db_path, mode, options["lookups"], results))
+            process.start()
+            row = results.get()
+            process.join()
+            self.stdout.write("%-9s %10.1f %10.1f %14.3f %14.3f" % (
+                mode, row["load_ms"], row["rss_mb"], row["lookup_p50_ms"], row["lookup_p99_ms"]
+            ))
@@ -0,0 +1,72 @@
+# rag/management/commands/bench_hybrid.py
+import random
+import re
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.benchmarks import percentile
+from rag.docstore import ColumnarDocstore, has_columnar_docstore
+from rag.provider import provider, read_faiss_index, read_vectors
+from rag.retrieval import RetrievalEngine
+from rag.sparse import SparseIndex, has_sparse_index
+
+
+class Command(BaseCommand):
+    help = "Compare dense, BM25 and hybrid (RRF) retrieval: query latency and hit rate of the source chunk"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=300, help="Queries sampled from corpus chunks")
+        parser.add_argument("--k", type=int, nargs="*", default=[3, 5, 10], help="k values to report")
+        parser.add_argument("--noise", type=float, default=1.0,
+                            help="Query-vector noise relative to the corpus spread (stands in for paraphrase)")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        db_path = options["db_path"]
+        if not (has_sparse_index(db_path) and has_columnar_docstore(db_path)):
+            raise CommandError("Run `manage.py export_docstore` and `manage.py build_sparse_index` first")
+
+        index = read_faiss_index(db_path)
+        vectors = read_vectors(db_path, mmap=True)
+        if vectors is None:
+            vectors = index.reconstruct_n(0, index.ntotal)
+        docstore = ColumnarDocstore(db_path)
+
+        start = time.perf_counter()
+        sparse = SparseIndex.load(db_path)
+        self.stdout.write(f"Sparse index load: {(time.perf_counter() - start) * 1000:.1f} ms, {sparse.nbytes() / 1024 / 1024:.1f} MB")
+
+        engine = RetrievalEngine(index, docstore, docstore.index_to_docstore_id(), None, vectors=vectors, sparse=sparse)
+
+        # Each query is a noisy copy of one chunk's vector plus a few of its words, e.g. a nutrient name
+        rng = random.Random(0)
+        noise = np.random.default_rng(0)
+        cases = []
+        for row in rng.sample(range(index.ntotal), min(options["queries"], index.ntotal)):
+            words = re.findall(r"\w+(?:\s*\(\w+\))?", docstore.get(row).page_content)
+            start_word = rng.randrange(max(1, len(words) - 3))
+            text = " ".join(words[start_word:start_word + 3])
+            vector = np.asarray(vectors[row], dtype=np.float32)
+            vector = vector + noise.normal(0, float(np.std(vector)) * options["noise"], vector.shape).astype(np.float32)
+            cases.append((row, text, vector / np.linalg.norm(vector)))
+
+        max_k = max(options["k"])
+        self.stdout.write("%-8s %9s %9s  %s" % ("mode", "p50 ms", "p99 ms", "  ".join(f"hit@{k:<3}" for k in options["k"])))
+        for mode in ("dense", "bm25", "hybrid"):
+            timings, ranks = [], []
+            for row, text, vector in cases:
+                start = time.perf_counter()
+                if mode == "bm25":
+                    positions, _ = sparse.search(text, max_k)
+                    positions = list(positions)
+                else:
+                    positions, _ = engine.rank(vector, k=max_k, query_text=text if mode == "hybrid" else None)
+                    positions = list(positions)
+                timings.append((time.perf_counter() - start) * 1000)
+                ranks.append(positions.index(row) if row in positions else None)
+
+            hits = "  ".join(f"{np.mean([r is not None and r < k for r in ranks]):<7.3f}" for k in options["k"])
+            self.stdout.write("%-8s %9.3f %9.3f  %s" % (mode, percentile(timings, 50), percentile(timings, 99), hits))
+
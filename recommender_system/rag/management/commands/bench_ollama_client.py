@@ -0,0 +1,73 @@
+# rag/management/commands/bench_ollama_client.py
+import asyncio
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from ollama_llm.client import OLLAMA_BASE_URL, OLLAMA_EMBEDDING_MODEL, AsyncOllamaClient, OllamaClient, OllamaError
+from rag.benchmarks import percentile
+
+
+class Command(BaseCommand):
+    help = "Per-call overhead of bare requests.post vs the pooled keep-alive Ollama client (sync and async)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8, help="In-flight calls for the async client")
+        parser.add_argument("--text", type=str, default="calcium", help="Embedded on every call (cheap request)")
+
+    def handle(self, *args, **options):
+        calls, text = options["calls"], options["text"]
+        payload = {"model": OLLAMA_EMBEDDING_MODEL, "input": [text]}
+
+        def bare():
+            # What every app did before: a new connection per request
+            response = requests.post(f"{OLLAMA_BASE_URL}/api/embed", json=payload, timeout=30)
+            response.raise_for_status()
+
+        client = OllamaClient()
+        try:
+            client.embed([text])  # model load is not per-call overhead
+            rows = [("requests.post", self._time(bare, calls)),
+                    ("pooled sync", self._time(lambda: client.embed([text]), calls))]
+        except (requests.RequestException, OllamaError) as e:
+            raise CommandError(f"Ollama request failed: {e}")
+
+        seconds, timings = asyncio.run(self._async(calls, options["concurrency"], text))
+
+        self.stdout.write("%-16s %9s %9s %11s" % ("client", "p50 ms", "p99 ms", "calls/s"))
+        for name, (total, values) in rows:
+            self.stdout.write("%-16s %9.2f %9.2f %11.1f" % (name, percentile(values, 50), percentile(values, 99), calls / total))
+        self.stdout.write("%-16s %9.2f %9.2f %11.1f" % (
+            f"pooled async x{options['concurrency']}", percentile(timings, 50), percentile(timings, 99), calls / seconds))
+        self.stdout.write(f"Pooled client stats: {client.stats.as_dict()}")
+
+    def _time(self, call, count):
+        timings = []
+        start = time.perf_counter()
+        for _ in range(count):
+            call_start = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - call_start) * 1000)
+        return time.perf_counter() - start, timings
+
+    async def _async(self, count, concurrency, text):
+        client = AsyncOllamaClient(pool_size=concurrency)
+        semaphore = asyncio.Semaphore(concurrency)
+        timings = []
+
+        async def one():
+            async with semaphore:
+                call_start = time.perf_counter()
+                await client.embed([text])
+                timings.append((time.perf_counter() - call_start) * 1000)
+
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(count)))
+            return time.perf_counter() - start, timings
+        except OllamaError as e:
+            raise CommandError(str(e))
+        finally:
+            await client.aclose()
@@ -0,0 +1,65 @@
+# rag/management/commands/bench_output.py
+import time
+from collections import Counter
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from ollama_llm.client import OllamaError, ollama
+from ollama_llm.output import OutputBudget, OutputGuard, budget_for
+from rag.benchmarks import percentile
+from rag.provider import provider
+from rag.services import RAG_PROMPT_TEMPLATE, RAG_TRANSLATED_PROMPT_TEMPLATE
+
+from .bench_pipeline import SAMPLE_QUESTION
+
+
+STAGES = {"answer": RAG_PROMPT_TEMPLATE, "answer-tr-cn": RAG_TRANSLATED_PROMPT_TEMPLATE}
+
+
+class Command(BaseCommand):
+    help = "Generated vs kept tokens and latency with and without output budgets / early stopping"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3, help="Generations per stage and mode")
+        parser.add_argument("--stages", nargs="*", default=list(STAGES), choices=list(STAGES))
+
+    def handle(self, *args, **options):
+        # Retrieval is the same in both modes; do it once
+        context = provider.build_context(SAMPLE_QUESTION)
+
+        # Same reasoning stripping, but no num_predict, stop sequences or early stop
+        unbounded = OutputBudget(num_predict=None, stop=None, early_stop=False)
+
+        self.stdout.write("%-13s %-9s %9s %9s %10s %10s  %s" % (
+            "stage", "budget", "p50 s", "max s", "generated", "kept", "stopped"))
+        for stage in options["stages"]:
+            prompt = STAGES[stage].format(question=SAMPLE_QUESTION, context=context)
+            for name, budget in (("none", unbounded), ("stage", budget_for(stage))):
+                timings, generated, kept, stopped = [], [], [], Counter()
+                for _ in range(options["runs"]):
+                    start = time.perf_counter()
+                    report = self._generate(prompt, stage, budget)
+                    timings.append(time.perf_counter() - start)
+                    generated.append(report["generated_tokens"])
+                    kept.append(report["kept_tokens"])
+                    stopped[report["stopped"]] += 1
+                self.stdout.write("%-13s %-9s %9.2f %9.2f %10.0f %10.0f  %s" % (
+                    stage, name, percentile(timings, 50), max(timings), np.mean(generated), np.mean(kept),
+                    ", ".join(f"{reason}={count}" for reason, count in stopped.items()),
+                ))
+
+    def _generate(self, prompt, stage, budget):
+        guard = OutputGuard(budget, stage)
+        stream = ollama.stream_text(prompt, options=budget.options(), timeout=600)
+        try:
+            for chunk in stream:
+                guard.feed(chunk)
+                if guard.done:
+                    break
+        except OllamaError as e:
+            raise CommandError(str(e))
+        finally:
+            stream.close()
+        guard.finish()
+        return guard.report()
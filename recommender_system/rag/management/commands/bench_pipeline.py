@@ -0,0 +1,97 @@
+# rag/management/commands/bench_pipeline.py
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from ollama_llm.client import OllamaError, ollama
+from rag.benchmarks import percentile
+from rag.provider import provider
+from rag.services import (
+    PIPELINE_MODES, RAG_PROMPT_TEMPLATE, RAG_TRANSLATED_PROMPT_TEMPLATE,
+    SUMMARIZE_PROMPT_TEMPLATE, TRANSLATE_PROMPT_TEMPLATE,
+)
+
+# translation-memory is compared against full translation by bench_translation_memory
+BENCH_MODES = [mode for mode in PIPELINE_MODES if mode != "translation-memory"]
+
+
+SAMPLE_QUESTION = """
+PATIENT DETAILS:
+Age: 78
+Gender: Female
+Height: 152 cm
+Weight: 49 kg
+Blood Pressure: 142/88 mmHg
+Activity Level: Sedentary
+
+RECOMMENDED DAILY INTAKE:
+Calories: 1500 kcal
+Protein: 59 g
+Total Fiber: 21 g
+Total Water: 2.7 L
+
+MEAL INTAKES:
+Meal 1: Congee with pickled vegetables
+Meal 2: White rice with braised pork
+Meal 3: Instant noodles
+"""
+
+
+class Command(BaseCommand):
+    help = "End-to-end latency and generated tokens of single-pass vs multi-pass RAG generation"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions-file", type=str, default=None,
+                            help="Questions separated by blank lines (default: one sample patient query)")
+        parser.add_argument("--runs", type=int, default=3, help="Runs per question, mode and language")
+        parser.add_argument("--modes", nargs="*", default=BENCH_MODES, choices=BENCH_MODES)
+        parser.add_argument("--no-translate", action="store_true", help="Skip the Traditional Chinese variants")
+
+    def handle(self, *args, **options):
+        questions = [SAMPLE_QUESTION]
+        if options["questions_file"]:
+            with open(options["questions_file"], encoding="utf-8") as f:
+                questions = [q.strip() for q in f.read().split("\n\n\n") if q.strip()]
+
+        # Retrieval is identical in both modes; do it once so only generation is compared
+        contexts = [provider.build_context(question) for question in questions]
+
+        languages = [False] if options["no_translate"] else [False, True]
+        self.stdout.write("%-12s %-6s %6s %9s %9s %10s %10s" % (
+            "mode", "lang", "calls", "p50 s", "max s", "gen tokens", "prompt tok"))
+        for translate in languages:
+            for mode in options["modes"]:
+                timings, generated, prompted, calls = [], [], [], 0
+                for question, context in zip(questions, contexts):
+                    for _ in range(options["runs"]):
+                        start = time.perf_counter()
+                        stages = self._run(mode, translate, question, context)
+                        timings.append(time.perf_counter() - start)
+                        generated.append(sum(stage["eval_count"] for stage in stages))
+                        prompted.append(sum(stage["prompt_eval_count"] for stage in stages))
+                        calls = len(stages)
+                self.stdout.write("%-12s %-6s %6d %9.2f %9.2f %10.0f %10.0f" % (
+                    mode, "tr-cn" if translate else "en", calls, percentile(timings, 50), max(timings),
+                    np.mean(generated), np.mean(prompted),
+                ))
+
+    def _run(self, mode, translate, question, context):
+        if mode == "single-pass":
+            template = RAG_TRANSLATED_PROMPT_TEMPLATE if translate else RAG_PROMPT_TEMPLATE
+            return [self._generate(template.format(question=question, context=context))]
+
+        first = self._generate(RAG_PROMPT_TEMPLATE.format(question=question, context=context))
+        second_template = TRANSLATE_PROMPT_TEMPLATE if translate else SUMMARIZE_PROMPT_TEMPLATE
+        return [first, self._generate(second_template.format(text=first["response"]))]
+
+    def _generate(self, prompt):
+        try:
+            data = ollama.generate(prompt, timeout=600)
+        except OllamaError as e:
+            raise CommandError(str(e))
+        return {
+            "response": data.get("response", ""),
+            "eval_count": data.get("eval_count", 0),
+            "prompt_eval_count": data.get("prompt_eval_count", 0),
+        }
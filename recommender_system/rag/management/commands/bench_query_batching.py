@@ -0,0 +1,78 @@
+# rag/management/commands/bench_query_batching.py
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag.batching import MicroBatcher, QUERY_BATCH_CONCURRENCY
+from rag.benchmarks import percentile
+from rag.provider import RETRIEVER_SEARCH_KWARGS, provider
+from rag.retrieval import RetrievalEngine
+
+from .bench_pipeline import SAMPLE_QUESTION
+
+
+class Command(BaseCommand):
+    help = "Retrieval throughput and latency under concurrent requests, with and without query micro-batching"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, nargs="*", default=[1, 8, 32],
+                            help="Concurrent request threads, each searching back to back")
+        parser.add_argument("--searches", type=int, default=20, help="Searches per thread")
+        parser.add_argument("--windows", type=float, nargs="*", default=[2, 5, 10],
+                            help="Batching windows in ms to compare against no batching")
+        parser.add_argument("--max-batch", type=int, default=16)
+        parser.add_argument("--concurrency", type=int, default=QUERY_BATCH_CONCURRENCY, help="Batches in flight")
+
+    def handle(self, *args, **options):
+        # Needs Ollama (or `manage.py mock_ollama` with --embed-dim matching the index) for the embed calls
+        vector_store = provider.vector_store
+        engine = RetrievalEngine.from_vector_store(vector_store, vectors=provider.vectors, **RETRIEVER_SEARCH_KWARGS)
+        self.stdout.write(f"{vector_store.index.ntotal} vectors, every query unique (no embedding cache hits)")
+        self.stdout.write("%-8s %7s %6s %9s %9s %9s %9s %10s %9s" % (
+            "window", "threads", "errors", "q/s", "p50 ms", "p95 ms", "p99 ms", "avg batch", "wait ms"))
+
+        configs = [None] + options["windows"]
+        for threads in options["threads"]:
+            for window in configs:
+                engine.batcher = None if window is None else MicroBatcher(
+                    engine.search_with_scores_many, options["max_batch"], window, options["concurrency"],
+                    name="bench-batch",
+                )
+                seconds, timings, errors = self._run(engine, threads, options["searches"], f"{window}-{threads}")
+                stats = engine.batcher.stats() if engine.batcher is not None else {"avg_batch": 1.0, "avg_wait_ms": 0.0}
+                self.stdout.write("%-8s %7d %6d %9.1f %9.2f %9.2f %9.2f %10.2f %9.2f" % (
+                    "off" if window is None else f"{window:g} ms", threads, errors, len(timings) / seconds,
+                    percentile(timings, 50), percentile(timings, 95), percentile(timings, 99),
+                    stats["avg_batch"], stats["avg_wait_ms"],
+                ))
+            self.stdout.write("")
+
+    def _run(self, engine, threads, searches, label):
+        run = f"{time.time():.0f}-{label}"
+        timings, errors, lock = [], [], threading.Lock()
+        barrier = threading.Barrier(threads + 1)
+
+        def worker(number):
+            barrier.wait()
+            for i in range(searches):
+                start = time.perf_counter()
+                try:
+                    engine.search_with_scores(f"{SAMPLE_QUESTION}\nRequest: {run}-{number}-{i}")
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    if len(errors) == 1:
+                        self.stderr.write(f"thread {number}: {type(e).__name__}: {e}")
+                    continue
+                with lock:
+                    timings.append((time.perf_counter() - start) * 1000)
+
+        workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+        for thread in workers:
+            thread.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - start, timings, len(errors)
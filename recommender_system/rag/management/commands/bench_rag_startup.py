@@ -0,0 +1,81 @@
+# rag/management/commands/bench_rag_startup.py
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from rag.provider import provider
+from rag.services import run_pipeline
+
+
+# Runs in a fresh interpreter so nothing is already imported
+IMPORT_PROBE = """
+import json, os, time
+from importlib import import_module
+start = time.perf_counter()
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "recommender_system.settings")
+import django
+django.setup()
+setup_done = time.perf_counter()
+from django.conf import settings
+import_module(settings.ROOT_URLCONF)
+urls_done = time.perf_counter()
+import sys
+print(json.dumps({
+    "django_setup_ms": (setup_done - start) * 1000,
+    "urlconf_import_ms": (urls_done - setup_done) * 1000,
+    "langchain_imported": any(name.startswith("langchain") for name in sys.modules),
+}))
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure import time of the URLconf and first-request latency of the lazy RAG provider"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=5, help="Fresh-interpreter import runs")
+        parser.add_argument("--query", type=str, default="", help="Optional question to time a full first/second answer")
+
+    def handle(self, *args, **options):
+        # ---- Import time ----
+        runs = []
+        for _ in range(options["repeat"]):
+            out = subprocess.run(
+                [sys.executable, "-c", IMPORT_PROBE],
+                cwd=str(settings.BASE_DIR),
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+        self.stdout.write("Import time (median of %d fresh interpreters):" % len(runs))
+        self.stdout.write("  django.setup():        %.1f ms" % statistics.median(r["django_setup_ms"] for r in runs))
+        self.stdout.write("  import ROOT_URLCONF:   %.1f ms" % statistics.median(r["urlconf_import_ms"] for r in runs))
+        self.stdout.write("  langchain imported:    %s" % any(r["langchain_imported"] for r in runs))
+
+        # ---- First request ----
+        start = time.perf_counter()
+        try:
+            provider.warmup()
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"Warmup failed: {e}"))
+            return
+        warmup_ms = (time.perf_counter() - start) * 1000
+
+        self.stdout.write("First-use load (paid at import time before lazy loading):")
+        for name, seconds in provider.load_seconds.items():
+            self.stdout.write("  %-20s %.1f ms" % (name + ":", seconds * 1000))
+        self.stdout.write("  %-20s %.1f ms" % ("total warmup:", warmup_ms))
+
+        if options["query"]:
+            for label in ("first request", "second request"):
+                start = time.perf_counter()
+                run_pipeline(options["query"])
+                self.stdout.write("  %-20s %.1f ms" % (label + ":", (time.perf_counter() - start) * 1000))
+
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,44 @@
+# rag/management/commands/bench_residency.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ollama_llm.client import OLLAMA_EMBEDDING_MODEL, OLLAMA_MODEL, OllamaError, ollama
+from ollama_llm.residency import residency
+from rag.benchmarks import percentile
+
+
+class Command(BaseCommand):
+    help = "Cold (model unloaded) vs warm latency for the chat and embedding models"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3, help="Cold and warm requests per model")
+
+    def handle(self, *args, **options):
+        requests = {
+            OLLAMA_MODEL: lambda: ollama.generate("Reply with OK.", options={"num_predict": 1}, timeout=600),
+            OLLAMA_EMBEDDING_MODEL: lambda: ollama.embed(["vitamin D intake for elderly"], timeout=600),
+        }
+        kinds = {OLLAMA_MODEL: "generate", OLLAMA_EMBEDDING_MODEL: "embed"}
+
+        self.stdout.write("%-28s %10s %10s %10s %10s" % ("model", "cold p50", "cold max", "warm p50", "warm max"))
+        try:
+            for model, request in requests.items():
+                cold, warm = [], []
+                for _ in range(options["runs"]):
+                    # keep_alive=0 unloads the model, so the next request loads it again
+                    ollama.load_model(model, kinds[model], keep_alive=0)
+                    cold.append(self._time(request))
+                    warm.append(self._time(request))
+                self.stdout.write("%-28s %10.0f %10.0f %10.0f %10.0f" % (
+                    model, percentile(cold, 50), max(cold), percentile(warm, 50), max(warm)))
+            # Leave both models loaded as a server would find them
+            self.stdout.write(f"warmup (ms): {residency.warm()}")
+        except OllamaError as e:
+            raise CommandError(str(e))
+
+    @staticmethod
+    def _time(request):
+        start = time.perf_counter()
+        request()
+        return (time.perf_counter() - start) * 1000
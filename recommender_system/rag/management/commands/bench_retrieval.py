@@ -0,0 +1,64 @@
+# rag/management/commands/bench_retrieval.py
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rag.benchmarks import percentile
+from rag.docstore import ColumnarDocstore, has_columnar_docstore
+from rag.provider import RETRIEVER_SEARCH_KWARGS, provider, read_faiss_index, read_vectors
+from rag.retrieval import RetrievalEngine
+
+
+class Command(BaseCommand):
+    help = "Microbenchmark the native retrieval engine against langchain's FAISS MMR path"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=200, help="Random query vectors per configuration")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        from langchain_community.vectorstores import FAISS
+
+        db_path = options["db_path"]
+        index = read_faiss_index(db_path)
+        if has_columnar_docstore(db_path):
+            docstore = ColumnarDocstore(db_path)
+            index_to_docstore_id = docstore.index_to_docstore_id()
+        else:
+            import pickle
+
+            with open(f"{db_path}/index.pkl", "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+
+        # Query embedding is out of scope here; both paths get the same vectors
+        store = FAISS(lambda text: [], index, docstore, index_to_docstore_id)
+        engine = RetrievalEngine(index, docstore, index_to_docstore_id, None, vectors=read_vectors(db_path))
+        queries = np.random.default_rng(0).standard_normal((options["queries"], index.d)).astype(np.float32)
+
+        k, fetch_k = RETRIEVER_SEARCH_KWARGS["k"], RETRIEVER_SEARCH_KWARGS["fetch_k"]
+        self.stdout.write(f"{index.ntotal} vectors, d={index.d}, k={k}, fetch_k={fetch_k}, {len(queries)} queries")
+        self.stdout.write("%-8s %-10s %10s %10s %10s" % ("lambda", "path", "p50 ms", "p99 ms", "overlap"))
+
+        for lambda_mult in (1, 0.5):
+            langchain_ids, langchain_ms = self._time(lambda q: store.max_marginal_relevance_search_with_score_by_vector(
+                q.tolist(), k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+            ), queries)
+            native_ids, native_ms = self._time(lambda q: engine.search_by_vector(
+                q, k=k, fetch_k=fetch_k, lambda_mult=lambda_mult
+            ), queries)
+
+            overlap = np.mean([len(a & b) / max(len(a), 1) for a, b in zip(langchain_ids, native_ids)])
+            for path, timings in (("langchain", langchain_ms), ("native", native_ms)):
+                self.stdout.write("%-8s %-10s %10.3f %10.3f %10.3f" % (
+                    lambda_mult, path, percentile(timings, 50), percentile(timings, 99), overlap
+                ))
+
+    def _time(self, search, queries):
+        ids, timings = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results = search(query)
+            timings.append((time.perf_counter() - start) * 1000)
+            ids.append({doc.id for doc, _ in results})
+        return ids, timings
@@ -0,0 +1,53 @@
+# rag/management/commands/bench_shared_index.py
+import multiprocessing
+import statistics
+
+from django.core.management.base import BaseCommand
+
+from rag.benchmarks import shared_index_worker
+from rag.provider import provider
+
+
+class Command(BaseCommand):
+    help = "Compare per-worker memory of copied vs memory-mapped FAISS index loads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Concurrent worker processes")
+        parser.add_argument("--searches", type=int, default=32, help="Searches per worker before measuring")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        self.stdout.write(f"Index: {options['db_path']}  workers: {workers}")
+        self.stdout.write("%-6s %10s %10s %10s %10s %10s" % ("mode", "load ms", "RSS MB", "anon MB", "file MB", "PSS MB"))
+
+        for mmap in (False, True):
+            rows = self._run(options["db_path"], mmap, workers, options["searches"])
+
+            def median(key):
+                return statistics.median(row["after"].get(key, 0) - row["before"].get(key, 0) for row in rows)
+
+            self.stdout.write("%-6s %10.1f %10.1f %10.1f %10.1f %10.1f" % (
+                "mmap" if mmap else "copy",
+                statistics.median(row["load_ms"] for row in rows),
+                median("VmRSS"), median("RssAnon"), median("RssFile"), median("Pss"),
+            ))
+
+        self.stdout.write("Memory columns are per-worker growth over an idle interpreter (median).")
+        self.stdout.write("PSS splits shared page-cache pages across workers; it should shrink with mmap as workers grow.")
+
+    def _run(self, db_path, mmap, workers, searches):
+        # Spawned, not forked, so workers do not inherit this process's pages
+        ctx = multiprocessing.get_context("spawn")
+        barrier = ctx.Barrier(workers)
+        results = ctx.Queue()
+        processes = [
+            ctx.Process(target=shared_index_worker, args=(db_path, mmap, searches, barrier, results))
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        rows = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        return rows
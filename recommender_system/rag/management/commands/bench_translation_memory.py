@@ -0,0 +1,71 @@
+# rag/management/commands/bench_translation_memory.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ollama_llm.client import OllamaError
+from ollama_llm.services import get_ollama_llm_response
+from rag.benchmarks import percentile
+from rag.services import _translate_full, get_translation_memory, run_pipeline
+from rag.translation import SqliteTranslationStore, TranslationMemory
+
+from .bench_pipeline import SAMPLE_QUESTION
+
+
+class Command(BaseCommand):
+    help = "LLM calls and latency of whole-text translation vs the sentence-level translation memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--questions-file", type=str, default=None,
+                            help="Questions separated by two blank lines (default: one sample patient query)")
+        parser.add_argument("--runs", type=int, default=3, help="Passes over the English answers")
+        parser.add_argument("--persistent", action="store_true",
+                            help="Use the server's translation memory instead of starting from an empty one")
+
+    def handle(self, *args, **options):
+        questions = [SAMPLE_QUESTION]
+        if options["questions_file"]:
+            with open(options["questions_file"], encoding="utf-8") as f:
+                questions = [q.strip() for q in f.read().split("\n\n\n") if q.strip()]
+
+        translation_memory = get_translation_memory()
+        if options["persistent"]:
+            if translation_memory is None:
+                raise CommandError("RAG_TRANSLATION_MEMORY=0: there is no translation memory to use")
+            memory = translation_memory
+        else:
+            memory = TranslationMemory(SqliteTranslationStore(":memory:"),
+                                       translation_memory.version if translation_memory is not None else "")
+
+        def segments(prompt):
+            return get_ollama_llm_response(prompt, stage="translate-segments")
+
+        try:
+            # The English answers are what both variants translate
+            answers = [run_pipeline(question, mode="single-pass") for question in questions]
+
+            self.stdout.write("%-10s %6s %10s %9s %9s %9s" % ("variant", "calls", "llm calls", "p50 s", "max s", "total s"))
+            full = [self._time(_translate_full, answer) for answer in answers * options["runs"]]
+            self.stdout.write("%-10s %6d %10d %9.2f %9.2f %9.2f" % (
+                "full", len(full), len(full), percentile(full, 50), max(full), sum(full)))
+
+            before = memory.stats()
+            timed = [self._time(memory.translate, answer, segments, _translate_full)
+                     for answer in answers * options["runs"]]
+            after = memory.stats()
+        except OllamaError as e:
+            raise CommandError(str(e))
+
+        llm_calls = after["llm_calls"] - before["llm_calls"]
+        self.stdout.write("%-10s %6d %10d %9.2f %9.2f %9.2f" % (
+            "memory", len(timed), llm_calls, percentile(timed, 50), max(timed), sum(timed)))
+        self.stdout.write(
+            f"LLM calls saved: {len(timed) - llm_calls}/{len(timed)}, "
+            f"time saved: {sum(full) - sum(timed):.2f}s, segment hit rate: {after['hit_rate']:.0%}"
+        )
+
+    @staticmethod
+    def _time(fn, *args):
+        start = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - start
@@ -0,0 +1,93 @@
+# rag/management/commands/bench_workers.py
+import asyncio
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.benchmarks import percentile
+
+from .bench_ws import run_clients
+
+
+class Command(BaseCommand):
+    help = "Start start_server.py with 1..N worker processes and measure websocket throughput for each"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, nargs="*", default=[1, 2, 4])
+        parser.add_argument("--clients", type=int, default=16)
+        parser.add_argument("--questions", type=int, default=4, help="Questions each client sends, one after another")
+        parser.add_argument("--port", type=int, default=25090)
+        parser.add_argument("--startup-timeout", type=float, default=120)
+        parser.add_argument("--timeout", type=float, default=300)
+        parser.add_argument("--server", type=str, default=str(settings.BASE_DIR.parent / "start_server.py"))
+
+    def handle(self, *args, **options):
+        if not os.path.exists(options["server"]):
+            raise CommandError(f"{options['server']} not found; pass --server")
+        url = f"ws://127.0.0.1:{options['port']}"
+        self.stdout.write(f"{options['clients']} clients x {options['questions']} questions (unique) at {url}")
+        self.stdout.write("%7s %6s %6s %9s %8s %9s %9s %9s %9s" % (
+            "workers", "ok", "errors", "q/s", "speedup", "p50 s", "p95 s", "p99 s", "drain s"))
+
+        baseline = None
+        for workers in options["workers"]:
+            process = self._start(options, workers)
+            try:
+                seconds, timings, errors = asyncio.run(run_clients(
+                    url, options["clients"], options["questions"], True, options["timeout"], self.stderr.write
+                ))
+            finally:
+                drain = self._stop(process)
+            rate = len(timings) / seconds
+            baseline = baseline or rate
+            self.stdout.write("%7d %6d %6d %9.2f %7.2fx %9.2f %9.2f %9.2f %9.2f" % (
+                workers, len(timings), errors, rate, rate / baseline,
+                percentile(timings, 50), percentile(timings, 95), percentile(timings, 99), drain,
+            ))
+
+    def _start(self, options, workers):
+        env = dict(os.environ, WS_WORKERS=str(workers), WS_HOST="127.0.0.1", WS_PORT=str(options["port"]),
+                   PYTHONUNBUFFERED="1")
+        process = subprocess.Popen(
+            [sys.executable, options["server"]], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+        )
+        lines = queue.Queue()
+
+        def read():
+            for line in process.stdout:
+                lines.put(line)
+            lines.put(None)
+
+        threading.Thread(target=read, daemon=True).start()
+
+        # Ready when every worker (or the single process) accepts connections
+        ready, deadline = 0, time.monotonic() + options["startup_timeout"]
+        while ready < workers:
+            try:
+                line = lines.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                line = None
+            if line is None:
+                process.kill()
+                raise CommandError(f"start_server.py with {workers} workers did not start")
+            if "accepting connections" in line or (workers == 1 and "please connect to the WebSocket service" in line):
+                ready += 1
+        return process
+
+    def _stop(self, process):
+        """Sends SIGTERM and returns the seconds until the server has drained and exited."""
+        start = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        return time.perf_counter() - start
@@ -0,0 +1,61 @@
+# rag/management/commands/bench_ws.py
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag.benchmarks import percentile
+
+from .bench_pipeline import SAMPLE_QUESTION
+
+
+class Command(BaseCommand):
+    help = "Throughput and latency of the start_server.py websocket server with N simultaneous clients"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", type=str, default="ws://127.0.0.1:25002")
+        parser.add_argument("--clients", type=int, nargs="*", default=[1, 4, 16])
+        parser.add_argument("--questions", type=int, default=4, help="Questions each client sends, one after another")
+        parser.add_argument("--vary", action="store_true",
+                            help="Make every question unique (bypasses the server's response cache)")
+        parser.add_argument("--timeout", type=float, default=300)
+
+    def handle(self, *args, **options):
+        self.stdout.write(options["url"])
+        self.stdout.write("%7s %6s %6s %9s %9s %9s %9s" % ("clients", "ok", "errors", "q/s", "p50 s", "p95 s", "p99 s"))
+        for clients in options["clients"]:
+            seconds, timings, errors = asyncio.run(run_clients(
+                options["url"], clients, options["questions"], options["vary"], options["timeout"], self.stderr.write
+            ))
+            self.stdout.write("%7d %6d %6d %9.2f %9.2f %9.2f %9.2f" % (
+                clients, len(timings), errors, len(timings) / seconds,
+                percentile(timings, 50), percentile(timings, 95), percentile(timings, 99),
+            ))
+
+
+async def run_clients(url, clients, questions, vary=False, timeout=300, log=print):
+    """(seconds, per-question timings, failed clients) for `clients` connections asking in turn."""
+    from websockets.asyncio.client import connect
+
+    timings, errors = [], 0
+    run = f"{time.time():.0f}"
+
+    async def client(number):
+        nonlocal errors
+        try:
+            async with connect(url, close_timeout=10, max_size=None) as websocket:
+                for i in range(questions):
+                    question = SAMPLE_QUESTION
+                    if vary:
+                        question += f"\nRequest: {run}-{number}-{i}"
+                    start = time.perf_counter()
+                    await websocket.send(question)
+                    await asyncio.wait_for(websocket.recv(), timeout)
+                    timings.append(time.perf_counter() - start)
+        except Exception as e:
+            errors += 1
+            log(f"client {number}: {type(e).__name__}: {e}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return time.perf_counter() - start, timings, errors
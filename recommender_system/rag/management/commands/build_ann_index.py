@@ -0,0 +1,71 @@
+# rag/management/commands/build_ann_index.py
+import os
+import shutil
+
+import faiss
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from rag import docstore, sparse
+from rag.ann import INDEX_TYPES, build_ann_index, index_memory_bytes, write_search_params
+from rag.provider import provider, read_faiss_index, read_vectors
+
+# Everything except the index itself is shared with the source vector store;
+# rows keep their positions, so the docstore and BM25 index stay valid
+COPIED_FILES = (
+    "index.pkl",
+    docstore.HEADER_FILE, docstore.IDS_FILE, docstore.OFFSETS_FILE, docstore.BLOB_FILE,
+    sparse.VOCAB_FILE, sparse.POSTINGS_FILE,
+)
+
+
+class Command(BaseCommand):
+    help = "Rebuild dietary_reference_intakes as an IVF-Flat, HNSW or IVF-PQ index in a new directory"
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", type=str, help="Directory for the new vector store (use it via RAG_DB_PATH)")
+        parser.add_argument("--type", choices=INDEX_TYPES, default="hnsw", help="Index structure")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Source (flat) vector store directory")
+        parser.add_argument("--nlist", type=int, default=256, help="IVF: number of inverted lists")
+        parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW: links per node")
+        parser.add_argument("--ef-construction", type=int, default=200, help="HNSW: build-time beam width")
+        parser.add_argument("--pq-m", type=int, default=16, help="IVF-PQ: sub-quantizers (must divide the dimension)")
+        parser.add_argument("--pq-bits", type=int, default=8, help="IVF-PQ: bits per sub-quantizer code")
+        parser.add_argument("--train-size", type=int, default=None, help="IVF: vectors sampled for training")
+        parser.add_argument("--search-params", type=str, default="",
+                            help='Saved search-time parameters, e.g. "nprobe=16" or "efSearch=64"')
+
+    def handle(self, *args, **options):
+        db_path, output = options["db_path"], options["output"]
+        if os.path.abspath(db_path) == os.path.abspath(output):
+            raise CommandError("Write the ANN index to a new directory, not over the flat index")
+
+        vectors = read_vectors(db_path)
+        if vectors is None:
+            source = read_faiss_index(db_path)
+            vectors = source.reconstruct_n(0, source.ntotal)
+            metric = source.metric_type
+        else:
+            metric = read_faiss_index(db_path, mmap=True).metric_type
+
+        build_params = {
+            key: options[key] for key in ("nlist", "hnsw_m", "ef_construction", "pq_m", "pq_bits", "train_size")
+        }
+        self.stdout.write(f"Building {options['type']} over {vectors.shape[0]} x {vectors.shape[1]} vectors...")
+        try:
+            index = build_ann_index(vectors, options["type"], metric=metric, **build_params)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        os.makedirs(output, exist_ok=True)
+        faiss.write_index(index, os.path.join(output, "index.faiss"))
+        write_search_params(output, options["type"], build_params, options["search_params"])
+        # IVF/PQ cannot reconstruct candidates cheaply; MMR reads them from here instead
+        np.save(os.path.join(output, "vectors.npy"), np.asarray(vectors, dtype=np.float32))
+        for name in COPIED_FILES:
+            if os.path.exists(os.path.join(db_path, name)):
+                shutil.copy2(os.path.join(db_path, name), os.path.join(output, name))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {options['type']} index ({index_memory_bytes(index) / 1024 / 1024:.1f} MB) to {output}"
+        ))
@@ -0,0 +1,32 @@
+# rag/management/commands/build_sparse_index.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from rag.docstore import iter_documents
+from rag.provider import provider
+from rag.sparse import SparseIndex
+
+
+class Command(BaseCommand):
+    help = "Build the BM25 inverted index (sparse.npz) used by hybrid retrieval (RAG_HYBRID=1)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        db_path = options["db_path"]
+
+        start = time.perf_counter()
+        texts = [doc.page_content for _, doc in iter_documents(db_path)]
+        read_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = SparseIndex.build(texts)
+        build_seconds = time.perf_counter() - start
+
+        index.save(db_path)
+        self.stdout.write(f"Read {len(texts)} chunks in {read_seconds * 1000:.0f} ms")
+        self.stdout.write(f"Indexed {len(index.vocab)} terms / {len(index.doc_ids)} postings in {build_seconds * 1000:.0f} ms "
+                          f"({len(texts) / max(build_seconds, 1e-9):.0f} chunks/s, {index.nbytes() / 1024 / 1024:.1f} MB)")
+        self.stdout.write(self.style.SUCCESS(f"Wrote sparse index to {db_path}"))
@@ -0,0 +1,36 @@
+# rag/management/commands/export_docstore.py
+import os
+import pickle
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.docstore import write_columnar_docstore
+from rag.provider import provider
+
+
+class Command(BaseCommand):
+    help = "Convert the pickled index.pkl docstore into the lazily read columnar docstore format"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        db_path = options["db_path"]
+        pkl_path = os.path.join(db_path, "index.pkl")
+        if not os.path.exists(pkl_path):
+            raise CommandError(f"{pkl_path} not found")
+
+        # One-off trusted conversion; serving never unpickles again afterwards
+        with open(pkl_path, "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+        def items():
+            for position in range(len(index_to_docstore_id)):
+                doc_id = index_to_docstore_id[position]
+                doc = docstore.search(doc_id)
+                if isinstance(doc, str):
+                    raise CommandError(f"Docstore is missing {doc_id} (index position {position})")
+                yield doc_id, doc
+
+        count = write_columnar_docstore(db_path, items())
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} chunks to columnar docstore in {db_path}"))
@@ -0,0 +1,27 @@
+# rag/management/commands/export_index_vectors.py
+import os
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from rag.provider import provider, read_faiss_index
+
+
+class Command(BaseCommand):
+    help = "Write the index's embedding matrix to vectors.npy so workers can memory-map it read-only"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+
+    def handle(self, *args, **options):
+        db_path = options["db_path"]
+        index = read_faiss_index(db_path)
+        vectors = index.reconstruct_n(0, index.ntotal).astype(np.float32)
+
+        # Write next to the index, then swap in atomically so running workers keep their mapping
+        path = os.path.join(db_path, "vectors.npy")
+        tmp_path = path + ".tmp.npy"
+        np.save(tmp_path, vectors)
+        os.replace(tmp_path, path)
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {vectors.shape[0]} x {vectors.shape[1]} vectors to {path}"))
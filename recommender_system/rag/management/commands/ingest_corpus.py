@@ -0,0 +1,106 @@
+# rag/management/commands/ingest_corpus.py
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rag.ingest import apply_changes, chunk_files, discover_files, embed_texts, indexed_ids, indexed_vectors
+from rag.models import SourceDocument
+from rag.provider import provider
+
+
+class Command(BaseCommand):
+    help = "Incrementally ingest guideline documents: embed only new/changed chunks and update the index in place"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source_dir", type=str, help="Directory of .txt/.md/.pdf guideline documents")
+        parser.add_argument("--source", type=str, default=None,
+                            help="Source label (NIH / NASEM / ...); chunks under this label missing from source_dir are deleted")
+        parser.add_argument("--db-path", type=str, default=provider.db_path, help="Vector store directory")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument("--chunk-overlap", type=int, default=200)
+        parser.add_argument("--workers", type=int, default=None, help="Chunking processes (default: CPU count)")
+        parser.add_argument("--batch-size", type=int, default=64, help="Texts per Ollama embed call")
+        parser.add_argument("--embed-workers", type=int, default=2, help="Embed calls in flight")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+
+    def handle(self, *args, **options):
+        source_dir = options["source_dir"]
+        if not os.path.isdir(source_dir):
+            raise CommandError(f"{source_dir} is not a directory")
+        source = options["source"] or os.path.basename(os.path.normpath(source_dir))
+        db_path = options["db_path"]
+        timings = {}
+
+        # ---- Chunk + hash ----
+        start = time.perf_counter()
+        paths = discover_files(source_dir)
+        chunks = chunk_files(paths, source_dir, options["chunk_size"], options["chunk_overlap"], options["workers"])
+        timings["chunk"] = time.perf_counter() - start
+
+        # ---- Diff against the index and this source's SourceDocument rows ----
+        scanned = {chunk["content_hash"]: chunk for chunk in chunks}
+        in_index = set(indexed_ids(db_path))
+        managed = set(
+            SourceDocument.objects.filter(source=source, content_hash__isnull=False)
+            .values_list("content_hash", flat=True)
+        )
+        new_chunks = [chunk for content_hash, chunk in scanned.items() if content_hash not in in_index]
+        # Already indexed for another source: this source owns it too, nothing to embed
+        adopted = [chunk for content_hash, chunk in scanned.items()
+                   if content_hash in in_index and content_hash not in managed]
+        dropped = managed - set(scanned)
+        # A dropped chunk another source still has stays in the index
+        shared = set(
+            SourceDocument.objects.filter(content_hash__in=dropped).exclude(source=source)
+            .values_list("content_hash", flat=True)
+        )
+        remove_ids = dropped - shared
+
+        self.stdout.write(
+            f"{len(paths)} files, {len(chunks)} chunks: {len(new_chunks)} new, {len(adopted)} shared with other sources, "
+            f"{len(scanned) - len(new_chunks) - len(adopted)} unchanged, {len(dropped)} deleted "
+            f"({len(shared)} kept for other sources)"
+        )
+        if options["dry_run"] or not (new_chunks or adopted or dropped):
+            self.stdout.write(self.style.SUCCESS("Nothing to do." if not options["dry_run"] else "Dry run."))
+            return
+
+        # ---- Embed only what changed ----
+        start = time.perf_counter()
+        embedder = getattr(provider.embeddings, "embeddings", provider.embeddings)  # skip the query cache
+        try:
+            vectors = embed_texts(embedder, [chunk["text"] for chunk in new_chunks],
+                                  options["batch_size"], options["embed_workers"])
+        except Exception as e:
+            raise CommandError(f"Embedding failed, nothing was changed: {e}")
+        timings["embed"] = time.perf_counter() - start
+
+        # ---- Update index, docstore and rows ----
+        start = time.perf_counter()
+        adopted_vectors = indexed_vectors(db_path, [chunk["content_hash"] for chunk in adopted])
+        try:
+            total = apply_changes(db_path, remove_ids, new_chunks, vectors, source)
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        rows = list(zip(new_chunks, vectors)) + [(chunk, adopted_vectors[chunk["content_hash"]]) for chunk in adopted]
+        with transaction.atomic():
+            SourceDocument.objects.filter(source=source, content_hash__in=dropped).delete()
+            SourceDocument.objects.bulk_create([
+                SourceDocument(
+                    title=chunk["title"],
+                    text=chunk["text"],
+                    embedding=vector.tobytes(),
+                    source=source,
+                    content_hash=chunk["content_hash"],
+                    chunk_index=chunk["chunk_index"],
+                )
+                for chunk, vector in rows
+                if chunk["content_hash"] not in managed
+            ])
+        timings["update"] = time.perf_counter() - start
+
+        self.stdout.write(" ".join(f"{name}: {seconds:.2f}s" for name, seconds in timings.items()))
+        self.stdout.write(self.style.SUCCESS(f"Vector store now holds {total} chunks."))
@@ -0,0 +1,166 @@
+# rag/management/commands/load_test.py
+import asyncio
+import collections
+import copy
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from rag.benchmarks import percentile
+
+
+SAMPLE_PATIENT = {
+    "sex": "female", "age": 78, "height_cm": 152, "weight_kg": 49, "activity_level": 1.0,
+    "meal": {"meal_name": "Congee with pickled vegetables", "consumed_weight_g": 300},
+}
+
+# Endpoint presets: (method, path, JSON body)
+ENDPOINTS = {
+    "rag": ("POST", "/api/rag/query/", {"query": "78-year-old woman, congee and pickled vegetables for lunch; low protein?"}),
+    "rag-tr-cn": ("POST", "/api/rag/query/tr-cn/", {"query": "78-year-old woman, congee and pickled vegetables for lunch; low protein?"}),
+    "rag-bilingual": ("POST", "/api/rag/query/bilingual/", {"query": "78-year-old woman, congee and pickled vegetables for lunch; low protein?"}),
+    "prompt": ("POST", "/api/ollama/chat/prompt/", {"prompt": "Name three calcium-rich foods for older adults."}),
+    "ingredients": ("POST", "/api/ollama/generate-ingredients-from-meal/", {"meal_text": "Stir-fried chicken with broccoli and garlic sauce"}),
+    "recommendations": ("POST", "/api/recommendations/generate/", SAMPLE_PATIENT),
+}
+
+# Fields made unique per request by --vary
+VARY_FIELDS = ("query", "prompt", "meal_text")
+
+
+def vary(body, n):
+    """Copy of body with a request number appended, so no response cache can answer it."""
+    body = copy.deepcopy(body)
+    for field in VARY_FIELDS:
+        if isinstance(body.get(field), str):
+            body[field] += f" (request {n})"
+    if isinstance(body.get("meal"), dict) and isinstance(body["meal"].get("meal_name"), str):
+        body["meal"]["meal_name"] += f" (request {n})"
+    return body
+
+
+class Command(BaseCommand):
+    help = "Fire concurrent requests at LLM-backed endpoints; report throughput and latency per concurrency level"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", type=str, default="http://127.0.0.1:8000")
+        parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), nargs="+", default=["prompt"],
+                            help="One or more presets, measured one after the other")
+        parser.add_argument("--mix", action="store_true",
+                            help="Send the --endpoint presets together, interleaved, at each level")
+        parser.add_argument("--body", type=str, default=None, help="JSON body overriding the preset (one endpoint)")
+        parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 8, 32, 128])
+        parser.add_argument("--requests", type=int, default=None, help="Requests per level (default: 2 x concurrency)")
+        parser.add_argument("--timeout", type=float, default=300)
+        parser.add_argument("--priority", choices=["interactive", "batch"], default=None,
+                            help="Send X-LLM-Priority (scheduler lane)")
+        parser.add_argument("--vary", action="store_true",
+                            help="Make every request body unique (bypasses the response caches)")
+        parser.add_argument("--output", type=str, default=None, help="Also write the results as JSON to this file")
+
+    def handle(self, *args, **options):
+        targets = {}
+        for name in options["endpoint"]:
+            method, path, body = ENDPOINTS[name]
+            targets[name] = (method, options["base_url"].rstrip("/") + path, body)
+        if options["body"]:
+            if len(targets) > 1:
+                raise CommandError("--body needs exactly one --endpoint")
+            try:
+                name = options["endpoint"][0]
+                targets[name] = targets[name][:2] + (json.loads(options["body"]),)
+            except ValueError as e:
+                raise CommandError(f"--body is not valid JSON: {e}")
+        headers = {"X-LLM-Priority": options["priority"]} if options["priority"] else {}
+
+        # Each group is measured on its own: every preset separately, or all of them mixed
+        groups = [dict(targets)] if options["mix"] else [{name: target} for name, target in targets.items()]
+        rows = []
+        for group in groups:
+            for name, (method, url, _) in group.items():
+                self.stdout.write(f"{name}: {method} {url}")
+            self.stdout.write("%-16s %7s %6s %6s %9s %9s %9s %9s" % (
+                "endpoint", "conc", "ok", "errors", "req/s", "p50 s", "p95 s", "p99 s"))
+            for concurrency in options["concurrency"]:
+                count = options["requests"] or concurrency * 2
+                seconds, results = asyncio.run(
+                    self._level(group, headers, concurrency, count, options["timeout"], options["vary"])
+                )
+                for name, result in results.items():
+                    rows.append(self._report(name, concurrency, seconds, result))
+                if len(results) > 1:
+                    total = {"timings": [], "ok": 0, "errors": 0, "statuses": collections.Counter(), "first_error": None}
+                    for result in results.values():
+                        total["timings"] += result["timings"]
+                        total["ok"] += result["ok"]
+                        total["errors"] += result["errors"]
+                        total["statuses"].update(result["statuses"])
+                    rows.append(self._report("all", concurrency, seconds, total))
+            self.stdout.write("")
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(rows, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def _report(self, name, concurrency, seconds, result):
+        timings = result["timings"]
+        row = {
+            "endpoint": name, "concurrency": concurrency, "requests": len(timings),
+            "ok": result["ok"], "errors": result["errors"],
+            "req_per_s": round(len(timings) / seconds, 3),
+            "p50_s": round(percentile(timings, 50), 4),
+            "p95_s": round(percentile(timings, 95), 4),
+            "p99_s": round(percentile(timings, 99), 4),
+            "statuses": {str(code): n for code, n in result["statuses"].items()},
+        }
+        self.stdout.write("%-16s %7d %6d %6d %9.2f %9.2f %9.2f %9.2f" % (
+            name, concurrency, row["ok"], row["errors"], row["req_per_s"], row["p50_s"], row["p95_s"], row["p99_s"]))
+        if result["errors"]:
+            # 429/503 are scheduler rejections (with Retry-After), not failures
+            self.stdout.write(f"{'':16} statuses: " + ", ".join(
+                f"{code}={n}" for code, n in sorted(result["statuses"].items(), key=lambda item: str(item[0]))))
+            if result["first_error"]:
+                self.stdout.write(f"{'':16} first error: {result['first_error']}")
+        return row
+
+    async def _level(self, targets, headers, concurrency, count, timeout, vary_bodies=False):
+        import httpx
+
+        results = {
+            name: {"timings": [], "ok": 0, "errors": 0, "statuses": collections.Counter(), "first_error": None}
+            for name in targets
+        }
+        names = list(targets)
+        semaphore = asyncio.Semaphore(concurrency)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+        async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+            async def one(name, n):
+                method, url, body = targets[name]
+                if vary_bodies:
+                    body = vary(body, n)
+                result = results[name]
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        response = await client.request(method, url, json=body, headers=headers)
+                        result["statuses"][response.status_code] += 1
+                        success = response.status_code < 400
+                        if not success and result["first_error"] is None:
+                            result["first_error"] = f"{response.status_code} {response.text[:200]}"
+                    except httpx.HTTPError as e:
+                        success = False
+                        result["statuses"][type(e).__name__] += 1
+                        if result["first_error"] is None:
+                            result["first_error"] = f"{type(e).__name__}: {e}"
+                    result["timings"].append(time.perf_counter() - start)
+                    result["ok" if success else "errors"] += 1
+
+            start = time.perf_counter()
+            # Round-robin over the presets when mixed
+            await asyncio.gather(*(one(names[i % len(names)], f"{time.time():.0f}-{i}") for i in range(count)))
+            seconds = time.perf_counter() - start
+
+        return seconds, results
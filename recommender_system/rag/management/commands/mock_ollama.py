@@ -0,0 +1,35 @@
+# rag/management/commands/mock_ollama.py
+from django.core.management.base import BaseCommand
+
+from ollama_llm.mock import MockConfig, serve
+
+
+class Command(BaseCommand):
+    help = "Serve a mock Ollama API (generate/chat/embed) with configurable latency, token rate and failures"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", type=str, default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=11435)
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+        parser.add_argument("--token-rate", type=float, default=40.0, help="Tokens per second per request (0: no delay)")
+        parser.add_argument("--embed-latency", type=float, default=0.01, help="Seconds per embed call")
+        parser.add_argument("--embed-dim", type=int, default=768, help="Must match the FAISS index dimension")
+        parser.add_argument("--parallel", type=int, default=4, help="Requests generating at once (OLLAMA_NUM_PARALLEL)")
+        parser.add_argument("--load-seconds", type=float, default=0.0, help="Cold model load time")
+        parser.add_argument("--think-tokens", type=int, default=0, help="Length of a <think> block before answers")
+        parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with --fail-status")
+        parser.add_argument("--fail-status", type=int, default=500)
+        parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of streams cut off halfway")
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        config = MockConfig(
+            latency=options["latency"], token_rate=options["token_rate"], embed_latency=options["embed_latency"],
+            embed_dim=options["embed_dim"], parallel=options["parallel"], load_seconds=options["load_seconds"],
+            fail_rate=options["fail_rate"], fail_status=options["fail_status"], drop_rate=options["drop_rate"],
+            think_tokens=options["think_tokens"], seed=options["seed"],
+        )
+        try:
+            serve(options["host"], options["port"], config)
+        except KeyboardInterrupt:
+            pass
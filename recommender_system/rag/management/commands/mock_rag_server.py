@@ -0,0 +1,114 @@
+# rag/management/commands/mock_rag_server.py
+import asyncio
+import json
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand
+
+from ollama_llm.mock import MOCK_ANSWER, MOCK_ANSWER_TR_CN
+from rag.ws_protocol import ProtocolError, parse_frame
+
+
+class Command(BaseCommand):
+    help = ("Serve a mock of start_server.py's websocket protocol (plain text, or JSON request/cancel "
+            "envelopes answered by id with token and final frames) for load tests")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", type=str, default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=25002)
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds before generation starts")
+        parser.add_argument("--token-rate", type=float, default=40.0, help="Tokens per second (0: no delay)")
+        parser.add_argument("--parallel", type=int, default=1,
+                            help="Questions answered at once; start_server.py answers one at a time")
+        parser.add_argument("--fail-rate", type=float, default=0.0,
+                            help="Fraction of questions failed: plain ones close with 1011, framed ones get an error frame")
+        parser.add_argument("--seed", type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(self._serve(options))
+        except KeyboardInterrupt:
+            pass
+
+    async def _serve(self, options):
+        from websockets.asyncio.server import serve
+        from websockets.exceptions import ConnectionClosed
+
+        rng = random.Random(options["seed"])
+        slots = asyncio.Semaphore(max(1, options["parallel"]))
+        delay = 1.0 / options["token_rate"] if options["token_rate"] > 0 else 0.0
+        counts = {"questions": 0, "answered": 0, "failed": 0, "cancelled": 0}
+
+        async def one(websocket, frame):
+            request_id = frame.get("id")
+            request_options = frame.get("options") or {}
+            text = MOCK_ANSWER_TR_CN if request_options.get("language") == "tr-cn" else MOCK_ANSWER
+            stream = frame["type"] == "request" and request_options.get("stream", True)
+            started = time.perf_counter()
+            try:
+                async with slots:
+                    await asyncio.sleep(options["latency"])
+                    for token in re.findall(r"\S+\s*", text):
+                        if stream:
+                            await websocket.send(json.dumps(
+                                {"type": "token", "id": request_id, "stage": "answer", "text": token}, ensure_ascii=False))
+                        await asyncio.sleep(delay)
+                    failed = rng.random() < options["fail_rate"]
+                counts["failed" if failed else "answered"] += 1
+                if frame["type"] == "plain":
+                    if failed:
+                        await websocket.close(1011, "mock failure")
+                        return
+                    await websocket.send(text)
+                elif failed:
+                    await websocket.send(json.dumps({"type": "error", "id": request_id, "error": "mock failure"}))
+                else:
+                    await websocket.send(json.dumps({
+                        "type": "final", "id": request_id, "result": text, "cached": False,
+                        "timings": {"total_ms": round((time.perf_counter() - started) * 1000, 1)},
+                    }, ensure_ascii=False))
+            except ConnectionClosed:
+                return
+            if counts["answered"] % 100 == 0:
+                self.stdout.write(f"[INFO] {counts}")
+
+        async def cancelled(websocket, task, request_id):
+            task.cancel()
+            counts["cancelled"] += 1
+            try:
+                await websocket.send(json.dumps({"type": "cancelled", "id": request_id}))
+            except ConnectionClosed:
+                pass
+
+        async def answer(websocket):
+            running = {}
+            try:
+                async for message in websocket:
+                    # Same framing as start_server.py
+                    try:
+                        frame = parse_frame(message)
+                    except ProtocolError as e:
+                        await websocket.send(json.dumps({"type": "error", "id": e.request_id, "error": str(e)}))
+                        continue
+                    if frame["type"] == "plain":
+                        # Plain text: one at a time, answers in order
+                        counts["questions"] += 1
+                        await one(websocket, frame)
+                    elif frame["type"] == "cancel":
+                        task = running.pop(frame["id"], None)
+                        if task is not None and not task.done():
+                            await cancelled(websocket, task, frame["id"])
+                    else:
+                        counts["questions"] += 1
+                        task = asyncio.create_task(one(websocket, frame))
+                        running[frame["id"]] = task
+                        task.add_done_callback(lambda _, request_id=frame["id"]: running.pop(request_id, None))
+            finally:
+                for task in list(running.values()):
+                    task.cancel()
+
+        async with serve(answer, options["host"], options["port"]):
+            self.stdout.write(f"[INFO] Mock RAG server listening on ws://{options['host']}:{options['port']}")
+            await asyncio.Future()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourcedocument',
+            name='chunk_index',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sourcedocument',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rag', '0002_sourcedocument_chunk_index_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sourcedocument',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='sourcedocument',
+            constraint=models.UniqueConstraint(fields=('source', 'content_hash'), name='rag_sourcedocument_source_hash'),
+        ),
+    ]
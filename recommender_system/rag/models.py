@@ -5,3 +5,12 @@ class SourceDocument(models.Model):
     text = models.TextField()
     embedding = models.BinaryField()  # vector stored raw
     source = models.CharField(max_length=100)  # NIH / NASEM
+    # Set for chunks managed by `manage.py ingest_corpus`; also the chunk's docstore id.
+    # Sources own their chunks separately, so the same hash may appear under two sources.
+    content_hash = models.CharField(max_length=64, db_index=True, null=True, blank=True)
+    chunk_index = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["source", "content_hash"], name="rag_sourcedocument_source_hash"),
+        ]
@@ -0,0 +1,262 @@
+# Lazily initialised embeddings / FAISS retriever / context assembler shared by
+# rag.services and start_server.py, which generate through the shared Ollama
+# client (ollama_llm.client). Nothing heavy (langchain, faiss, the index
+# itself) is imported or loaded until first use or an explicit warmup() call.
+import os
+import threading
+import time
+
+# Model names, URL and timeouts are shared with every other Ollama caller
+from ollama_llm.client import (
+    OLLAMA_BASE_URL, OLLAMA_EMBEDDING_MODEL as EMBEDDING_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_MODEL as LLM_MODEL,
+    OLLAMA_TIMEOUT,
+)
+
+#BASE_DIR = "/home/rochefym/projects/11172025_ver2_websockets"
+BASE_DIR = os.environ.get("RAG_BASE_DIR", "/home/k503/下載/20251124_Recommender_System-main/")
+DB_PATH = os.environ.get("RAG_DB_PATH", os.path.join(BASE_DIR, "dietary_reference_intakes"))
+
+# Memory-map index.faiss (and vectors.npy) read-only so every worker process
+# shares one physical copy through the page cache
+INDEX_MMAP = os.environ.get("RAG_INDEX_MMAP", "0") == "1"
+
+# "native" uses rag.retrieval.RetrievalEngine; "langchain" uses vector_store.as_retriever
+RETRIEVAL_ENGINE = os.environ.get("RAG_RETRIEVAL_ENGINE", "native")
+
+# Fuse BM25 (sparse.npz, built by `manage.py build_sparse_index`) with FAISS results
+HYBRID_SEARCH = os.environ.get("RAG_HYBRID", "0") == "1"
+
+RETRIEVER_SEARCH_KWARGS = {
+    "k": int(os.environ.get("RAG_RETRIEVER_K", "10")),          # fewer but higher-quality chunks
+    "fetch_k": int(os.environ.get("RAG_RETRIEVER_FETCH_K", "50")),   # how many to initially fetch before filtering
+    "lambda_mult": 1  # balance between diversity and relevance
+}
+
+
+# Function to format Retrieved documents from the vector store
+def format_docs(docs):
+    return "\n\n".join([doc.page_content for doc in docs])
+
+
+def read_faiss_index(db_path, mmap=False):
+    import faiss
+    from .ann import apply_search_params, read_search_params
+
+    path = os.path.join(db_path, "index.faiss")
+    if mmap:
+        # Flat codes are mapped straight from the file instead of copied to the heap
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+    else:
+        index = faiss.read_index(path)
+
+    # IVF / HNSW indexes built by `manage.py build_ann_index`: nprobe, efSearch, ...
+    return apply_search_params(index, os.environ.get("RAG_INDEX_SEARCH_PARAMS") or read_search_params(db_path))
+
+
+def read_vectors(db_path, mmap=False):
+    # Optional float32 (ntotal, dim) matrix written by `manage.py export_index_vectors`
+    import numpy as np
+
+    path = os.path.join(db_path, "vectors.npy")
+    if not os.path.exists(path):
+        return None
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+class RagProvider:
+    def __init__(self, db_path=DB_PATH, cache_dir=BASE_DIR, mmap=INDEX_MMAP):
+        self.db_path = db_path
+        self.cache_dir = cache_dir
+        self.mmap = mmap
+        self.vectors = None
+
+        self._lock = threading.RLock()
+        self._embeddings = None
+        self._vector_store = None
+        self._engine = None
+        self._retriever = None
+        self._context_assembler = False  # False: not built yet; None: disabled
+
+        # Seconds spent building each component, for the startup benchmark
+        self.load_seconds = {}
+
+    def _timed(self, name, build):
+        start = time.perf_counter()
+        value = build()
+        self.load_seconds[name] = round(time.perf_counter() - start, 4)
+        return value
+
+    # ======= COMPONENTS =======
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = self._timed("embeddings", self._build_embeddings)
+        return self._embeddings
+
+    @property
+    def vector_store(self):
+        if self._vector_store is None:
+            embeddings = self.embeddings
+            with self._lock:
+                if self._vector_store is None:
+                    self._vector_store = self._timed("vector_store", lambda: self._load_vector_store(embeddings))
+        return self._vector_store
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            vector_store = self.vector_store
+            with self._lock:
+                if self._engine is None:
+                    from .batching import query_batcher_from_env
+                    from .retrieval import RetrievalEngine
+                    from .sparse import SparseIndex, has_sparse_index
+
+                    sparse = None
+                    if HYBRID_SEARCH and has_sparse_index(self.db_path):
+                        sparse = self._timed("sparse_index", lambda: SparseIndex.load(self.db_path))
+                    elif HYBRID_SEARCH:
+                        print(f"[WARN] RAG_HYBRID=1 but {self.db_path} has no sparse index: hybrid retrieval is OFF "
+                              f"and only dense search is used. Run `manage.py build_sparse_index --db-path {self.db_path}`.")
+
+                    engine = RetrievalEngine.from_vector_store(
+                        vector_store, vectors=self.vectors, sparse=sparse, **RETRIEVER_SEARCH_KWARGS
+                    )
+                    engine.batcher = query_batcher_from_env(engine)
+                    self._engine = engine
+        return self._engine
+
+    @property
+    def retriever(self):
+        if self._retriever is None:
+            if RETRIEVAL_ENGINE == "langchain":
+                retriever = self.vector_store.as_retriever(
+                    search_type="mmr",
+                    search_kwargs=RETRIEVER_SEARCH_KWARGS
+                )
+            else:
+                from .retrieval import EngineRetriever
+
+                retriever = EngineRetriever(engine=self.engine)
+            with self._lock:
+                if self._retriever is None:
+                    self._retriever = retriever
+        return self._retriever
+
+    @property
+    def context_assembler(self):
+        if self._context_assembler is False:
+            from .context import context_assembler_from_env
+
+            with self._lock:
+                if self._context_assembler is False:
+                    self._context_assembler = context_assembler_from_env()
+        return self._context_assembler
+
+    def build_context(self, question):
+        assembler = self.context_assembler
+        if assembler is None:
+            return format_docs(self.retriever.invoke(question))
+
+        if RETRIEVAL_ENGINE == "langchain":
+            # as_retriever() returns no scores; only dedupe and budget apply
+            scored_docs = [(doc, None) for doc in self.retriever.invoke(question)]
+        else:
+            scored_docs = self.engine.search_with_scores(question)
+
+        context, report = assembler.assemble(scored_docs)
+        print(
+            f"[INFO] RAG context: {report['chunks_in']} -> {report['chunks_out']} chunks, "
+            f"{report['tokens_in']} -> {report['tokens_out']} tokens (saved {report['tokens_saved']})"
+        )
+        return context
+
+    def context_fingerprint(self):
+        assembler = self.context_assembler
+        return assembler.fingerprint() if assembler is not None else "context:all"
+
+    # ======= BUILDERS =======
+    def _build_embeddings(self):
+        from langchain_ollama import OllamaEmbeddings
+        from .embedding_cache import cached_embeddings_from_env
+
+        # Query vectors are cached in memory and on disk
+        return cached_embeddings_from_env(
+            OllamaEmbeddings(model=EMBEDDING_MODEL, base_url=OLLAMA_BASE_URL, keep_alive=OLLAMA_KEEP_ALIVE,
+                             client_kwargs={"timeout": OLLAMA_TIMEOUT}),
+            EMBEDDING_MODEL,
+            self.cache_dir,
+        )
+
+    def _load_vector_store(self, embeddings):
+        from langchain_community.vectorstores import FAISS
+
+        if not os.path.isdir(self.db_path):
+            raise RuntimeError(
+                f"Vector store not found at {self.db_path}. "
+                "Download dietary_reference_intakes (see README) or set RAG_DB_PATH."
+            )
+        from .docstore import ColumnarDocstore, has_columnar_docstore
+
+        index = read_faiss_index(self.db_path, mmap=self.mmap)
+        self.vectors = read_vectors(self.db_path, mmap=self.mmap)
+
+        if has_columnar_docstore(self.db_path):
+            # Pickle-free: chunk text is read lazily from docstore.blob by id
+            docstore = ColumnarDocstore(self.db_path)
+            return FAISS(embeddings, index, docstore, docstore.index_to_docstore_id())
+
+        # Legacy index.pkl (same as FAISS.load_local): unpickles the whole
+        # InMemoryDocstore. Run `manage.py export_docstore` once to switch formats.
+        import pickle
+
+        with open(os.path.join(self.db_path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+    # ======= LIFECYCLE =======
+    def warmup(self):
+        # Explicit hook for process start; raises if the index cannot be loaded.
+        # The prompts are plain format strings and the Ollama models are kept
+        # loaded by ollama_llm.residency, so only the retrieval side is built.
+        self.retriever
+        self.context_assembler
+        return dict(self.load_seconds)
+
+    def warmup_in_background(self):
+        def run():
+            try:
+                print("[INFO] RAG warmup finished:", self.warmup())
+            except Exception as e:
+                print(f"[WARN] RAG warmup failed: {e}")
+
+        thread = threading.Thread(target=run, name="rag-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def embedding_stats(self):
+        return self._embeddings.stats() if self._embeddings is not None else {}
+
+    def context_stats(self):
+        assembler = self.context_assembler
+        return assembler.stats() if assembler is not None else {}
+
+    def batching_stats(self):
+        batcher = self._engine.batcher if self._engine is not None else None
+        return batcher.stats() if batcher is not None else {}
+
+    def status(self):
+        return {
+            "db_path": self.db_path,
+            "mmap": self.mmap,
+            "retrieval_engine": RETRIEVAL_ENGINE,
+            "hybrid": self._engine is not None and self._engine.sparse is not None,
+            "embeddings_loaded": self._embeddings is not None,
+            "vector_store_loaded": self._vector_store is not None,
+            "load_seconds": dict(self.load_seconds),
+        }
+
+
+provider = RagProvider()
@@ -0,0 +1,182 @@
+# Native retrieval engine for the FAISS vector store.
+#
+# Same contract as vector_store.as_retriever(search_type="mmr", ...), but:
+# - lambda_mult >= 1 is pure relevance ranking, so it is answered with a
+#   single top-k index search instead of fetch_k + MMR re-ranking;
+# - real MMR runs over the fetch_k candidate matrix in NumPy (one
+#   similarity matrix, O(k * fetch_k) selection) instead of per-candidate
+#   reconstruct() calls and a Python double loop;
+# - with a rag.sparse.SparseIndex attached, BM25 and dense rankings are
+#   fused by reciprocal rank fusion before the final top-k / MMR step;
+# - with a rag.batching.MicroBatcher attached, concurrent queries share one
+#   embedding call and one multi-query index search.
+#
+# Results are (Document, relevance) pairs, higher = more relevant: cosine
+# similarity for dense-only search (embeddings are unit length), the RRF
+# score for hybrid search.
+from typing import Any, List
+
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .sparse import reciprocal_rank_fusion
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def mmr_select(query_vector, candidates, k, lambda_mult):
+    """Indices into `candidates` chosen by maximal marginal relevance (cosine)."""
+    count = len(candidates)
+    k = min(k, count)
+    if k <= 0:
+        return []
+
+    unit = _normalize_rows(np.asarray(candidates, dtype=np.float32))
+    query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    query_norm = np.linalg.norm(query)
+    query = query / query_norm if query_norm else query
+
+    relevance = unit @ query
+    pairwise = unit @ unit.T
+
+    selected = [int(np.argmax(relevance))]
+    chosen = np.zeros(count, dtype=bool)
+    chosen[selected[0]] = True
+    # Highest similarity of every candidate to anything already selected
+    redundancy = pairwise[selected[0]].copy()
+
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[chosen] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        chosen[best] = True
+        np.maximum(redundancy, pairwise[best], out=redundancy)
+
+    return selected
+
+
+class RetrievalEngine:
+    def __init__(self, index, docstore, index_to_docstore_id, embeddings, vectors=None,
+                 k=10, fetch_k=50, lambda_mult=1, sparse=None, batcher=None):
+        self.index = index
+        self.docstore = docstore
+        self.index_to_docstore_id = index_to_docstore_id
+        self.embeddings = embeddings
+        self.vectors = vectors
+        self.k = k
+        self.fetch_k = fetch_k
+        self.lambda_mult = lambda_mult
+        self.sparse = sparse
+        # rag.batching.MicroBatcher over search_with_scores_many(), or None
+        self.batcher = batcher
+
+    @classmethod
+    def from_vector_store(cls, vector_store, vectors=None, sparse=None, **search_kwargs):
+        return cls(
+            vector_store.index,
+            vector_store.docstore,
+            vector_store.index_to_docstore_id,
+            vector_store.embeddings,
+            vectors=vectors,
+            sparse=sparse,
+            **search_kwargs,
+        )
+
+    def search(self, query):
+        return [doc for doc, _ in self.search_with_scores(query)]
+
+    def search_with_scores(self, query):
+        if self.batcher is not None:
+            # Shares one embed call and one index search with concurrent requests
+            return self.batcher.submit(query)
+        query_vector = self.embeddings.embed_query(query)
+        return self.search_by_vector(query_vector, query_text=query)
+
+    def search_with_scores_many(self, queries):
+        """search_with_scores() for several queries: one embedding batch, one multi-query index search."""
+        query_vectors = self.embeddings.embed_documents(list(queries))
+        return [
+            self._documents(positions, scores)
+            for positions, scores in self.rank_many(query_vectors, query_texts=queries)
+        ]
+
+    def search_by_vector(self, query_vector, k=None, fetch_k=None, lambda_mult=None, query_text=None):
+        positions, scores = self.rank(query_vector, k, fetch_k, lambda_mult, query_text)
+        return self._documents(positions, scores)
+
+    def rank(self, query_vector, k=None, fetch_k=None, lambda_mult=None, query_text=None):
+        """Index positions and relevance scores, best first, without touching the docstore."""
+        return self.rank_many([query_vector], k, fetch_k, lambda_mult, [query_text])[0]
+
+    def rank_many(self, query_vectors, k=None, fetch_k=None, lambda_mult=None, query_texts=None):
+        """rank() for a batch of queries, answered by a single index search."""
+        k = self.k if k is None else k
+        fetch_k = max(self.fetch_k if fetch_k is None else fetch_k, k)
+        lambda_mult = self.lambda_mult if lambda_mult is None else lambda_mult
+
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(len(query_vectors), -1)
+        query_texts = list(query_texts or [None] * len(queries))
+        hybrid = [self.sparse is not None and bool(text) for text in query_texts]
+        # No diversity term: MMR degenerates to top-k relevance
+        count = k if lambda_mult >= 1 and not any(hybrid) else fetch_k
+        distances, found_positions = self.index.search(queries, count)
+
+        ranked = []
+        for row, query in enumerate(queries):
+            if hybrid[row]:
+                positions, scores = self._hybrid_candidates(found_positions[row], query_texts[row], fetch_k)
+            else:
+                found = found_positions[row] >= 0
+                positions, scores = found_positions[row][found], self._relevance(distances[row][found])
+
+            if lambda_mult >= 1:
+                ranked.append((positions[:k], scores[:k]))
+                continue
+            picked = mmr_select(query, self.candidate_vectors(positions), k, lambda_mult)
+            ranked.append((positions[picked], scores[picked]))
+        return ranked
+
+    def _hybrid_candidates(self, dense, query_text, fetch_k):
+        sparse, _ = self.sparse.search(query_text, fetch_k)
+        positions, scores = reciprocal_rank_fusion([dense, sparse])
+        return np.asarray(positions[:fetch_k], dtype=np.int64), np.asarray(scores[:fetch_k], dtype=np.float32)
+
+    def _relevance(self, distances):
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return distances
+        # Squared L2 between unit vectors is 2 - 2 * cosine
+        return 1 - distances / 2
+
+    def candidate_vectors(self, positions):
+        if self.vectors is not None:
+            # Memory-mapped embedding matrix: one fancy-indexed read
+            return np.asarray(self.vectors[positions], dtype=np.float32)
+        return self.index.reconstruct_batch(positions.astype(np.int64))
+
+    def _documents(self, positions, scores):
+        results = []
+        for position, score in zip(positions, scores):
+            if position < 0:
+                continue
+            doc_id = self.index_to_docstore_id[int(position)]
+            doc = self.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for id {doc_id}, got {doc}")
+            results.append((doc, float(score)))
+        return results
+
+
+class EngineRetriever(BaseRetriever):
+    """Lets RetrievalEngine stand in for vector_store.as_retriever() in a chain."""
+
+    engine: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        return self.engine.search(query)
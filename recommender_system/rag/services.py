@@ -1,41 +1,20 @@
-# VECTOR STORE AND EMBEDDINGS
-from langchain_ollama import ChatOllama, OllamaEmbeddings
-from langchain_community.vectorstores import FAISS
-
-# PROMPTING
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-
+import asyncio
 import os
-from ollama_llm.services import get_ollama_llm_response
-
-# Load local LLM model from Ollama server
-# LLM Model: deepseek-r1:8b
-model = ChatOllama(model="deepseek-r1:8b", base_url="http://localhost:11434")
-
-# Initialize Ollama Embedding model
-embeddings = OllamaEmbeddings(model='nomic-embed-text:v1.5', base_url="http://localhost:11434")
-
-# Load vector database
-#BASE_DIR = "/home/rochefym/projects/11172025_ver2_websockets"
-BASE_DIR = "/home/k503/下載/20251124_Recommender_System-main/"
-db_path = os.path.join(BASE_DIR, "dietary_reference_intakes")
-new_vector_store = FAISS.load_local(db_path, embeddings=embeddings, allow_dangerous_deserialization=True)
-
-# Create a vector store Retriever
-retriever = new_vector_store.as_retriever(
-    search_type="mmr",
-    search_kwargs={
-        "k": 10,          # fewer but higher-quality chunks
-        "fetch_k": 50,   # how many to initially fetch before filtering
-        "lambda_mult": 1  # balance between diversity and relevance
-    }
-)
+import threading
+from ollama_llm.client import OLLAMA_CHAIN_TIMEOUT, OLLAMA_MODEL, async_ollama, ollama
+from ollama_llm.output import aconsume, aguarded_stream, budget_for, budgets_fingerprint, consume, guarded_stream
+from ollama_llm.scheduler import OllamaBusy, scheduler
+from ollama_llm.services import aget_ollama_llm_response, get_ollama_llm_response
+from .cache import cache_from_env, corpus_fingerprint, prompt_fingerprint
+from .provider import provider
+from .translation import TRANSLATE_SEGMENTS_PROMPT_TEMPLATE, translation_memory_from_env
+
+# Embeddings and the FAISS vector store are loaded lazily by rag.provider on
+# first use (or by provider.warmup()), not at import time.
 
 # Prompt Template
 # Create detailed prompt for recommendation
-prompt = ChatPromptTemplate.from_template("""
+RAG_PROMPT_TEMPLATE = """
 You are a clinical nutrition assistant writing guidance for non-medical caregivers.
 
 TASK:
@@ -84,48 +63,258 @@ Context:
                                           
 FINAL CHECK:
 Return ONLY the formatted text exactly as specified above. No extra text.
-""")
-
+"""
 
-# Function to format Retrieved documents from the vector store
-def format_docs(docs):
-    return "\n\n".join([doc.page_content for doc in docs])
 
+# Single-pass variant of the prompt above: the answer comes out translated directly
+RAG_TRANSLATED_PROMPT_TEMPLATE = RAG_PROMPT_TEMPLATE.replace(
+    "FINAL CHECK:",
+    """LANGUAGE:
+Write the entire answer, including the section headings, in Traditional Chinese.
 
-# Define RAG chain
-rag_chain = (
-    {"context": retriever | format_docs, 
-     "question": RunnablePassthrough()}
-    | prompt
-    | model
-    | StrOutputParser()
+FINAL CHECK:""",
 )
 
+# "multi-pass" (default): RAG chain, then a second LLM call to summarize or translate its output.
+# "single-pass": one generation whose prompt already asks for the final format (and language).
+# "translation-memory": English answers as in single-pass; the Chinese routes translate that
+# answer through the translation memory, so only sentences not seen before reach the LLM.
+PIPELINE_MODES = ("multi-pass", "single-pass", "translation-memory")
+PIPELINE_MODE = os.environ.get("RAG_PIPELINE_MODE", "multi-pass")
+if PIPELINE_MODE not in PIPELINE_MODES:
+    print(f"[WARN] Unknown RAG_PIPELINE_MODE {PIPELINE_MODE!r}; using multi-pass")
+    PIPELINE_MODE = "multi-pass"
+
+
+# The RAG prompt (one user message) is generated through the shared client:
+# streamed under the stage's output budget (ollama_llm.output) and closed as
+# soon as the layout is complete, which also stops the Ollama request.
+def rag_prompt(question, template=RAG_PROMPT_TEMPLATE):
+    return template.format(question=question, context=provider.build_context(question))
+
+
+def stream_answer(prompt, stage):
+    return ollama.stream_text(prompt, options=budget_for(stage).options(), timeout=OLLAMA_CHAIN_TIMEOUT)
+
+
+def astream_answer(prompt, stage):
+    return async_ollama.stream_text(prompt, options=budget_for(stage).options(), timeout=OLLAMA_CHAIN_TIMEOUT)
+
+
+def _answer_stage(translate):
+    return "answer-tr-cn" if translate else "answer"
+
+
+def _require_answer(text, stage):
+    # num_predict counts the reasoning tokens too: a generation cut off inside
+    # <think> leaves no answer, which must fail rather than be cached
+    if not text:
+        raise RuntimeError(f"LLM returned no answer ({stage}); the output budget ran out while reasoning")
+    return text
+
 
-def generate_recommendation(question):
+def run_pipeline(question, translate=False, mode=None):
+    mode = mode or PIPELINE_MODE
+    # One scheduler slot for the whole pipeline; the second pass reuses it
+    with scheduler.slot():
+        if mode == "single-pass" or (mode == "translation-memory" and not translate):
+            # The RAG prompt's format rules and word limit already produce the summarized form
+            stage = _answer_stage(translate)
+            prompt = rag_prompt(question, RAG_TRANSLATED_PROMPT_TEMPLATE if translate else RAG_PROMPT_TEMPLATE)
+            return _require_answer(consume(stream_answer(prompt, stage), stage), stage)
+
+        results = _require_answer(consume(stream_answer(rag_prompt(question), "answer"), "answer"), "answer")
+        if translate:
+            return _require_answer(translate_text_with_ollama(results), "translate")
+        return _require_answer(summarize_text_with_ollama(results), "summarize")
+
+
+# Response cache in front of the chain, keyed on the normalized question
+response_cache = cache_from_env(embed_fn=lambda text: provider.embeddings.embed_query(text))
+
+
+def _cache_version():
+    # Cached answers are only valid for the corpus and prompts that produced them
+    return corpus_fingerprint(provider.db_path) + prompt_fingerprint(
+        PIPELINE_MODE,
+        RAG_PROMPT_TEMPLATE,
+        RAG_TRANSLATED_PROMPT_TEMPLATE,
+        SUMMARIZE_PROMPT_TEMPLATE,
+        TRANSLATE_PROMPT_TEMPLATE,
+        TRANSLATE_SEGMENTS_PROMPT_TEMPLATE if get_translation_memory() is not None else "",
+        provider.context_fingerprint(),
+        budgets_fingerprint(),
+    )
+
+
+def invalidate_response_cache():
+    response_cache.invalidate()
+
+
+def generate_recommendation(question, semantic=False):
+    # semantic=True only for free-text questions, never for patient queries (see ResponseCache)
     try:
-        results = rag_chain.invoke(question)
-        results = summarize_text_with_ollama(results)
+        response_cache.ensure_version(_cache_version())
+        cached = response_cache.get(question, namespace="summary", semantic=semantic)
+        if cached is not None:
+            return cached
+
+        results = run_pipeline(question)
 
+        response_cache.set(question, results, namespace="summary", semantic=semantic)
         return results
+    except OllamaBusy:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return Exception
     
     
-def generate_translated_recommendation(question):
+def generate_translated_recommendation(question, semantic=False):
     try:
-        results = rag_chain.invoke(question)
-        results = translate_text_with_ollama(results)
+        response_cache.ensure_version(_cache_version())
+        cached = response_cache.get(question, namespace="tr-cn", semantic=semantic)
+        if cached is not None:
+            return cached
 
+        results = run_pipeline(question, translate=True)
+
+        response_cache.set(question, results, namespace="tr-cn", semantic=semantic)
         return results
+    except OllamaBusy:
+        raise
     except Exception as e:
         print(f"Error: {e}")
         return Exception
     
 
-def summarize_text_with_ollama(text: str) -> str:
-    prompt = f"""Please provide a comprehensive summary with 150 or less words: 
+# ======= ASYNC =======
+# Same as above for the async views: the LLM calls are awaited, only retrieval
+# (a local FAISS search) and cache bookkeeping run in worker threads.
+async def arun_pipeline(question, translate=False, mode=None):
+    mode = mode or PIPELINE_MODE
+    async with scheduler.aslot():
+        if mode == "single-pass" or (mode == "translation-memory" and not translate):
+            stage = _answer_stage(translate)
+            template = RAG_TRANSLATED_PROMPT_TEMPLATE if translate else RAG_PROMPT_TEMPLATE
+            prompt = await asyncio.to_thread(rag_prompt, question, template)
+            return _require_answer(await aconsume(astream_answer(prompt, stage), stage), stage)
+
+        prompt = await asyncio.to_thread(rag_prompt, question)
+        results = _require_answer(await aconsume(astream_answer(prompt, "answer"), "answer"), "answer")
+        if translate:
+            return _require_answer(await atranslate_text_with_ollama(results), "translate")
+        return _require_answer(await asummarize_text_with_ollama(results), "summarize")
+
+
+async def _agenerate(question, translate, semantic=False):
+    namespace = "tr-cn" if translate else "summary"
+    try:
+        await asyncio.to_thread(response_cache.ensure_version, _cache_version())
+        cached = await asyncio.to_thread(response_cache.get, question, namespace, semantic)
+        if cached is not None:
+            return cached
+
+        results = await arun_pipeline(question, translate=translate)
+
+        await asyncio.to_thread(response_cache.set, question, results, namespace, semantic)
+        return results
+    except OllamaBusy:
+        raise
+    except Exception as e:
+        print(f"Error: {e}")
+        return Exception
+
+
+async def agenerate_recommendation(question, semantic=False):
+    return await _agenerate(question, translate=False, semantic=semantic)
+
+
+async def agenerate_translated_recommendation(question, semantic=False):
+    return await _agenerate(question, translate=True, semantic=semantic)
+
+
+# ======= STREAMING =======
+def _stream_prompt(question, translate):
+    # (RAG template, its output stage, second-pass template or None, its stage)
+    if PIPELINE_MODE == "single-pass" or (PIPELINE_MODE == "translation-memory" and not translate):
+        template = RAG_TRANSLATED_PROMPT_TEMPLATE if translate else RAG_PROMPT_TEMPLATE
+        return template, _answer_stage(translate), None, None
+    if translate:
+        return RAG_PROMPT_TEMPLATE, "answer", TRANSLATE_PROMPT_TEMPLATE, "translate"
+    return RAG_PROMPT_TEMPLATE, "answer", SUMMARIZE_PROMPT_TEMPLATE, "summarize"
+
+
+def stream_recommendation(question, translate=False, lane=None, semantic=False):
+    """Yields text chunks as they are generated; the full text is cached once complete."""
+    namespace = "tr-cn" if translate else "summary"
+    response_cache.ensure_version(_cache_version())
+    cached = response_cache.get(question, namespace=namespace, semantic=semantic)
+    if cached is not None:
+        yield cached
+        return
+
+    template, stage, second_pass, second_stage = _stream_prompt(question, translate)
+    parts = []
+    # The body runs after the view returned, so the lane is passed in explicitly
+    with scheduler.slot(lane):
+        prompt = rag_prompt(question, template)
+        if second_pass is None:
+            chunks = guarded_stream(stream_answer(prompt, stage), stage)
+        else:
+            # Only the second pass is what the caller sees, so only it is streamed
+            results = consume(stream_answer(prompt, stage), stage)
+            if second_stage == "translate" and get_translation_memory() is not None:
+                # Unseen segments are translated as one batch: one chunk
+                chunks = [translate_text_with_ollama(results)]
+            else:
+                chunks = guarded_stream(stream_answer(second_pass.format(text=results), second_stage), second_stage)
+
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    results = "".join(parts).strip()
+    # Nothing kept (cut off while reasoning): not cached, the next request generates again
+    if results:
+        response_cache.set(question, results, namespace=namespace, semantic=semantic)
+
+
+async def astream_recommendation(question, translate=False, lane=None, semantic=False):
+    namespace = "tr-cn" if translate else "summary"
+    # Cache lookups may embed the question (a blocking HTTP call)
+    await asyncio.to_thread(response_cache.ensure_version, _cache_version())
+    cached = await asyncio.to_thread(response_cache.get, question, namespace, semantic)
+    if cached is not None:
+        yield cached
+        return
+
+    template, stage, second_pass, second_stage = _stream_prompt(question, translate)
+    parts = []
+    async with scheduler.aslot(lane):
+        prompt = await asyncio.to_thread(rag_prompt, question, template)
+        if second_pass is None:
+            chunks = aguarded_stream(astream_answer(prompt, stage), stage)
+        else:
+            results = await aconsume(astream_answer(prompt, stage), stage)
+            if second_stage == "translate" and get_translation_memory() is not None:
+                chunks = _aiter([await atranslate_text_with_ollama(results)])
+            else:
+                chunks = aguarded_stream(astream_answer(second_pass.format(text=results), second_stage), second_stage)
+        async for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+    results = "".join(parts).strip()
+    if results:
+        await asyncio.to_thread(response_cache.set, question, results, namespace, semantic)
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+# Second-pass prompts used by multi-pass mode
+SUMMARIZE_PROMPT_TEMPLATE = """Please provide a comprehensive summary with 150 or less words: 
 {text}
 
 But keep the same format rules below
@@ -148,21 +337,86 @@ Caregiver Action Steps:
 3. Step three
 """
 
+TRANSLATE_PROMPT_TEMPLATE = "Please translate the following text into Traditional Chinese: \n\n{text}"
+
+
+def summarize_text_with_ollama(text: str) -> str:
+    prompt = SUMMARIZE_PROMPT_TEMPLATE.format(text=text)
+
     try:
-        response = get_ollama_llm_response(prompt)
+        response = get_ollama_llm_response(prompt, stage="summarize")
         return response
 
     except Exception as e:
         raise RuntimeError(f"Ollama summarization failed: {e}")
     
 
+# Sentence-level translation memory (rag.translation) in front of the translate pass,
+# opened on first use like rag.provider's components. None when RAG_TRANSLATION_MEMORY=0.
+# Entries are only valid for the model and prompt that produced them.
+_translation_memory = False  # False: not built yet
+_translation_memory_lock = threading.Lock()
+
+
+def get_translation_memory():
+    global _translation_memory
+    if _translation_memory is False:
+        with _translation_memory_lock:
+            if _translation_memory is False:
+                _translation_memory = translation_memory_from_env(
+                    provider.cache_dir, prompt_fingerprint(OLLAMA_MODEL, TRANSLATE_SEGMENTS_PROMPT_TEMPLATE)
+                )
+    return _translation_memory
+
+
+def set_translation_memory(memory):
+    # Benchmarks compare runs with a fresh memory and without one (None)
+    global _translation_memory
+    _translation_memory = memory
+
+
+def translation_stats():
+    # Does not open the memory just to report on it
+    return _translation_memory.stats() if _translation_memory else {}
+
+
+def _translate_full(text):
+    return get_ollama_llm_response(TRANSLATE_PROMPT_TEMPLATE.format(text=text), stage="translate")
+
+
+async def _atranslate_full(text):
+    return await aget_ollama_llm_response(TRANSLATE_PROMPT_TEMPLATE.format(text=text), stage="translate")
+
+
 def translate_text_with_ollama(text: str) -> str:
-    prompt = f"Please translate the following text into Traditional Chinese: \n\n{text}"
+    try:
+        translation_memory = get_translation_memory()
+        if translation_memory is not None:
+            return translation_memory.translate(
+                text, lambda prompt: get_ollama_llm_response(prompt, stage="translate-segments"), _translate_full
+            )
+        return _translate_full(text)
 
+    except Exception as e:
+        raise RuntimeError(f"Ollama translation failed: {e}")
+
+
+async def asummarize_text_with_ollama(text: str) -> str:
     try:
-        response = get_ollama_llm_response(prompt)
-        return response
+        return await aget_ollama_llm_response(SUMMARIZE_PROMPT_TEMPLATE.format(text=text), stage="summarize")
+    except Exception as e:
+        raise RuntimeError(f"Ollama summarization failed: {e}")
+
 
+async def atranslate_text_with_ollama(text: str) -> str:
+    try:
+        # The first call opens the sqlite store
+        translation_memory = await asyncio.to_thread(get_translation_memory)
+        if translation_memory is not None:
+            return await translation_memory.atranslate(
+                text, lambda prompt: aget_ollama_llm_response(prompt, stage="translate-segments"), _atranslate_full
+            )
+        return await _atranslate_full(text)
     except Exception as e:
         raise RuntimeError(f"Ollama translation failed: {e}")
 
@@ -194,7 +448,7 @@ Then translate the text into Traditional Chinese and only reply with the transla
 """
 
     try:
-        response = get_ollama_llm_response(prompt)
+        response = get_ollama_llm_response(prompt, stage="translate")
         return response
 
     except Exception as e:
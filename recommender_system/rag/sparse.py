@@ -0,0 +1,152 @@
+# BM25 inverted index over the corpus chunks, for hybrid sparse + dense retrieval.
+#
+# Exact nutrient names ("Vitamin B12 (mcg)", "Sodium (mg)", 膳食纖維) are matched
+# lexically here and fused with the FAISS ranking by reciprocal rank fusion.
+#
+# Files inside the vector store directory (rows follow FAISS index positions):
+#   sparse.vocab.json  list of terms; a term's id is its position
+#   sparse.npz         term_offsets (V+1), doc_ids, term_freqs, doc_lengths
+import json
+import os
+import re
+import unicodedata
+from collections import Counter
+
+import numpy as np
+
+
+VOCAB_FILE = "sparse.vocab.json"
+POSTINGS_FILE = "sparse.npz"
+
+# Latin words/numbers, or runs of CJK ideographs
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "with",
+}
+
+
+def tokenize(text):
+    # NFKC folds full-width forms such as （ｍｇ） into plain ASCII
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    tokens = []
+    for match in _TOKEN_RE.findall(text):
+        if match[0] >= "\u3400":
+            # No word segmenter for Traditional Chinese: index characters and bigrams
+            tokens.extend(match)
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        elif match not in STOPWORDS:
+            tokens.append(match)
+    return tokens
+
+
+def has_sparse_index(db_path):
+    return os.path.exists(os.path.join(db_path, POSTINGS_FILE))
+
+
+def reciprocal_rank_fusion(rankings, k=60, weights=None):
+    """Fuse ranked position lists; returns (positions, scores) best first."""
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, position in enumerate(ranking):
+            position = int(position)
+            if position >= 0:
+                fused[position] = fused.get(position, 0.0) + weight / (k + rank + 1)
+    ordered = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    return [position for position, _ in ordered], [score for _, score in ordered]
+
+
+class SparseIndex:
+    def __init__(self, vocab, term_offsets, doc_ids, term_freqs, doc_lengths, k1=1.2, b=0.75):
+        self.vocab = vocab
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        self.count = len(doc_lengths)
+        self.avg_length = float(doc_lengths.mean()) if self.count else 0.0
+        doc_freqs = np.diff(term_offsets).astype(np.float32)
+        self.idf = np.log(1 + (self.count - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        # Per-document part of the BM25 denominator, computed once
+        self._length_norm = (self.k1 * (1 - self.b + self.b * doc_lengths / max(self.avg_length, 1e-9))).astype(np.float32)
+
+    # ======= BUILD / LOAD =======
+    @classmethod
+    def build(cls, texts):
+        postings = {}
+        lengths = []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths.append(sum(counts.values()))
+            for term, freq in counts.items():
+                postings.setdefault(term, []).append((row, freq))
+
+        vocab = sorted(postings)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        for i, term in enumerate(vocab):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+
+        doc_ids = np.empty(offsets[-1], dtype=np.int32)
+        term_freqs = np.empty(offsets[-1], dtype=np.float32)
+        for i, term in enumerate(vocab):
+            rows = postings[term]
+            doc_ids[offsets[i]:offsets[i + 1]] = [row for row, _ in rows]
+            term_freqs[offsets[i]:offsets[i + 1]] = [freq for _, freq in rows]
+
+        return cls(vocab, offsets, doc_ids, term_freqs, np.asarray(lengths, dtype=np.float32))
+
+    def save(self, db_path):
+        for tmp_path, path in self.stage(db_path):
+            os.replace(tmp_path, path)
+
+    def stage(self, db_path):
+        """Writes the files under temporary names; returns the [(tmp_path, path)] renames still to do."""
+        vocab_path = os.path.join(db_path, VOCAB_FILE)
+        postings_path = os.path.join(db_path, POSTINGS_FILE)
+        with open(vocab_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        np.savez(postings_path + ".tmp.npz", term_offsets=self.term_offsets, doc_ids=self.doc_ids,
+                 term_freqs=self.term_freqs, doc_lengths=self.doc_lengths)
+        return [(vocab_path + ".tmp", vocab_path), (postings_path + ".tmp.npz", postings_path)]
+
+    @classmethod
+    def load(cls, db_path):
+        with open(os.path.join(db_path, VOCAB_FILE), encoding="utf-8") as f:
+            vocab = json.load(f)
+        arrays = np.load(os.path.join(db_path, POSTINGS_FILE))
+        return cls(vocab, arrays["term_offsets"], arrays["doc_ids"], arrays["term_freqs"], arrays["doc_lengths"])
+
+    def nbytes(self):
+        return int(self.term_offsets.nbytes + self.doc_ids.nbytes + self.term_freqs.nbytes + self.doc_lengths.nbytes)
+
+    # ======= QUERY =======
+    def search(self, query, k=10):
+        """BM25 top-k as (positions, scores), best first."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            rows = self.doc_ids[start:end]
+            freqs = self.term_freqs[start:end]
+            # Each row appears once per term, so fancy-index += is safe
+            scores[rows] += self.idf[term_id] * freqs * (self.k1 + 1) / (freqs + self._length_norm[rows])
+            matched = True
+
+        if not matched:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
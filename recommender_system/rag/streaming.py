@@ -0,0 +1,77 @@
+# Server-sent events for the streaming /api/rag/ endpoints.
+#
+# Under ASGI (recommender_system.asgi) the body is an async generator so each
+# token is flushed as it arrives; Django would buffer a sync iterator there.
+# Under WSGI (runserver) a sync generator streams instead.
+import json
+import time
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+from ollama_llm.scheduler import current_lane, scheduler
+from .services import astream_recommendation, stream_recommendation
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _done(started, first_token_at, chunks):
+    now = time.perf_counter()
+    timings = {
+        # Time to the first generated token, not to the response headers
+        "ttfb_ms": round(((first_token_at or now) - started) * 1000, 1),
+        "total_ms": round((now - started) * 1000, 1),
+        "chunks": chunks,
+    }
+    print(f"[INFO] RAG stream: ttfb {timings['ttfb_ms']} ms, total {timings['total_ms']} ms, {chunks} chunks")
+    return sse_event("done", timings)
+
+
+def event_stream(question, translate, started, lane=None, semantic=False):
+    first_token_at, chunks = None, 0
+    try:
+        for chunk in stream_recommendation(question, translate, lane, semantic):
+            if not chunk:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks += 1
+            yield sse_event("token", {"text": chunk})
+    except Exception as e:
+        yield sse_event("error", {"detail": "Error generating recommendation.", "error": str(e)})
+        return
+    yield _done(started, first_token_at, chunks)
+
+
+async def aevent_stream(question, translate, started, lane=None, semantic=False):
+    first_token_at, chunks = None, 0
+    try:
+        async for chunk in astream_recommendation(question, translate, lane, semantic):
+            if not chunk:
+                continue
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            chunks += 1
+            yield sse_event("token", {"text": chunk})
+    except Exception as e:
+        yield sse_event("error", {"detail": "Error generating recommendation.", "error": str(e)})
+        return
+    yield _done(started, first_token_at, chunks)
+
+
+def sse_response(request, question, translate=False, started=None, semantic=False):
+    started = started or time.perf_counter()
+    # Reject a full queue with a 429 now; once the headers are sent it can only be an error event
+    lane = current_lane()
+    scheduler.check(lane)
+    if isinstance(getattr(request, "_request", request), ASGIRequest):
+        content = aevent_stream(question, translate, started, lane, semantic)
+    else:
+        content = event_stream(question, translate, started, lane, semantic)
+
+    response = StreamingHttpResponse(content, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # nginx would otherwise buffer the whole stream
+    return response
@@ -1,3 +1,1348 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from ollama_llm.scheduler import Scheduler, current_lane
+
+from .batching import MicroBatcher
+from .cache import ResponseCache, normalize_question, prompt_fingerprint
+from .context import ContextAssembler, estimate_tokens
+from .docstore import ColumnarDocstore, has_columnar_docstore, iter_documents
+from .embedding_cache import CachedEmbeddings
+from .ingest import indexed_ids
+from .models import SourceDocument
+from .provider import RagProvider, read_faiss_index, read_vectors
+from . import services
+from .retrieval import RetrievalEngine, mmr_select
+from .sparse import SparseIndex, reciprocal_rank_fusion, tokenize
+from .bilingual import SectionSplitter, agenerate_bilingual
+from .ws_protocol import PLAIN_OPTIONS, ProtocolError, parse_frame
+from .translation import (
+    SqliteTranslationStore, TranslationMemory, join_segments, parse_numbered, split_segments,
+    translation_memory_from_env,
+)
+
+
+# ======= RESPONSE CACHE =======
+
+def _embed(text):
+    # Every question with the same first word embeds to the same direction
+    return [1.0, 0.0] if text.split()[0] == "protein" else [0.0, 1.0]
+
+
+class ResponseCacheTests(SimpleTestCase):
+
+    def test_exact_hit_ignores_case_and_whitespace(self):
+        cache = ResponseCache()
+        cache.set("How much  protein?", "answer")
+        self.assertEqual(cache.get("how much protein? "), "answer")
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_namespaces_are_separate(self):
+        cache = ResponseCache()
+        cache.set("question", "english", namespace="summary")
+        self.assertIsNone(cache.get("question", namespace="tr-cn"))
+        self.assertEqual(cache.get("question", namespace="summary"), "english")
+
+    def test_expired_entries_miss(self):
+        cache = ResponseCache(ttl_seconds=10)
+        with mock.patch("rag.cache.time.monotonic", return_value=100.0):
+            cache.set("question", "answer")
+        with mock.patch("rag.cache.time.monotonic", return_value=111.0):
+            self.assertIsNone(cache.get("question"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResponseCache(max_entries=2)
+        cache.set("a", "1")
+        cache.set("b", "2")
+        cache.get("a")
+        cache.set("c", "3")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "1")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_byte_limit(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.set("a", "12345")
+        cache.set("b", "123456")
+        self.assertIsNone(cache.get("a"))
+        cache.set("c", "x" * 11)
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.stats()["bytes"], 6)
+
+    def test_new_version_drops_entries(self):
+        cache = ResponseCache()
+        cache.ensure_version("v1")
+        cache.set("question", "answer")
+        cache.ensure_version("v1")
+        self.assertEqual(cache.get("question"), "answer")
+        cache.ensure_version("v2")
+        self.assertIsNone(cache.get("question"))
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+    def test_similar_question_hits_only_when_both_sides_opt_in(self):
+        cache = ResponseCache(embed_fn=_embed, similarity_threshold=0.99)
+        cache.set("protein for a 70 kg man", "free text", semantic=True)
+        self.assertEqual(cache.get("protein for a 71 kg man", semantic=True), "free text")
+        self.assertEqual(cache.stats()["semantic_hits"], 1)
+        self.assertIsNone(cache.get("fibre for a 70 kg man", semantic=True))
+
+    def test_patient_queries_are_only_served_for_the_exact_query(self):
+        embed = mock.Mock(side_effect=_embed)
+        cache = ResponseCache(embed_fn=embed, similarity_threshold=0.5)
+        cache.set("protein: patient A, 70 kg", "recommendation for A")
+        # Not embedded on either side, and no similarity match even against free-text entries
+        self.assertIsNone(cache.get("protein: patient B, 71 kg"))
+        self.assertIsNone(cache.get("protein: patient B, 71 kg", semantic=True))
+        embed.assert_called_once()
+        self.assertEqual(cache.get("protein: patient A, 70 kg"), "recommendation for A")
+
+    def test_failed_embedding_is_a_miss(self):
+        cache = ResponseCache(embed_fn=mock.Mock(side_effect=OSError("down")), similarity_threshold=0.9)
+        with mock.patch("builtins.print"):
+            cache.set("question", "answer", semantic=True)
+            self.assertIsNone(cache.get("other question", semantic=True))
+            self.assertEqual(cache.get("question", semantic=True), "answer")
+
+
+class FingerprintTests(SimpleTestCase):
+
+    def test_normalize_question(self):
+        self.assertEqual(normalize_question("  Two\n\tLines  "), "two lines")
+
+    def test_prompt_fingerprint_follows_the_template_text(self):
+        self.assertEqual(prompt_fingerprint("a {x}", "b"), prompt_fingerprint("a {x}", "b"))
+        self.assertNotEqual(prompt_fingerprint("a {x}", "b"), prompt_fingerprint("a {x} ", "b"))
+
+
+# ======= EMBEDDING CACHE =======
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.queries = []
+        self.documents = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return [float(len(text)), 1.0]
+
+    def embed_documents(self, texts):
+        self.documents.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class CachedEmbeddingsTests(SimpleTestCase):
+
+    def test_repeated_query_is_served_from_memory(self):
+        fake = FakeEmbeddings()
+        cached = CachedEmbeddings(fake, "model")
+        self.assertEqual(cached.embed_query("abc"), [3.0, 1.0])
+        self.assertEqual(cached.embed_query("abc"), [3.0, 1.0])
+        self.assertEqual(fake.queries, ["abc"])
+        self.assertEqual(cached.stats()["memory_hits"], 1)
+
+    def test_only_missing_and_distinct_texts_reach_the_client(self):
+        fake = FakeEmbeddings()
+        cached = CachedEmbeddings(fake, "model")
+        cached.embed_query("a")
+        vectors = cached.embed_documents(["a", "bb", "bb", "ccc"])
+        self.assertEqual(vectors, [[1.0, 1.0], [2.0, 1.0], [2.0, 1.0], [3.0, 1.0]])
+        self.assertEqual(fake.documents, [["bb", "ccc"]])
+        self.assertEqual(cached.stats()["misses"], 3)
+
+    def test_memory_tier_is_bounded(self):
+        fake = FakeEmbeddings()
+        cached = CachedEmbeddings(fake, "model", max_memory_entries=2)
+        for text in ("a", "b", "c", "a"):
+            cached.embed_query(text)
+        self.assertEqual(fake.queries, ["a", "b", "c", "a"])
+        self.assertEqual(cached.stats()["memory_entries"], 2)
+
+    def test_disk_tier_survives_a_restart_and_is_keyed_on_the_model(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "embeddings.sqlite3")
+            first = CachedEmbeddings(FakeEmbeddings(), "model", cache_path=path)
+            first.embed_documents(["a", "bb"])
+            first.disk.close()
+
+            fake = FakeEmbeddings()
+            second = CachedEmbeddings(fake, "model", cache_path=path)
+            self.assertEqual(second.embed_documents(["a", "bb"]), [[1.0, 1.0], [2.0, 1.0]])
+            self.assertEqual(second.stats()["disk_hits"], 2)
+            self.assertEqual(fake.documents, [])
+            second.disk.close()
+
+            other = CachedEmbeddings(fake, "other-model", cache_path=path)
+            other.embed_query("a")
+            self.assertEqual(fake.queries, ["a"])
+            other.disk.close()
+
+
+# ======= PROVIDER =======
+
+class HashEmbeddings(Embeddings):
+    """Deterministic unit vectors per text, so a text's own chunk is its nearest neighbour."""
+
+    def __init__(self, dim=8):
+        self.dim = dim
+
+    def embed_query(self, text):
+        vector = np.random.default_rng(zlib.crc32(text.encode("utf-8"))).normal(size=self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def write_store(path, texts, metadatas=None, dim=8):
+    """index.faiss + index.pkl, as FAISS.save_local writes them for the real index."""
+    from langchain_community.vectorstores import FAISS
+
+    FAISS.from_texts(list(texts), HashEmbeddings(dim), metadatas=metadatas).save_local(path)
+    return path
+
+
+class RagProviderTests(SimpleTestCase):
+
+    def test_importing_the_services_loads_nothing_heavy(self):
+        code = (
+            "import sys, rag.services; "
+            "print(sorted(m for m in ('faiss', 'langchain_core', 'langchain_ollama') if m in sys.modules), "
+            "rag.services._translation_memory)"
+        )
+        result = subprocess.run([sys.executable, "-c", code], cwd=settings.BASE_DIR, capture_output=True,
+                                text=True, check=True)
+        # Nothing logged either: the translation memory is not opened until first use
+        self.assertEqual((result.stdout, result.stderr), ("[] False\n", ""))
+
+    def test_nothing_is_built_until_used(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            status = RagProvider(db_path=tmp, cache_dir=tmp).status()
+        self.assertFalse(status["embeddings_loaded"] or status["vector_store_loaded"])
+        self.assertEqual(status["load_seconds"], {})
+
+    def test_missing_index_fails_on_first_use(self):
+        provider = RagProvider(db_path="/nonexistent/index", cache_dir="/nonexistent")
+        with mock.patch.object(RagProvider, "_build_embeddings", return_value=HashEmbeddings()):
+            with self.assertRaisesMessage(RuntimeError, "Vector store not found"):
+                provider.vector_store
+
+    def test_components_are_built_once_across_threads(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.05)
+            return object()
+
+        provider = RagProvider(db_path="/nonexistent/index")
+        with mock.patch.object(RagProvider, "_build_embeddings", side_effect=build):
+            threads = [threading.Thread(target=lambda: provider.embeddings) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertIn("embeddings", provider.load_seconds)
+
+    def test_loads_a_saved_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_store(tmp, ["calcium", "protein", "vitamin d"])
+            provider = RagProvider(db_path=tmp, cache_dir=tmp)
+            with mock.patch.object(RagProvider, "_build_embeddings", return_value=HashEmbeddings()):
+                docs = provider.vector_store.similarity_search("protein", k=1)
+        self.assertEqual(docs[0].page_content, "protein")
+
+    def test_warmup_builds_the_retrieval_side_only(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            write_store(tmp, ["calcium", "protein", "vitamin d"])
+            provider = RagProvider(db_path=tmp, cache_dir=tmp)
+            with mock.patch.object(RagProvider, "_build_embeddings", return_value=HashEmbeddings()):
+                loaded = provider.warmup()
+        self.assertEqual(set(loaded), {"embeddings", "vector_store"})
+        self.assertTrue(provider.status()["vector_store_loaded"])
+
+
+# ======= MEMORY-MAPPED INDEX =======
+
+class MappedIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = write_store(tmp.name, [f"chunk {i}" for i in range(20)])
+
+    def test_mapped_index_answers_like_the_loaded_one(self):
+        query = np.asarray([HashEmbeddings().embed_query("chunk 7")], dtype=np.float32)
+        loaded = read_faiss_index(self.db_path).search(query, 5)
+        mapped = read_faiss_index(self.db_path, mmap=True).search(query, 5)
+        np.testing.assert_array_equal(loaded[1], mapped[1])
+        self.assertEqual(mapped[1][0][0], 7)
+
+    def test_exported_vectors_are_memory_mapped_read_only(self):
+        self.assertIsNone(read_vectors(self.db_path))
+        call_command("export_index_vectors", db_path=self.db_path, stdout=io.StringIO())
+
+        vectors = read_vectors(self.db_path, mmap=True)
+        self.assertIsInstance(vectors, np.memmap)
+        self.assertEqual(vectors.shape, (20, 8))
+        self.assertFalse(vectors.flags.writeable)
+        np.testing.assert_allclose(vectors[3], HashEmbeddings().embed_query("chunk 3"), rtol=1e-6)
+
+
+# ======= COLUMNAR DOCSTORE =======
+
+class ColumnarDocstoreTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.texts = ["calcium 1000 mg", "蛋白質 protein", "vitamin d"]
+        self.db_path = write_store(tmp.name, self.texts, metadatas=[{"source": "NIH", "page": i} for i in range(3)])
+        self.pickled = list(iter_documents(self.db_path))
+        call_command("export_docstore", db_path=self.db_path, stdout=io.StringIO())
+
+    def docstore(self):
+        docstore = ColumnarDocstore(self.db_path)
+        self.addCleanup(docstore.close)
+        return docstore
+
+    def test_export_keeps_ids_text_and_metadata_in_index_order(self):
+        self.assertTrue(has_columnar_docstore(self.db_path))
+        exported = list(iter_documents(self.db_path))
+        self.assertEqual([doc_id for doc_id, _ in exported], [doc_id for doc_id, _ in self.pickled])
+        self.assertEqual([doc.page_content for _, doc in exported], self.texts)
+        self.assertEqual(exported[1][1].metadata, {"source": "NIH", "page": 1})
+
+    def test_search_by_position_and_by_id(self):
+        docstore = self.docstore()
+        doc_id = self.pickled[2][0]
+        self.assertEqual(docstore.search(2).page_content, "vitamin d")
+        self.assertEqual(docstore.search(doc_id).page_content, "vitamin d")
+        self.assertEqual(docstore.search(3), "ID 3 not found.")
+        self.assertEqual(docstore.search("missing"), "ID missing not found.")
+
+    def test_serves_the_faiss_wrapper_without_unpickling(self):
+        from langchain_community.vectorstores import FAISS
+
+        os.remove(os.path.join(self.db_path, "index.pkl"))
+        docstore = self.docstore()
+        store = FAISS(HashEmbeddings(), read_faiss_index(self.db_path), docstore, docstore.index_to_docstore_id())
+        doc = store.similarity_search("蛋白質 protein", k=1)[0]
+        self.assertEqual((doc.page_content, doc.metadata["page"]), ("蛋白質 protein", 1))
+
+    def test_is_read_only(self):
+        with self.assertRaisesMessage(ValueError, "read-only"):
+            self.docstore().delete([self.pickled[0][0]])
+
+
+# ======= RETRIEVAL ENGINE =======
+
+class RetrievalEngineTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from langchain_community.vectorstores import FAISS
+
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.texts = [f"chunk {i}" for i in range(40)]
+        write_store(cls.tmp.name, cls.texts)
+        cls.vector_store = FAISS.load_local(cls.tmp.name, HashEmbeddings(), allow_dangerous_deserialization=True)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+        super().tearDownClass()
+
+    def engine(self, **kwargs):
+        return RetrievalEngine.from_vector_store(self.vector_store, **dict({"k": 5, "fetch_k": 20}, **kwargs))
+
+    def test_mmr_select_matches_langchain(self):
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+        rng = np.random.default_rng(0)
+        for lambda_mult in (0.0, 0.3, 0.5, 0.9):
+            candidates = rng.normal(size=(30, 8)).astype(np.float32)
+            query = rng.normal(size=8).astype(np.float32)
+            self.assertEqual(mmr_select(query, candidates, 6, lambda_mult),
+                             maximal_marginal_relevance(query, candidates, lambda_mult=lambda_mult, k=6))
+        self.assertEqual(mmr_select(query, candidates[:0], 6, 0.5), [])
+
+    def test_lambda_one_is_plain_top_k(self):
+        expected = self.vector_store.similarity_search_with_score("chunk 3", k=5)
+        results = self.engine(lambda_mult=1).search_with_scores("chunk 3")
+        self.assertEqual([doc.page_content for doc, _ in results], [doc.page_content for doc, _ in expected])
+        self.assertEqual(results[0][0].page_content, "chunk 3")
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertEqual([score for _, score in results], sorted((score for _, score in results), reverse=True))
+
+    def test_mmr_matches_the_langchain_retriever(self):
+        # Not a stored text: an exact match makes relevance and redundancy tie
+        for lambda_mult in (0.25, 0.5):
+            expected = self.vector_store.max_marginal_relevance_search(
+                "chunk 11 and 12", k=5, fetch_k=20, lambda_mult=lambda_mult)
+            results = self.engine(lambda_mult=lambda_mult).search("chunk 11 and 12")
+            self.assertEqual([doc.page_content for doc in results], [doc.page_content for doc in expected])
+
+    def test_exported_vectors_give_the_same_candidates(self):
+        vectors = self.vector_store.index.reconstruct_n(0, self.vector_store.index.ntotal)
+        with_vectors = self.engine(lambda_mult=0.5, vectors=vectors).search("chunk 20 and 21")
+        reconstructed = self.engine(lambda_mult=0.5).search("chunk 20 and 21")
+        self.assertEqual([doc.page_content for doc in with_vectors], [doc.page_content for doc in reconstructed])
+
+    def test_batched_queries_match_single_searches(self):
+        queries = [f"chunk {i} and {i + 1}" for i in range(0, 12, 2)]
+        expected = [self.engine().search_with_scores(query) for query in queries]
+        engine = self.engine(batcher=None)
+        engine.batcher = MicroBatcher(engine.search_with_scores_many, window_ms=20, name="test-batch")
+        with ThreadPool(len(queries)) as pool:
+            results = pool.map(engine.search_with_scores, queries)
+        self.assertEqual([[doc.page_content for doc, _ in docs] for docs in results],
+                         [[doc.page_content for doc, _ in docs] for docs in expected])
+        self.assertLess(engine.batcher.stats()["batches"], len(queries))
+
+
+class MicroBatcherTests(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def double(self, items):
+        self.calls.append(list(items))
+        time.sleep(0.02)
+        return [item * 2 for item in items]
+
+    def test_concurrent_items_share_a_call(self):
+        batcher = MicroBatcher(self.double, max_batch=16, window_ms=50, concurrency=1)
+        with ThreadPool(8) as pool:
+            results = pool.map(batcher.submit, range(8))
+        self.assertEqual(results, [item * 2 for item in range(8)])
+        self.assertEqual(sorted(item for call in self.calls for item in call), list(range(8)))
+        stats = batcher.stats()
+        self.assertEqual((stats["items"], stats["failures"]), (8, 0))
+        self.assertLess(stats["batches"], 8)
+        self.assertLessEqual(stats["largest_batch"], 16)
+
+    def test_max_batch(self):
+        batcher = MicroBatcher(self.double, max_batch=3, window_ms=50, concurrency=2)
+        with ThreadPool(9) as pool:
+            pool.map(batcher.submit, range(9))
+        self.assertLessEqual(max(len(call) for call in self.calls), 3)
+
+    def test_failures_reach_every_caller(self):
+        batcher = MicroBatcher(lambda items: items[:-1], window_ms=0, name="short")
+        with self.assertRaisesMessage(RuntimeError, "short: 0 results for 1 items"):
+            batcher.submit("a")
+        self.assertEqual(batcher.stats()["failures"], 1)
+        # The slot was released: the next item still gets a batch
+        batcher.fn = self.double
+        self.assertEqual(batcher.submit(2), 4)
+
+    def test_forked_child_does_not_inherit_a_held_lock(self):
+        batcher = MicroBatcher(self.double, window_ms=0)
+        self.assertEqual(batcher.submit(1), 2)
+        # Fork while another thread holds the lock, as a stats() call might
+        held, release = threading.Event(), threading.Event()
+
+        def hold():
+            with batcher._lock:
+                held.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        held.wait()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                code = 1
+                try:
+                    signal.alarm(5)
+                    code = 0 if batcher.submit(21) == 42 else 1
+                finally:
+                    os._exit(code)
+        finally:
+            release.set()
+            holder.join()
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+# ======= ANN INDEXES =======
+
+class AnnIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = write_store(os.path.join(tmp.name, "flat"), [f"chunk {i}" for i in range(60)])
+        self.output = os.path.join(tmp.name, "hnsw")
+        out = io.StringIO()
+        call_command("export_docstore", db_path=self.db_path, stdout=out)
+        call_command("build_sparse_index", db_path=self.db_path, stdout=out)
+
+    def provider(self, db_path):
+        provider = RagProvider(db_path=db_path, cache_dir=db_path)
+        patcher = mock.patch.object(RagProvider, "_build_embeddings", return_value=HashEmbeddings())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return provider
+
+    def test_build_keeps_the_docstore_and_sparse_index(self):
+        call_command("build_ann_index", self.output, type="hnsw", db_path=self.db_path,
+                     search_params="efSearch=64", stdout=io.StringIO())
+        for name in ("docstore.blob", "sparse.npz", "sparse.vocab.json", "vectors.npy", "index_params.json"):
+            self.assertTrue(os.path.exists(os.path.join(self.output, name)), name)
+
+        with mock.patch("rag.provider.HYBRID_SEARCH", True):
+            engine = self.provider(self.output).engine
+        self.assertIsNotNone(engine.sparse)
+        self.assertEqual(engine.index.hnsw.efSearch, 64)
+        self.assertEqual(engine.search("chunk 42")[0].page_content, "chunk 42")
+
+    def test_hybrid_without_a_sparse_index_warns(self):
+        os.remove(os.path.join(self.db_path, "sparse.npz"))
+        with mock.patch("rag.provider.HYBRID_SEARCH", True), mock.patch("builtins.print") as printed:
+            engine = self.provider(self.db_path).engine
+        self.assertIsNone(engine.sparse)
+        self.assertIn("hybrid retrieval is OFF", printed.call_args[0][0])
+
+
+# ======= HYBRID RETRIEVAL =======
+
+def reference_bm25(texts, query, k1=1.2, b=0.75):
+    docs = [tokenize(text) for text in texts]
+    avg_length = sum(len(doc) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0.0
+        for term in set(tokenize(query)):
+            freq = doc.count(term)
+            if not freq:
+                continue
+            doc_freq = sum(term in other for other in docs)
+            idf = np.log(1 + (len(docs) - doc_freq + 0.5) / (doc_freq + 0.5))
+            score += idf * freq * (k1 + 1) / (freq + k1 * (1 - b + b * len(doc) / avg_length))
+        scores.append(score)
+    return scores
+
+
+class SparseIndexTests(SimpleTestCase):
+    texts = [
+        "Vitamin B12 (mcg) for adults over 70",
+        "Sodium (mg) limits for older adults with hypertension",
+        "膳食纖維 dietary fibre 25 g per day",
+        "Vitamin D and calcium for bone health",
+        "Sodium and potassium balance",
+    ]
+
+    def test_tokenize_folds_width_and_splits_chinese(self):
+        self.assertEqual(tokenize("Sodium （ＭＧ） of the day"), ["sodium", "mg", "day"])
+        self.assertEqual(tokenize("膳食纖維"), ["膳", "食", "纖", "維", "膳食", "食纖", "纖維"])
+
+    def test_scores_match_plain_bm25(self):
+        index = SparseIndex.build(self.texts)
+        for query in ("sodium mg", "vitamin", "纖維 fibre"):
+            expected = reference_bm25(self.texts, query)
+            positions, scores = index.search(query, k=len(self.texts))
+            self.assertEqual(len(positions), sum(score > 0 for score in expected))
+            for position, score in zip(positions, scores):
+                self.assertAlmostEqual(float(score), expected[position], places=4)
+            self.assertEqual(list(scores), sorted(scores, reverse=True))
+
+    def test_unknown_terms_match_nothing(self):
+        positions, scores = SparseIndex.build(self.texts).search("zinc", k=3)
+        self.assertEqual((len(positions), len(scores)), (0, 0))
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            SparseIndex.build(self.texts).save(tmp)
+            loaded = SparseIndex.load(tmp)
+        np.testing.assert_array_equal(loaded.search("sodium", k=2)[0], [4, 1])
+
+    def test_reciprocal_rank_fusion(self):
+        positions, scores = reciprocal_rank_fusion([[1, 2, 3], [3, 1, -1]], k=60)
+        self.assertEqual(positions, [1, 3, 2])
+        self.assertAlmostEqual(scores[0], 1 / 61 + 1 / 62)
+        positions, _ = reciprocal_rank_fusion([[1, 2], [2, 1]], weights=[1.0, 2.0])
+        self.assertEqual(positions, [2, 1])
+
+    def test_engine_fuses_lexical_matches_into_dense_results(self):
+        from langchain_community.vectorstores import FAISS
+
+        texts = self.texts + [f"unrelated chunk {i}" for i in range(30)]
+        with tempfile.TemporaryDirectory() as tmp:
+            write_store(tmp, texts)
+            vector_store = FAISS.load_local(tmp, HashEmbeddings(), allow_dangerous_deserialization=True)
+        dense = RetrievalEngine.from_vector_store(vector_store, k=3, fetch_k=10)
+        hybrid = RetrievalEngine.from_vector_store(vector_store, k=3, fetch_k=10, sparse=SparseIndex.build(texts))
+
+        # Hash embeddings carry no meaning, so only the BM25 side can find these
+        self.assertIn("Sodium (mg) limits for older adults with hypertension",
+                      [doc.page_content for doc in hybrid.search("sodium hypertension")])
+        self.assertEqual(len(dense.search("sodium hypertension")), 3)
+
+
+# ======= INGESTION =======
+
+class CountingEmbeddings(HashEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+
+
+class IngestCorpusTests(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.db_path = os.path.join(tmp.name, "store")
+        self.embeddings = CountingEmbeddings()
+        patcher = mock.patch("rag.management.commands.ingest_corpus.provider", mock.Mock(embeddings=self.embeddings))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, source, name, text):
+        os.makedirs(os.path.join(self.root, source), exist_ok=True)
+        with open(os.path.join(self.root, source, name), "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def remove(self, source, name):
+        os.remove(os.path.join(self.root, source, name))
+
+    def ingest(self, source):
+        out = io.StringIO()
+        self.embeddings.embedded = []
+        call_command("ingest_corpus", os.path.join(self.root, source), source=source, db_path=self.db_path,
+                     workers=1, chunk_size=200, chunk_overlap=0, stdout=out)
+        return out.getvalue()
+
+    def texts(self):
+        return sorted(doc.page_content for _, doc in iter_documents(self.db_path))
+
+    def test_only_changed_chunks_are_embedded(self):
+        self.write("NIH", "calcium.txt", "Calcium 1200 mg for women over 50.")
+        self.write("NIH", "protein.txt", "Protein 1.0 g per kg body weight.")
+        self.ingest("NIH")
+        self.assertEqual(len(self.embeddings.embedded), 2)
+
+        self.assertIn("Nothing to do", self.ingest("NIH"))
+        self.assertEqual(self.embeddings.embedded, [])
+
+        self.write("NIH", "protein.txt", "Protein 1.2 g per kg body weight.")
+        self.ingest("NIH")
+        self.assertEqual(self.embeddings.embedded, ["Protein 1.2 g per kg body weight."])
+        self.assertEqual(self.texts(), ["Calcium 1200 mg for women over 50.", "Protein 1.2 g per kg body weight."])
+        self.assertEqual(read_faiss_index(self.db_path).ntotal, 2)
+        self.assertEqual(SourceDocument.objects.filter(source="NIH").count(), 2)
+
+    def test_a_chunk_shared_by_two_sources_stays_until_both_drop_it(self):
+        for source in ("NIH", "NASEM"):
+            self.write(source, "fibre.txt", "Fibre 25 g per day.")
+            self.write(source, f"{source}.txt", f"Only in {source}.")
+        self.ingest("NIH")
+        self.ingest("NASEM")
+        # Already embedded for NIH: NASEM only adds its own chunk
+        self.assertEqual(self.embeddings.embedded, ["Only in NASEM."])
+        self.assertEqual(len(indexed_ids(self.db_path)), 3)
+        self.assertEqual(SourceDocument.objects.filter(text="Fibre 25 g per day.").count(), 2)
+
+        self.remove("NASEM", "fibre.txt")
+        self.ingest("NASEM")
+        self.assertIn("Fibre 25 g per day.", self.texts())
+        self.assertEqual(SourceDocument.objects.filter(text="Fibre 25 g per day.").count(), 1)
+
+        self.remove("NIH", "fibre.txt")
+        self.ingest("NIH")
+        self.assertEqual(self.texts(), ["Only in NASEM.", "Only in NIH."])
+        self.assertFalse(SourceDocument.objects.filter(text="Fibre 25 g per day.").exists())
+
+    def test_sparse_index_and_vectors_follow_the_changes(self):
+        self.write("NIH", "a.txt", "Sodium limits.")
+        self.ingest("NIH")
+        call_command("build_sparse_index", db_path=self.db_path, stdout=io.StringIO())
+        call_command("export_index_vectors", db_path=self.db_path, stdout=io.StringIO())
+
+        self.write("NIH", "b.txt", "Potassium balance.")
+        self.remove("NIH", "a.txt")
+        self.ingest("NIH")
+        self.assertEqual(SparseIndex.load(self.db_path).search("potassium")[0].tolist(), [0])
+        self.assertEqual(SparseIndex.load(self.db_path).search("sodium")[0].tolist(), [])
+        np.testing.assert_allclose(read_vectors(self.db_path)[0], HashEmbeddings().embed_query("Potassium balance."),
+                                   rtol=1e-6)
+
+    def test_a_failed_update_leaves_the_store_untouched(self):
+        self.write("NIH", "a.txt", "Sodium limits.")
+        self.ingest("NIH")
+        before = sorted(os.listdir(self.db_path))
+        index_before = os.stat(os.path.join(self.db_path, "index.faiss")).st_mtime_ns
+
+        self.write("NIH", "b.txt", "Potassium balance.")
+        with mock.patch("rag.ingest.stage_raw_docstore", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.ingest("NIH")
+        self.assertEqual(sorted(os.listdir(self.db_path)), before)
+        self.assertEqual(os.stat(os.path.join(self.db_path, "index.faiss")).st_mtime_ns, index_before)
+        self.assertEqual(self.texts(), ["Sodium limits."])
+        self.assertEqual(SourceDocument.objects.count(), 1)
+
+    def test_a_pickle_docstore_is_converted_in_the_same_swap(self):
+        write_store(self.db_path, ["Legacy chunk."], dim=HashEmbeddings().dim)
+        before = sorted(os.listdir(self.db_path))
+
+        self.write("NIH", "a.txt", "Sodium limits.")
+        with mock.patch("rag.ingest.stage_raw_docstore", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.ingest("NIH")
+        # Still the pickle store: nothing was converted outside the swap
+        self.assertEqual(sorted(os.listdir(self.db_path)), before)
+        self.assertFalse(has_columnar_docstore(self.db_path))
+
+        self.ingest("NIH")
+        self.assertTrue(has_columnar_docstore(self.db_path))
+        self.assertEqual(self.texts(), ["Legacy chunk.", "Sodium limits."])
+
+
+# ======= CONTEXT ASSEMBLY =======
+
+def _words(start, count):
+    return " ".join(f"word{i}" for i in range(start, start + count))
+
+
+def _scored(*items):
+    return [(Document(page_content=text), score) for text, score in items]
+
+
+class ContextAssemblerTests(SimpleTestCase):
+
+    def test_estimate_tokens(self):
+        # "Vitamin" counts 1.3, the rest 1 each
+        self.assertEqual(estimate_tokens("Vitamin D 20 mcg"), 4)
+        self.assertEqual(estimate_tokens("Vitamins " * 10), 13)
+        self.assertEqual(estimate_tokens("膳食纖維"), 4)
+
+    def test_overlap_between_neighbouring_chunks_is_cut(self):
+        first, second = _words(0, 60), _words(40, 60)
+        context, _ = ContextAssembler(tail_std=None, duplicate_threshold=1.1).assemble(
+            _scored((first, 0.9), (second, 0.8)))
+        self.assertEqual(context, first + "\n\n" + _words(60, 40))
+
+    def test_near_duplicates_are_dropped(self):
+        text = _words(0, 50)
+        near = _words(0, 25) + " other " + _words(26, 24)
+        _, report = ContextAssembler(tail_std=None).assemble(
+            _scored((text, 0.9), (near, 0.8), (_words(100, 50), 0.7)))
+        self.assertEqual(report["chunks_out"], 2)
+        self.assertEqual(report["dropped"]["duplicate"], 1)
+
+    def test_low_scoring_tail_is_trimmed(self):
+        docs = _scored(*[(_words(i * 100, 20), score) for i, score in enumerate([0.9, 0.88, 0.87, 0.86, 0.2])])
+        _, report = ContextAssembler(tail_std=0.5).assemble(docs)
+        self.assertEqual(report["dropped"]["tail"], 1)
+        _, report = ContextAssembler(tail_std=0.5, min_chunks=5).assemble(docs)
+        self.assertEqual(report["dropped"]["tail"], 0)
+
+    def test_budget_skips_chunks_that_do_not_fit(self):
+        docs = _scored((_words(0, 30), 0.9), (_words(100, 80), 0.9), (_words(200, 10), 0.9))
+        # "word12" is two tokens: 60, 160 and 20 tokens
+        context, report = ContextAssembler(max_tokens=90, tail_std=None).assemble(docs)
+        self.assertEqual(report["dropped"]["budget"], 1)
+        self.assertEqual(context, _words(0, 30) + "\n\n" + _words(200, 10))
+        self.assertLessEqual(report["tokens_out"], 90)
+
+    def test_unscored_results_are_kept_in_order(self):
+        context, report = ContextAssembler().assemble(_scored((_words(0, 10), None), (_words(50, 10), None)))
+        self.assertEqual(report["chunks_out"], 2)
+        self.assertTrue(context.startswith("word0 "))
+
+    def test_fingerprint_follows_the_settings(self):
+        self.assertNotEqual(ContextAssembler(max_tokens=600).fingerprint(), ContextAssembler().fingerprint())
+
+
+# ======= PIPELINE MODES =======
+
+class PipelineModeTests(SimpleTestCase):
+
+    def setUp(self):
+        self.generations = []
+
+        def stream_answer(prompt, stage):
+            self.generations.append((stage, prompt))
+            return iter([f"{stage} answer"])
+
+        def second_pass(prompt, stage):
+            self.generations.append((stage, prompt))
+            return f"{stage} of the answer"
+
+        for target, replacement in (
+            ("rag_prompt", lambda question, template=services.RAG_PROMPT_TEMPLATE: template),
+            ("stream_answer", stream_answer),
+            ("get_ollama_llm_response", second_pass),
+            ("get_translation_memory", lambda: None),
+        ):
+            patcher = mock.patch.object(services, target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Output guard log lines
+        patcher = mock.patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_multi_pass_is_the_default(self):
+        env = {key: value for key, value in os.environ.items() if key != "RAG_PIPELINE_MODE"}
+        result = subprocess.run([sys.executable, "-c", "import rag.services as s; print(s.PIPELINE_MODE)"],
+                                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout, "multi-pass\n")
+
+    def test_multi_pass_summarizes_or_translates_the_answer(self):
+        self.assertEqual(services.run_pipeline("question", mode="multi-pass"), "summarize of the answer")
+        self.assertEqual([stage for stage, _ in self.generations], ["answer", "summarize"])
+        self.assertIn("answer answer", self.generations[1][1])
+
+        self.generations.clear()
+        self.assertEqual(services.run_pipeline("question", translate=True, mode="multi-pass"),
+                         "translate of the answer")
+        self.assertEqual([stage for stage, _ in self.generations], ["answer", "translate"])
+
+    def test_single_pass_makes_one_generation(self):
+        self.assertEqual(services.run_pipeline("question", translate=True, mode="single-pass"), "answer-tr-cn answer")
+        self.assertEqual(self.generations, [("answer-tr-cn", services.RAG_TRANSLATED_PROMPT_TEMPLATE)])
+
+    def test_an_answer_cut_off_while_reasoning_is_an_error_and_not_cached(self):
+        # num_predict reached inside <think>: the guard keeps nothing
+        thinking = lambda prompt, stage: iter(["<think>", "Considering the intake"])
+        cache = ResponseCache(max_entries=8, ttl_seconds=60)
+
+        async def astream(prompt, stage):
+            for chunk in thinking(prompt, stage):
+                yield chunk
+
+        async def collect():
+            return [chunk async for chunk in services.astream_recommendation("question")]
+
+        with mock.patch.object(services, "stream_answer", thinking), \
+                mock.patch.object(services, "astream_answer", astream), \
+                mock.patch.object(services, "response_cache", cache), \
+                mock.patch.object(services, "_cache_version", lambda: "v1"), \
+                mock.patch.object(services, "PIPELINE_MODE", "single-pass"):
+            with self.assertRaisesMessage(RuntimeError, "LLM returned no answer (answer)"):
+                services.run_pipeline("question")
+            with self.assertRaisesMessage(RuntimeError, "LLM returned no answer (answer)"):
+                asyncio.run(services.arun_pipeline("question", mode="multi-pass"))
+            self.assertIs(services.generate_recommendation("question"), Exception)
+            self.assertIs(asyncio.run(services.agenerate_translated_recommendation("question")), Exception)
+            self.assertEqual(list(services.stream_recommendation("question")), [])
+            self.assertEqual(asyncio.run(collect()), [])
+        self.assertEqual(cache.stats()["entries"], 0)
+        # Nothing reached the second pass
+        self.assertEqual(self.generations, [])
+
+
+# ======= SERVER-SENT EVENTS =======
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+class StreamingViewTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_tokens_then_done(self):
+        chunks = iter(["Summary:", "", " eat more fibre"])
+        with mock.patch("rag.streaming.stream_recommendation", return_value=chunks) as stream:
+            response = self.client.post("/api/rag/query/stream/", {"query": "fibre?"}, content_type="application/json")
+            body = b"".join(response.streaming_content).decode("utf-8")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        events = parse_events(body)
+        self.assertEqual(events[:2], [("token", {"text": "Summary:"}), ("token", {"text": " eat more fibre"})])
+        self.assertEqual(events[2][0], "done")
+        self.assertEqual(events[2][1]["chunks"], 2)
+        self.assertLessEqual(events[2][1]["ttfb_ms"], events[2][1]["total_ms"])
+        # Free-text questions may be answered from a similar cached one
+        self.assertEqual(stream.call_args[0], ("fibre?", False, "interactive", True))
+
+    def test_patient_streams_are_cached_exactly(self):
+        with mock.patch("rag.views._patient_query", return_value="patient 7 query"), \
+                mock.patch("rag.streaming.stream_recommendation", return_value=iter(["ok"])) as stream:
+            response = self.client.get("/api/rag/recommendations/patient/7/tr-cn/stream/")
+            b"".join(response.streaming_content)
+        self.assertEqual(stream.call_args[0], ("patient 7 query", True, "interactive", False))
+
+    def test_failure_after_the_headers_is_an_error_event(self):
+        def failing():
+            yield "Summary:"
+            raise RuntimeError("Ollama went away")
+
+        with mock.patch("rag.streaming.stream_recommendation", return_value=failing()):
+            response = self.client.post("/api/rag/query/stream/", {"query": "q"}, content_type="application/json")
+            events = parse_events(b"".join(response.streaming_content).decode("utf-8"))
+        self.assertEqual(events[-1], ("error", {"detail": "Error generating recommendation.", "error": "Ollama went away"}))
+
+    def test_missing_query(self):
+        response = self.client.post("/api/rag/query/stream/", {}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+    async def test_asgi_streams_from_the_async_generator(self):
+        async def chunks(*args):
+            for chunk in ("a", "b"):
+                yield chunk
+
+        with mock.patch("rag.streaming.astream_recommendation", side_effect=chunks) as stream:
+            response = await self.async_client.post("/api/rag/query/tr-cn/stream/", {"query": "q"},
+                                                    content_type="application/json")
+            body = b"".join([chunk async for chunk in response.streaming_content]).decode("utf-8")
+        self.assertEqual([event for event, _ in parse_events(body)], ["token", "token", "done"])
+        self.assertEqual(stream.call_args[0][:2], ("q", True))
+
+
+TRANSLATABLE = "Summary:\nLow protein. Add eggs.\n\nCaregiver Action Steps:\n1. Add eggs.\n2. Offer water."
+
+
+def numbered_reply(prompt):
+    # Echoes every numbered segment back, "translated"
+    lines = [line for line in prompt.splitlines() if line[:1].isdigit()]
+    return "\n".join(line.replace(". ", ". 譯", 1) for line in lines)
+
+
+class TranslationMemoryTests(SimpleTestCase):
+
+    def memory(self):
+        return TranslationMemory(SqliteTranslationStore(":memory:"), "v1")
+
+    def test_split_and_join_keep_the_layout(self):
+        layout, segments = split_segments(TRANSLATABLE)
+        self.assertEqual(segments, ["Summary:", "Low protein.", "Add eggs.", "Caregiver Action Steps:", "Add eggs.",
+                                    "Offer water."])
+        self.assertEqual(join_segments(layout, segments), TRANSLATABLE.replace("protein. Add", "protein.Add"))
+
+    def test_parse_numbered_accepts_full_width_numbers(self):
+        self.assertEqual(parse_numbered("１．一\n2) 二\n9. out of range\nnoise", 3), {1: "一", 2: "二"})
+
+    def test_only_unseen_segments_reach_the_llm(self):
+        memory, prompts = self.memory(), []
+
+        def llm(prompt):
+            prompts.append(prompt)
+            return numbered_reply(prompt)
+
+        first = memory.translate(TRANSLATABLE, llm, full=None)
+        self.assertIn("1. 譯Add eggs.", first)
+        # "Add eggs." appears twice but is sent once
+        self.assertEqual(prompts[0].count("Add eggs."), 1)
+        self.assertEqual(memory.translate(TRANSLATABLE, llm, full=None), first)
+        self.assertEqual(len(prompts), 1)
+        stats = memory.stats()
+        self.assertEqual((stats["calls"], stats["llm_calls"], stats["calls_saved"]), (2, 1, 1))
+        self.assertEqual(stats["entries"], 5)
+
+    def test_incomplete_reply_falls_back_to_the_whole_text(self):
+        memory = self.memory()
+        with self.assertLogs("rag.translation", "WARNING") as logs:
+            text = memory.translate(TRANSLATABLE, lambda prompt: "1. 摘要", full=lambda text: "whole")
+        self.assertEqual(text, "whole")
+        self.assertIn("covered 1/5", logs.output[0])
+        self.assertEqual(memory.stats()["fallbacks"], 1)
+        self.assertEqual(memory.stats()["entries"], 0)
+
+    def test_async_translate(self):
+        memory = self.memory()
+
+        async def allm(prompt):
+            return numbered_reply(prompt)
+
+        text = asyncio.run(memory.atranslate("Drink water.", allm, afull=None))
+        self.assertEqual(text, "譯Drink water.")
+
+    def test_versions_do_not_share_entries(self):
+        store = SqliteTranslationStore(":memory:")
+        TranslationMemory(store, "v1").translate("Drink water.", numbered_reply, full=None)
+        prompts = []
+        TranslationMemory(store, "v2").translate("Drink water.", lambda p: prompts.append(p) or numbered_reply(p), None)
+        self.assertEqual(len(prompts), 1)
+
+    def test_from_env(self):
+        with mock.patch.dict(os.environ, {"RAG_TRANSLATION_MEMORY": "0"}):
+            self.assertIsNone(translation_memory_from_env("/tmp"))
+        with mock.patch.dict(os.environ, {"RAG_TRANSLATION_MEMORY_PATH": "/nonexistent/dir/tm.sqlite3"}), \
+                self.assertLogs("rag.translation", "WARNING") as logs:
+            memory = translation_memory_from_env("/tmp")
+        self.assertIn("on disk disabled", logs.output[0])
+        self.assertEqual(memory.store.path, ":memory:")
+
+    def test_opened_once_on_first_use(self):
+        built = mock.Mock(return_value="memory")
+        with mock.patch.object(services, "_translation_memory", False), \
+                mock.patch.object(services, "translation_memory_from_env", built):
+            self.assertEqual(services.translation_stats(), {})
+            self.assertEqual(services.get_translation_memory(), "memory")
+            self.assertEqual(services.get_translation_memory(), "memory")
+        built.assert_called_once()
+
+
+BILINGUAL_ANSWER = (
+    "Summary:\nLow protein.\n\n**Key Health Concerns:**\n- Muscle loss\n\n"
+    "## Dietary Issues Observed\n- Refined starch\n\nCaregiver Action Steps:\n1. Add eggs.\n2. Add tofu.\n3. Water.\n"
+)
+
+
+class BilingualTests(SimpleTestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(concurrency=1, batch_concurrency=1, queue_timeout=1)
+        self.translated = []
+        self.chunk_delay = 0
+        self.english_done = False
+
+        async def answer(prompt, stage):
+            try:
+                for chunk in ["<think>plan</think>"] + [line + "\n" for line in BILINGUAL_ANSWER.split("\n")[:-1]]:
+                    await asyncio.sleep(self.chunk_delay)
+                    yield chunk
+            finally:
+                # Also when the output guard closes the stream after the last step
+                self.english_done = True
+
+        async def translate(section):
+            # Same path as the real client: a generation asks the scheduler for a slot
+            async with self.scheduler.aslot():
+                self.translated.append((current_lane(), section.split("\n")[0], self.english_done))
+                return "譯" + section
+
+        cache = mock.Mock()
+        cache.get.return_value = None
+        for target, replacement in (
+            ("scheduler", self.scheduler), ("response_cache", cache), ("_cache_version", lambda: "v"),
+            ("rag_prompt", lambda question, template: "prompt"), ("astream_answer", answer),
+            ("atranslate_text_with_ollama", translate),
+        ):
+            patcher = mock.patch(f"rag.bilingual.{target}", replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_splitter_cuts_at_headings(self):
+        splitter = SectionSplitter()
+        done = []
+        for chunk in [BILINGUAL_ANSWER[i:i + 7] for i in range(0, len(BILINGUAL_ANSWER), 7)]:
+            done += splitter.feed(chunk)
+        done += splitter.finish()
+        self.assertEqual([section.split("\n")[0] for section in done],
+                         ["Summary:", "**Key Health Concerns:**", "## Dietary Issues Observed", "Caregiver Action Steps:"])
+        self.assertEqual(splitter.text, BILINGUAL_ANSWER)
+
+    def test_splitter_ignores_headings_inside_text(self):
+        splitter = SectionSplitter()
+        done = splitter.feed("Summary:\nThe summary: fine.\nKey Health Concerns are few.\n")
+        self.assertEqual(done, [])
+        self.assertEqual(len(splitter.finish()), 1)
+
+    def test_each_translation_takes_its_own_batch_slot(self):
+        result = asyncio.run(agenerate_bilingual("q"))
+        self.assertEqual(result["en"], BILINGUAL_ANSWER.strip())
+        self.assertEqual(result["tr-cn"].count("譯"), 4)
+        self.assertEqual([lane for lane, _, _ in self.translated], ["batch"] * 4)
+        lanes = self.scheduler.stats()["lanes"]
+        # One slot for the English stream, one per translation, and none held afterwards
+        self.assertEqual((lanes["interactive"]["admitted"], lanes["batch"]["admitted"]), (1, 4))
+        self.assertEqual(self.scheduler.stats()["active"], 0)
+
+    def test_one_slot_translates_after_the_english_stream(self):
+        # The English stream outlasts the queue timeout: queued translations would be rejected
+        self.scheduler = Scheduler(concurrency=1, batch_concurrency=1, queue_timeout=0.05)
+        self.chunk_delay = 0.01
+        with mock.patch("rag.bilingual.scheduler", self.scheduler):
+            result = asyncio.run(agenerate_bilingual("q"))
+        self.assertEqual(result["tr-cn"].count("譯"), 4)
+        self.assertEqual([done for _, _, done in self.translated], [True] * 4)
+        self.assertEqual(self.scheduler.stats()["lanes"]["batch"]["admitted"], 4)
+
+    def test_free_slots_translate_while_the_english_streams(self):
+        self.scheduler = Scheduler(concurrency=3, batch_concurrency=2, queue_timeout=1)
+        self.chunk_delay = 0.01
+        with mock.patch("rag.bilingual.scheduler", self.scheduler):
+            asyncio.run(agenerate_bilingual("q"))
+        # Only the last section has to wait for the end of the stream
+        self.assertEqual([done for _, _, done in self.translated], [False, False, False, True])
+
+
+def import_start_server():
+    # start_server.py sits next to the Django project and imports its apps
+    root = str(settings.BASE_DIR.parent)
+    if root not in sys.path:
+        sys.path.append(root)
+    import start_server
+
+    return start_server
+
+
+class FakeAsyncOllama:
+    """stream_text() like the shared client: one scheduler slot per generation, closed when abandoned."""
+
+    def __init__(self, scheduler, chunks=("<think>plan</think>", "\n1. Analysis", " — low protein.")):
+        self.scheduler = scheduler
+        self.chunks = chunks
+        self.active = []
+        self.closed = 0
+
+    async def stream_text(self, prompt, **kwargs):
+        async with self.scheduler.aslot():
+            self.active.append(self.scheduler.stats()["active"])
+            try:
+                for chunk in self.chunks:
+                    await asyncio.sleep(0)
+                    yield chunk
+            finally:
+                self.closed += 1
+
+
+class StartServerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = import_start_server()
+        self.scheduler = Scheduler(concurrency=1, queue_timeout=1)
+        self.events = []
+        self.cache = cache = mock.Mock()
+        cache.get.return_value = None
+        self.ollama = FakeAsyncOllama(self.scheduler)
+        for target, replacement in (("async_ollama", self.ollama), ("response_cache", cache),
+                                    ("corpus_fingerprint", lambda path: "")):
+            patcher = mock.patch.object(self.server, target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_server(self, coroutine_fn, retrieval_slots=1):
+        async def main():
+            with mock.patch.object(self.server, "retrieval_slots", asyncio.Semaphore(retrieval_slots)):
+                return await coroutine_fn()
+
+        return asyncio.run(main())
+
+    def build_prompt(self, question, template):
+        self.events.append(("prompt", dict(self.server.server_stats)))
+        return f"prompt for {question}"
+
+    def test_generation_does_not_hold_a_retrieval_slot(self):
+        async def generate(prompt, budget, on_token):
+            self.events.append(("generate", dict(self.server.server_stats)))
+            return "answer"
+
+        options = {"language": "en", "summarise": True, "budget": None, "stream": False}
+        with mock.patch.object(self.server, "build_prompt", self.build_prompt), \
+                mock.patch.object(self.server, "generate", generate):
+            result = self.run_server(lambda: self.server.answer_request("q", options, None))
+        self.assertEqual(result, ("answer", False))
+        self.assertEqual([(name, stats["active"]) for name, stats in self.events],
+                         [("prompt", 1), ("generate", 0), ("generate", 0)])
+
+    def test_retrieval_slots_bound_prompt_builds_only(self):
+        generating = []
+
+        async def generate(prompt, budget, on_token):
+            generating.append(prompt)
+            await asyncio.sleep(0.2)
+            return prompt
+
+        async def both():
+            options = {"language": "en", "summarise": False, "budget": None, "stream": False}
+            return await asyncio.gather(*(self.server.answer_request(q, options, None) for q in ("a", "b")))
+
+        with mock.patch.object(self.server, "build_prompt", self.build_prompt), \
+                mock.patch.object(self.server, "generate", generate):
+            started = time.perf_counter()
+            results = self.run_server(both, retrieval_slots=1)
+        # One retrieval slot, yet both generations overlapped
+        self.assertLess(time.perf_counter() - started, 0.35)
+        self.assertEqual([text for text, _ in results], ["prompt for a", "prompt for b"])
+
+    def test_plain_questions_share_the_request_path(self):
+        async def both():
+            return (await self.server.answer("q"),
+                    await self.server.answer_request("q", {"language": "en", "summarise": False, "budget": None,
+                                                           "stream": False}))
+
+        with mock.patch.object(self.server, "build_prompt", self.build_prompt):
+            plain, (framed, cached) = self.run_server(both)
+        # Guarded (reasoning dropped), admitted by the scheduler, and the same text on both protocols
+        self.assertEqual(plain, "1. Analysis — low protein.")
+        self.assertEqual(framed, plain)
+        self.assertEqual(self.ollama.active, [1, 1])
+        self.assertEqual(self.scheduler.stats()["active"], 0)
+
+    def test_an_answer_cut_off_while_reasoning_is_not_cached(self):
+        self.ollama.chunks = ("<think>", "plan")
+        with mock.patch.object(self.server, "build_prompt", self.build_prompt):
+            with self.assertRaisesMessage(RuntimeError, "LLM returned no answer"):
+                self.run_server(lambda: self.server.answer("q"))
+        self.cache.set.assert_not_called()
+
+    def test_cancelling_a_plain_question_closes_the_generation(self):
+        self.ollama.chunks = ("<think>", "plan") * 1000
+
+        async def cancelled():
+            task = asyncio.create_task(self.server.answer("q"))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        with mock.patch.object(self.server, "build_prompt", self.build_prompt):
+            self.run_server(cancelled)
+        self.assertEqual(self.ollama.closed, 1)
+        self.assertEqual(self.scheduler.stats()["active"], 0)
+
+    def test_websocket_protocols(self):
+        from websockets.asyncio.client import connect
+        from websockets.asyncio.server import serve
+
+        async def session():
+            async with serve(self.server.echo, "127.0.0.1", 0) as ws_server:
+                port = ws_server.sockets[0].getsockname()[1]
+                async with connect(f"ws://127.0.0.1:{port}") as websocket:
+                    await websocket.send("q")
+                    plain = await websocket.recv()
+                    await websocket.send(json.dumps({"id": 7, "query": "q"}))
+                    untyped = json.loads(await websocket.recv())
+                    await websocket.send(json.dumps({"type": "request", "id": 8, "query": "q",
+                                                     "options": {"language": "fr"}}))
+                    invalid = json.loads(await websocket.recv())
+                    # Binary frames: decoded as UTF-8, or an error frame (and the connection stays up)
+                    await websocket.send(json.dumps({"id": 9, "query": "q"}).encode("utf-8"))
+                    binary = json.loads(await websocket.recv())
+                    await websocket.send(b"\xff\xfe")
+                    undecodable = json.loads(await websocket.recv())
+                    await websocket.send("q")
+                    after = await websocket.recv()
+            return plain, untyped, invalid, binary, undecodable, after
+
+        with mock.patch.object(self.server, "build_prompt", self.build_prompt):
+            plain, untyped, invalid, binary, undecodable, after = self.run_server(session)
+        self.assertEqual(plain, "1. Analysis — low protein.")
+        self.assertEqual((untyped["type"], untyped["id"], untyped["result"]), ("final", 7, plain))
+        self.assertEqual(invalid, {"type": "error", "id": 8, "error": "language must be one of en, tr-cn"})
+        self.assertEqual((binary["type"], binary["id"], binary["result"]), ("final", 9, plain))
+        self.assertEqual(undecodable, {"type": "error", "id": None, "error": "binary frames must be UTF-8 text"})
+        self.assertEqual(after, plain)
+
+
+class SupervisorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = import_start_server()
+
+    def test_restart_delay_grows_while_a_worker_keeps_dying(self):
+        backoff = {}
+        delays = [self.server.restart_delay(backoff, 0, uptime=0.1) for _ in range(7)]
+        self.assertEqual(delays, [1.0, 2.0, 4.0, 8.0, 16.0, 30.0, 30.0])
+
+    def test_restart_delay_is_per_worker_and_resets_after_a_long_run(self):
+        backoff = {}
+        self.server.restart_delay(backoff, 0, uptime=0.1)
+        self.server.restart_delay(backoff, 0, uptime=0.1)
+        self.assertEqual(self.server.restart_delay(backoff, 1, uptime=0.1), 1.0)
+        uptime = self.server.WS_RESTART_MIN_UPTIME + 1
+        self.assertEqual(self.server.restart_delay(backoff, 0, uptime), 0.0)
+        self.assertEqual(backoff, {1: 1.0})
+        self.assertEqual(self.server.restart_delay(backoff, 0, uptime=0.1), 1.0)
+
+    def test_drain_finishes_questions_in_flight(self):
+        from websockets.asyncio.client import connect
+        from websockets.exceptions import ConnectionClosed
+
+        started = asyncio.Event()
+
+        async def answer(question):
+            started.set()
+            await asyncio.sleep(0.1)
+            return f"answer: {question}"
+
+        async def session():
+            # The server start_server.py runs, whose close() drain() calls twice
+            server = await self.server.serve(self.server.echo, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with connect(f"ws://127.0.0.1:{port}") as websocket:
+                await websocket.send("q")
+                await started.wait()
+                draining = asyncio.create_task(self.server.drain(server))
+                reply = await websocket.recv()
+                with self.assertRaises(ConnectionClosed):
+                    await websocket.recv()
+                await draining
+                return reply, websocket.close_code
+
+        with mock.patch.object(self.server, "answer", answer), \
+                mock.patch.object(self.server.residency, "stop"), mock.patch("builtins.print"):
+            self.assertEqual(asyncio.run(session()), ("answer: q", 1001))
+
+
+class WsProtocolTests(SimpleTestCase):
+
+    def test_plain_text(self):
+        for message in ("What should he eat?", "{not json", '{"query": "no id"}', "[1, 2]"):
+            self.assertEqual(parse_frame(message), {"type": "plain", "id": None, "query": message})
+
+    def test_untyped_frame(self):
+        self.assertEqual(parse_frame('{"id": "a", "query": "q"}'), {"type": "untyped", "id": "a", "query": "q"})
+
+    def test_request_defaults(self):
+        frame = parse_frame('{"type": "request", "id": 1, "query": "q"}')
+        self.assertEqual(frame["options"], {"language": "en", "summarise": False, "budget": None, "stream": True})
+        self.assertEqual(PLAIN_OPTIONS, dict(frame["options"], stream=False))
+
+    def test_cancel(self):
+        self.assertEqual(parse_frame('{"type": "cancel", "id": 3}'), {"type": "cancel", "id": 3})
+
+    def test_binary_frames(self):
+        self.assertEqual(parse_frame('{"type": "cancel", "id": 3}'.encode("utf-8")), {"type": "cancel", "id": 3})
+        self.assertEqual(parse_frame("低蛋白".encode("utf-8")), {"type": "plain", "id": None, "query": "低蛋白"})
+        with self.assertRaisesMessage(ProtocolError, "UTF-8"):
+            parse_frame(b"\xff")
+
+    def test_invalid_frames(self):
+        for message, error in (
+            ('{"type": "request", "id": true, "query": "q"}', "id must be"),
+            ('{"type": "request", "id": 1, "query": " "}', "query must be"),
+            ('{"type": "request", "id": 1, "query": "q", "options": {"budget": 0}}', "budget must be"),
+            ('{"type": "request", "id": 1, "query": "q", "options": "fast"}', "options must be"),
+            ('{"type": "ping", "id": 1}', "unknown frame type"),
+        ):
+            with self.assertRaisesMessage(ProtocolError, error) as raised:
+                parse_frame(message)
+            # Errors are answered under the frame's id
+            self.assertEqual(raised.exception.request_id, json.loads(message)["id"])
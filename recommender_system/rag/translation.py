@@ -0,0 +1,289 @@
+# Sentence-level translation memory for the Traditional Chinese endpoints.
+#
+# Recommendations share most of their text across patients: the four section
+# headers, recurring concerns and caregiver steps. TranslationMemory splits the
+# English answer into segments (one per sentence, list markers and numbering
+# kept as layout), serves segments it has translated before from sqlite, and
+# sends only the unseen ones to the LLM, all in one numbered prompt.
+# Kept free of Django imports so start_server.py can use it too.
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+TRANSLATE_SEGMENTS_PROMPT_TEMPLATE = """Translate each numbered line below into Traditional Chinese.
+Reply with exactly one line per number, in the form "1. <translation>", keeping the numbers.
+Do not add, merge or skip lines, and do not add any other text.
+
+{segments}"""
+
+logger = logging.getLogger(__name__)
+
+# Layout around a line's text: indentation, "-"/"*"/"•" bullets, "1." numbering, "#" headings
+_LINE = re.compile(r"^(\s*(?:[-*•]\s+|\d+[.)]\s+|#+\s+)?)(.*?)(\s*)$")
+# Sentence ends followed by the start of a new sentence
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[\"'(A-Z0-9])")
+# "3. text", also full-width digits/punctuation in the model's reply
+_NUMBERED = re.compile(r"^\s*\**\s*([0-9０-９]+)\s*[.．、)）:：]\s*(.*?)\s*$")
+
+
+def normalize_segment(segment):
+    return re.sub(r"\s+", " ", segment).strip()
+
+
+def split_segments(text):
+    """
+    Returns (layout, segments): layout is a list of literal strings and
+    segment indexes that rebuild the text once the segments are translated.
+    """
+    layout, segments = [], []
+    for line in text.split("\n"):
+        if layout:
+            layout.append("\n")
+        prefix, body, suffix = _LINE.match(line).groups()
+        if not body:
+            layout.append(line)
+            continue
+        layout.append(prefix)
+        for sentence in _SENTENCE_END.split(body):
+            sentence = normalize_segment(sentence)
+            if sentence:
+                layout.append(len(segments))
+                segments.append(sentence)
+        layout.append(suffix)
+    return layout, segments
+
+
+def join_segments(layout, translated):
+    # Chinese sentences are not separated by spaces
+    return "".join(translated[part] if isinstance(part, int) else part for part in layout)
+
+
+def parse_numbered(reply, count):
+    """{number: text} for the lines 1..count found in the model's reply."""
+    found = {}
+    for line in reply.splitlines():
+        match = _NUMBERED.match(line)
+        if not match:
+            continue
+        number = int(match.group(1).translate(str.maketrans("０１２３４５６７８９", "0123456789")))
+        if 1 <= number <= count and match.group(2) and number not in found:
+            found[number] = match.group(2)
+    return found
+
+
+class SqliteTranslationStore:
+    """One row per (model, prompt, English segment) hash."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, source TEXT NOT NULL, target TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, target FROM translations WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_many(self, items):
+        now = time.time()
+        rows = [(key, source, target, now) for key, source, target in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TranslationMemory:
+    """
+    Translates text segment by segment. `llm` / `allm` are (prompt) -> reply
+    callables; `full` / `afull` translate a whole text and are the fallback
+    when the model's reply does not account for every numbered segment.
+    """
+
+    def __init__(self, store, version="", max_memory_entries=4096):
+        self.store = store
+        self.version = version
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.llm_calls = 0
+        self.fallbacks = 0
+        self.segments = 0
+        self.hits = 0
+        self.misses = 0
+        self.llm_seconds = 0.0
+
+    def key(self, segment):
+        return hashlib.sha256(f"{self.version}\x00{segment}".encode("utf-8")).hexdigest()
+
+    # ======= LOOKUP =======
+    def _lookup(self, segments):
+        keys = {segment: self.key(segment) for segment in segments}
+        known = {}
+        with self._lock:
+            for segment, key in keys.items():
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    known[segment] = self._memory[key]
+        pending = [segment for segment in keys if segment not in known]
+        if pending:
+            stored = self.store.get_many([keys[segment] for segment in pending])
+            for segment in pending:
+                if keys[segment] in stored:
+                    known[segment] = stored[keys[segment]]
+                    self._remember(keys[segment], known[segment])
+        return known
+
+    def _remember(self, key, target):
+        with self._lock:
+            self._memory[key] = target
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _prepare(self, text):
+        layout, segments = split_segments(text)
+        known = self._lookup(set(segments))
+        # Repeated segments within one text are translated once
+        unseen = list(OrderedDict.fromkeys(segment for segment in segments if segment not in known))
+        with self._lock:
+            self.calls += 1
+            self.segments += len(segments)
+            self.hits += len(segments) - len(unseen)
+            self.misses += len(unseen)
+        return layout, segments, known, unseen
+
+    def _prompt(self, unseen):
+        return TRANSLATE_SEGMENTS_PROMPT_TEMPLATE.format(
+            segments="\n".join(f"{n}. {segment}" for n, segment in enumerate(unseen, 1))
+        )
+
+    def _learn(self, unseen, reply, known):
+        """Adds the parsed reply to `known`; False if any segment is missing from it."""
+        found = parse_numbered(reply, len(unseen))
+        if len(found) < len(unseen):
+            logger.warning("Translation memory: reply covered %d/%d segments, translating the whole text instead",
+                           len(found), len(unseen))
+            return False
+        items = []
+        for n, segment in enumerate(unseen, 1):
+            known[segment] = found[n]
+            items.append((self.key(segment), segment, found[n]))
+            self._remember(items[-1][0], found[n])
+        self.store.put_many(items)
+        return True
+
+    def _record_llm(self, seconds):
+        with self._lock:
+            self.llm_calls += 1
+            self.llm_seconds += seconds
+
+    def _count_fallback(self):
+        # The whole-text translation is a second LLM call
+        with self._lock:
+            self.fallbacks += 1
+            self.llm_calls += 1
+
+    # ======= TRANSLATE =======
+    def translate(self, text, llm, full):
+        layout, segments, known, unseen = self._prepare(text)
+        if unseen:
+            start = time.perf_counter()
+            reply = llm(self._prompt(unseen))
+            self._record_llm(time.perf_counter() - start)
+            if not self._learn(unseen, reply, known):
+                self._count_fallback()
+                return full(text)
+        return join_segments(layout, [known[segment] for segment in segments])
+
+    async def atranslate(self, text, allm, afull):
+        import asyncio
+
+        # The sqlite lookups are local and short, but still blocking
+        layout, segments, known, unseen = await asyncio.to_thread(self._prepare, text)
+        if unseen:
+            start = time.perf_counter()
+            reply = await allm(self._prompt(unseen))
+            self._record_llm(time.perf_counter() - start)
+            if not await asyncio.to_thread(self._learn, unseen, reply, known):
+                self._count_fallback()
+                return await afull(text)
+        return join_segments(layout, [known[segment] for segment in segments])
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        self.store.clear()
+
+    def stats(self):
+        with self._lock:
+            avg_llm_ms = (self.llm_seconds / self.llm_calls * 1000) if self.llm_calls else 0.0
+            # Model time per translated segment, from the batches actually sent
+            ms_per_segment = (self.llm_seconds / self.misses * 1000) if self.misses else 0.0
+            return {
+                "entries": self.store.count(),
+                "calls": self.calls,
+                "llm_calls": self.llm_calls,
+                # Texts served entirely from memory: no LLM call at all
+                "calls_saved": self.calls - self.llm_calls,
+                "fallbacks": self.fallbacks,
+                "segments": self.segments,
+                "segment_hits": self.hits,
+                "segment_misses": self.misses,
+                "hit_rate": round(self.hits / self.segments, 4) if self.segments else 0.0,
+                "avg_llm_ms": round(avg_llm_ms, 2),
+                "saved_ms": round(self.hits * ms_per_segment, 2),
+            }
+
+
+def translation_memory_from_env(default_dir, version=""):
+    # RAG_TRANSLATION_MEMORY=0 disables it; RAG_TRANSLATION_MEMORY_PATH="" keeps it in memory only
+    if os.environ.get("RAG_TRANSLATION_MEMORY", "1") == "0":
+        return None
+    path = os.environ.get(
+        "RAG_TRANSLATION_MEMORY_PATH", os.path.join(default_dir, "translation_memory.sqlite3")
+    )
+    try:
+        store = SqliteTranslationStore(path or ":memory:")
+    except sqlite3.Error as e:
+        logger.warning("Translation memory on disk disabled (%s): %s", path, e)
+        store = SqliteTranslationStore(":memory:")
+    return TranslationMemory(
+        store, version, max_memory_entries=int(os.environ.get("RAG_TRANSLATION_MEMORY_ENTRIES", "4096"))
+    )
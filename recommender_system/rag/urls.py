@@ -1,5 +1,9 @@
 from django.urls import path
-from .views import RagQueryByPatientView, RagQueryChineseView, RagQueryInChineseByPatientView, RagQueryView
+from .views import (
+    RagCacheView, RagQueryBilingualByPatientView, RagQueryBilingualView, RagQueryByPatientStreamView,
+    RagQueryByPatientView, RagQueryChineseStreamView, RagQueryChineseView,
+    RagQueryInChineseByPatientStreamView, RagQueryInChineseByPatientView, RagQueryStreamView, RagQueryView,
+)
 
 urlpatterns = [
     path("query/", RagQueryView.as_view()),
@@ -11,4 +15,20 @@ urlpatterns = [
     path("recommendations/patient/<int:patient_id>//", RagQueryByPatientView.as_view()),
     path("recommendations/patient/<int:patient_id>/tr-cn/", RagQueryInChineseByPatientView.as_view()),
     path("recommendations/patient/<int:patient_id>/tr-cn", RagQueryInChineseByPatientView.as_view()),
+    # Server-sent-event variants: token events as they are generated, then a done event with timings
+    path("query/stream/", RagQueryStreamView.as_view()),
+    path("query/stream", RagQueryStreamView.as_view()),
+    path("query/tr-cn/stream/", RagQueryChineseStreamView.as_view()),
+    path("query/tr-cn/stream", RagQueryChineseStreamView.as_view()),
+    path("recommendations/patient/<int:patient_id>/stream/", RagQueryByPatientStreamView.as_view()),
+    path("recommendations/patient/<int:patient_id>/stream", RagQueryByPatientStreamView.as_view()),
+    path("recommendations/patient/<int:patient_id>/tr-cn/stream/", RagQueryInChineseByPatientStreamView.as_view()),
+    path("recommendations/patient/<int:patient_id>/tr-cn/stream", RagQueryInChineseByPatientStreamView.as_view()),
+    # English + Traditional Chinese, sections translated while the English is generated
+    path("query/bilingual/", RagQueryBilingualView.as_view()),
+    path("query/bilingual", RagQueryBilingualView.as_view()),
+    path("recommendations/patient/<int:patient_id>/bilingual/", RagQueryBilingualByPatientView.as_view()),
+    path("recommendations/patient/<int:patient_id>/bilingual", RagQueryBilingualByPatientView.as_view()),
+    path("cache/", RagCacheView.as_view()),
+    path("cache", RagCacheView.as_view()),
 ]
@@ -1,29 +1,53 @@
+import asyncio
+import time
+
 import requests
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from .services import generate_recommendation, generate_translated_recommendation, translate_text_with_ollama
-
-class RagQueryView(APIView):
-
-    def post(self, request):
-        query = request.data.get("query")
+from ollama_llm.output import output_stats
+from ollama_llm.scheduler import OllamaBusy
+from recommender_system.async_views import AsyncAPIView, ParseError, json_response, request_data
+from .services import (
+    agenerate_recommendation, agenerate_translated_recommendation, response_cache, invalidate_response_cache,
+    translation_stats,
+)
+from .bilingual import agenerate_bilingual
+from .provider import provider
+from .streaming import sse_response
+
+class RagQueryView(AsyncAPIView):
+    translate = False
+
+    async def post(self, request):
+        try:
+            data = request_data(request)
+        except ParseError as e:
+            return json_response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        query = data.get("query") if isinstance(data, dict) else None
 
         if not query:
-            return Response(
+            return json_response(
                 {"detail": "Missing 'query' in request data."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         try:
-            response_text = generate_recommendation(query)
-            return Response(
+            # Free-text questions may be answered from a similar cached question
+            if self.translate:
+                response_text = await agenerate_translated_recommendation(query, semantic=True)
+            else:
+                response_text = await agenerate_recommendation(query, semantic=True)
+            return json_response(
                 {"recommendation": response_text},
                 status=status.HTTP_200_OK
             )
+        except OllamaBusy:
+            # 429/503 + Retry-After (LLMAdmissionMiddleware)
+            raise
         except Exception as e:
-            return Response(
+            return json_response(
                 {
                     "detail": "Error generating recommendation.",
                     "error": str(e)
@@ -35,30 +59,27 @@ class RagQueryView(APIView):
 
 FOOD_INTAKE_BACKEND_URL = "https://h3vkhzth-8000.asse.devtunnels.ms/api/"
 
-class RagQueryByPatientView(APIView):
-    # ======= GET ======= 
-    def get(self, request, patient_id):
-        try:
-            patient = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}"
-            ).json()
-
-            intake = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}/recommended-intake"
-            ).json().get("nutritional_recommendations", {})
-
-            meal_lines = []
-            for idx, assignment in enumerate(patient.get("meal_assignments", []), start=1):
-                meal_id = assignment.get("meal")
-                meal = requests.get(
-                    f"{FOOD_INTAKE_BACKEND_URL}meals/{meal_id}"
-                ).json()
-
-                meal_lines.append(
-                    f"Meal {idx}: {meal.get('meal_name', 'N/A')}"
-                )
-
-            query = f"""
+def _patient_query(patient_id):
+    patient = requests.get(
+        f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}"
+    ).json()
+
+    intake = requests.get(
+        f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}/recommended-intake"
+    ).json().get("nutritional_recommendations", {})
+
+    meal_lines = []
+    for idx, assignment in enumerate(patient.get("meal_assignments", []), start=1):
+        meal_id = assignment.get("meal")
+        meal = requests.get(
+            f"{FOOD_INTAKE_BACKEND_URL}meals/{meal_id}"
+        ).json()
+
+        meal_lines.append(
+            f"Meal {idx}: {meal.get('meal_name', 'N/A')}"
+        )
+
+    query = f"""
 PATIENT DETAILS:
 Patient Name: {patient.get('name')}
 Age: {patient.get('age')}
@@ -82,84 +103,116 @@ Total Water: {intake.get('total_water')} L
 
 MEAL INTAKES:
 """ + "\n".join(meal_lines)
+    return query
 
-            return Response(
-                {"recommendation": generate_recommendation(query)},
+
+
+class RagQueryByPatientView(AsyncAPIView):
+    translate = False
+
+    # ======= GET ======= 
+    async def get(self, request, patient_id):
+        try:
+            # The food-intake backend calls are short; the LLM call below is awaited
+            query = await asyncio.to_thread(_patient_query, patient_id)
+
+            if self.translate:
+                recommendation = await agenerate_translated_recommendation(query)
+            else:
+                recommendation = await agenerate_recommendation(query)
+            return json_response(
+                {"recommendation": recommendation},
                 status=status.HTTP_200_OK
             )
 
+        except OllamaBusy:
+            raise
         except Exception as e:
-            return Response(
+            return json_response(
                 {"detail": "Error generating recommendation", "error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
 
     # ======= POST =========
-    def post(self, request, patient_id):
-        try:
-            patient = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}"
-            ).json()
-
-            intake = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}/recommended-intake"
-            ).json().get("nutritional_recommendations", {})
-
-            meal_lines = []
-            for idx, assignment in enumerate(patient.get("meal_assignments", []), start=1):
-                meal_id = assignment.get("meal")
-                meal = requests.get(
-                    f"{FOOD_INTAKE_BACKEND_URL}meals/{meal_id}"
-                ).json()
-
-                meal_lines.append(
-                    f"Meal {idx}: {meal.get('meal_name', 'N/A')}"
-                )
-
-            query = f"""
-PATIENT DETAILS:
-Patient Name: {patient.get('name')}
-Age: {patient.get('age')}
-Gender: {patient.get('sex').capitalize()}
-Height: {patient.get('height_cm')} cm
-Weight: {patient.get('weight_kg')} kg
-BMI: {patient.get('bmi')}
-Heart Rate: {patient.get('heart_rate')} bpm
-Blood Pressure: {patient.get('systolic_bp')}/{patient.get('diastolic_bp')} mmHg
-Activity Level: {patient.get('activity_level').capitalize()}
+    async def post(self, request, patient_id):
+        return await self.get(request, patient_id)
 
-RECOMMENDED DAILY INTAKE:
-Calories: {intake.get('daily_caloric_needs')} kcal
-Protein: {intake.get('protein')} g
-Carbohydrates: {intake.get('carbohydrate')} g
-Fat: {intake.get('fat')} g
-Total Fiber: {intake.get('total_fiber')} g
-Alpha Linolenic Acid: {intake.get('alpha_linolenic_acid')} g
-Linoleic Acid: {intake.get('linoleic_acid')} g
-Total Water: {intake.get('total_water')} L
 
-MEAL INTAKES:
-""" + "\n".join(meal_lines)
 
-            return Response(
-                {"recommendation": generate_recommendation(query)},
-                status=status.HTTP_200_OK
+# ======= VIEWS FOR CHINESE TRANSLATION =======
+
+class RagQueryChineseView(RagQueryView):
+    translate = True
+        
+
+class RagQueryInChineseByPatientView(RagQueryByPatientView):
+    translate = True
+
+
+
+# ======= BILINGUAL =======
+# English and Traditional Chinese from one generation; sections are translated
+# while the English answer is still being written (rag.bilingual)
+
+def _bilingual_response(result):
+    return json_response(
+        {"recommendation": {"en": result["en"], "tr-cn": result["tr-cn"]}, "timings": result["timings"]},
+        status=status.HTTP_200_OK
+    )
+
+
+class RagQueryBilingualView(AsyncAPIView):
+
+    async def post(self, request):
+        try:
+            data = request_data(request)
+        except ParseError as e:
+            return json_response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        query = data.get("query") if isinstance(data, dict) else None
+
+        if not query:
+            return json_response(
+                {"detail": "Missing 'query' in request data."},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
+        try:
+            return _bilingual_response(await agenerate_bilingual(query, semantic=True))
+        except OllamaBusy:
+            raise
         except Exception as e:
-            return Response(
+            return json_response(
+                {"detail": "Error generating recommendation.", "error": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class RagQueryBilingualByPatientView(AsyncAPIView):
+
+    async def get(self, request, patient_id):
+        try:
+            query = await asyncio.to_thread(_patient_query, patient_id)
+            return _bilingual_response(await agenerate_bilingual(query))
+        except OllamaBusy:
+            raise
+        except Exception as e:
+            return json_response(
                 {"detail": "Error generating recommendation", "error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    async def post(self, request, patient_id):
+        return await self.get(request, patient_id)
 
 
-# ======= VIEWS FOR CHINESE TRANSLATION =======
+# ======= STREAMING (SSE) =======
 
-class RagQueryChineseView(APIView):
+class RagQueryStreamView(APIView):
+    translate = False
 
     def post(self, request):
+        started = time.perf_counter()
         query = request.data.get("query")
 
         if not query:
@@ -168,136 +221,52 @@ class RagQueryChineseView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        try:
-            response_text = generate_translated_recommendation(query)
-            return Response(
-                {"recommendation": response_text},
-                status=status.HTTP_200_OK
-            )
-        except Exception as e:
-            return Response(
-                {
-                    "detail": "Error generating recommendation.",
-                    "error": str(e)
-                },
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-        
+        return sse_response(request, query, translate=self.translate, started=started, semantic=True)
 
-class RagQueryInChineseByPatientView(APIView):
-    # ======= GET ======= 
-    def get(self, request, patient_id):
-        try:
-            patient = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}"
-            ).json()
-
-            intake = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}/recommended-intake"
-            ).json().get("nutritional_recommendations", {})
-
-            meal_lines = []
-            for idx, assignment in enumerate(patient.get("meal_assignments", []), start=1):
-                meal_id = assignment.get("meal")
-                meal = requests.get(
-                    f"{FOOD_INTAKE_BACKEND_URL}meals/{meal_id}"
-                ).json()
-
-                meal_lines.append(
-                    f"Meal {idx}: {meal.get('meal_name', 'N/A')}"
-                )
-
-            query = f"""
-PATIENT DETAILS:
-Patient Name: {patient.get('name')}
-Age: {patient.get('age')}
-Gender: {patient.get('sex').capitalize()}
-Height: {patient.get('height_cm')} cm
-Weight: {patient.get('weight_kg')} kg
-BMI: {patient.get('bmi')}
-Heart Rate: {patient.get('heart_rate')} bpm
-Blood Pressure: {patient.get('systolic_bp')}/{patient.get('diastolic_bp')} mmHg
-Activity Level: {patient.get('activity_level').capitalize()}
 
-RECOMMENDED DAILY INTAKE:
-Calories: {intake.get('daily_caloric_needs')} kcal
-Protein: {intake.get('protein')} g
-Carbohydrates: {intake.get('carbohydrate')} g
-Fat: {intake.get('fat')} g
-Total Fiber: {intake.get('total_fiber')} g
-Alpha Linolenic Acid: {intake.get('alpha_linolenic_acid')} g
-Linoleic Acid: {intake.get('linoleic_acid')} g
-Total Water: {intake.get('total_water')} L
+class RagQueryChineseStreamView(RagQueryStreamView):
+    translate = True
 
-MEAL INTAKES:
-""" + "\n".join(meal_lines)
 
-            return Response(
-                {"recommendation": generate_translated_recommendation(query)},
-                status=status.HTTP_200_OK
-            )
+class RagQueryByPatientStreamView(APIView):
+    translate = False
+
+    def get(self, request, patient_id):
+        return self.post(request, patient_id)
 
+    def post(self, request, patient_id):
+        started = time.perf_counter()
+        try:
+            query = _patient_query(patient_id)
         except Exception as e:
             return Response(
                 {"detail": "Error generating recommendation", "error": str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        
 
-    # ======= POST =========
-    def post(self, request, patient_id):
-        try:
-            patient = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}"
-            ).json()
-
-            intake = requests.get(
-                f"{FOOD_INTAKE_BACKEND_URL}patients/{patient_id}/recommended-intake"
-            ).json().get("nutritional_recommendations", {})
-
-            meal_lines = []
-            for idx, assignment in enumerate(patient.get("meal_assignments", []), start=1):
-                meal_id = assignment.get("meal")
-                meal = requests.get(
-                    f"{FOOD_INTAKE_BACKEND_URL}meals/{meal_id}"
-                ).json()
-
-                meal_lines.append(
-                    f"Meal {idx}: {meal.get('meal_name', 'N/A')}"
-                )
-
-            query = f"""
-PATIENT DETAILS:
-Patient Name: {patient.get('name')}
-Age: {patient.get('age')}
-Gender: {patient.get('sex').capitalize()}
-Height: {patient.get('height_cm')} cm
-Weight: {patient.get('weight_kg')} kg
-BMI: {patient.get('bmi')}
-Heart Rate: {patient.get('heart_rate')} bpm
-Blood Pressure: {patient.get('systolic_bp')}/{patient.get('diastolic_bp')} mmHg
-Activity Level: {patient.get('activity_level').capitalize()}
+        return sse_response(request, query, translate=self.translate, started=started)
 
-RECOMMENDED DAILY INTAKE:
-Calories: {intake.get('daily_caloric_needs')} kcal
-Protein: {intake.get('protein')} g
-Carbohydrates: {intake.get('carbohydrate')} g
-Fat: {intake.get('fat')} g
-Total Fiber: {intake.get('total_fiber')} g
-Alpha Linolenic Acid: {intake.get('alpha_linolenic_acid')} g
-Linoleic Acid: {intake.get('linoleic_acid')} g
-Total Water: {intake.get('total_water')} L
 
-MEAL INTAKES:
-""" + "\n".join(meal_lines)
+class RagQueryInChineseByPatientStreamView(RagQueryByPatientStreamView):
+    translate = True
 
-            return Response(
-                {"recommendation": generate_translated_recommendation(query)},
-                status=status.HTTP_200_OK
-            )
 
-        except Exception as e:
-            return Response(
-                {"detail": "Error generating recommendation", "error": str(e)},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+
+# ======= RESPONSE CACHE =======
+
+class RagCacheView(APIView):
+
+    def get(self, request):
+        return Response(
+            {"responses": response_cache.stats(), "embeddings": provider.embedding_stats(), "context": provider.context_stats(),
+             "output": output_stats.as_dict(), "translation": translation_stats(), "query_batching": provider.batching_stats()},
+            status=status.HTTP_200_OK
+        )
+
+    def delete(self, request):
+        invalidate_response_cache()
+        return Response(
+            {"responses": response_cache.stats(), "embeddings": provider.embedding_stats(), "context": provider.context_stats(),
+             "output": output_stats.as_dict(), "translation": translation_stats(), "query_batching": provider.batching_stats()},
+            status=status.HTTP_200_OK
+        )
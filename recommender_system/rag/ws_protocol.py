@@ -0,0 +1,88 @@
+# Message framing of the websocket recommender server (start_server.py).
+#
+# Plain text: one question in, one answer out, in order (test_client.py).
+#
+# JSON envelopes, answered by id and in any order:
+#   {"type": "request", "id": ..., "query": "...",
+#    "options": {"language": "en" | "tr-cn", "summarise": false, "budget": <answer tokens>, "stream": true}}
+#   {"type": "cancel", "id": ...}
+# answered with
+#   {"type": "token", "id": ..., "stage": "answer" | "summary", "text": "..."}   (when streaming)
+#   {"type": "final", "id": ..., "result": "...", "cached": false, "timings": {...}}
+#   {"type": "error", "id": ..., "error": "..."}
+#   {"type": "cancelled", "id": ...}
+# A cancelled request's Ollama stream is closed, which stops the generation.
+#
+# {"id": ..., "query": ...} without "type" (the Django recommendations pool) is
+# answered like plain text (PLAIN_OPTIONS), with a single final frame.
+# Kept free of Django imports so start_server.py can use it.
+import json
+
+
+LANGUAGES = ("en", "tr-cn")
+
+
+class ProtocolError(ValueError):
+    def __init__(self, message, request_id=None):
+        super().__init__(message)
+        # Echoed in the error frame; None when the frame carried no usable id
+        self.request_id = request_id
+
+
+def parse_options(options):
+    options = options or {}
+    if not isinstance(options, dict):
+        raise ProtocolError("options must be an object")
+    language = options.get("language", "en")
+    if language not in LANGUAGES:
+        raise ProtocolError(f"language must be one of {', '.join(LANGUAGES)}")
+    budget = options.get("budget")
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, int) or budget <= 0):
+        raise ProtocolError("budget must be a positive number of tokens")
+    return {
+        "language": language,
+        "summarise": bool(options.get("summarise", False)),
+        "budget": budget,
+        "stream": bool(options.get("stream", True)),
+    }
+
+
+# Plain-text and untyped questions: the English answer, not streamed
+PLAIN_OPTIONS = dict(parse_options(None), stream=False)
+
+
+def parse_frame(message):
+    """{"type": "plain" | "untyped" | "request" | "cancel", "id", "query", "options"}; raises ProtocolError."""
+    if isinstance(message, bytes):
+        # A binary frame: the same protocol, sent as UTF-8 bytes
+        try:
+            message = message.decode("utf-8")
+        except UnicodeDecodeError:
+            raise ProtocolError("binary frames must be UTF-8 text")
+    if not message.startswith("{"):
+        return {"type": "plain", "id": None, "query": message}
+    try:
+        frame = json.loads(message)
+    except ValueError:
+        # A question that happens to start with "{"
+        return {"type": "plain", "id": None, "query": message}
+    if not isinstance(frame, dict) or "id" not in frame:
+        return {"type": "plain", "id": None, "query": message}
+
+    request_id = frame["id"]
+    if not isinstance(request_id, (str, int)) or isinstance(request_id, bool):
+        raise ProtocolError("id must be a string or a number", request_id)
+    kind = frame.get("type")
+    if kind is None and isinstance(frame.get("query"), str):
+        return {"type": "untyped", "id": request_id, "query": frame["query"]}
+    if kind == "cancel":
+        return {"type": "cancel", "id": request_id}
+    if kind == "request":
+        if not isinstance(frame.get("query"), str) or not frame["query"].strip():
+            raise ProtocolError("query must be a non-empty string", request_id)
+        try:
+            options = parse_options(frame.get("options"))
+        except ProtocolError as e:
+            raise ProtocolError(str(e), request_id)
+        return {"type": "request", "id": request_id, "query": frame["query"], "options": options}
+    raise ProtocolError(f"unknown frame type {kind!r}", request_id)
@@ -1,3 +1,131 @@
-from django.test import TestCase
+import asyncio
+import json
 
-# Create your tests here.
+from django.test import SimpleTestCase
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from .ws_pool import RecommenderError, RecommenderPool, _Stats
+
+
+class RecommenderPoolTests(SimpleTestCase):
+    """Against an in-process websocket server speaking start_server.py's {"id", "query"} frames."""
+
+    def setUp(self):
+        self.received = []
+        self.connections = 0
+
+    async def handler(self, websocket):
+        self.connections += 1
+        try:
+            async for message in websocket:
+                frame = json.loads(message)
+                self.received.append(frame)
+                if frame.get("type") != "cancel":
+                    asyncio.create_task(self.reply(websocket, frame))
+        except ConnectionClosed:
+            pass
+
+    async def reply(self, websocket, frame):
+        query = frame["query"]
+        if query.startswith("sleep "):
+            # "sleep 0.2 name": answered after a delay, so later questions overtake it
+            await asyncio.sleep(float(query.split()[1]))
+        if query == "fail":
+            await websocket.send(json.dumps({"id": frame["id"], "error": "RAG chain failed"}))
+        elif query == "close":
+            await websocket.close(1011, "RAG chain failed")
+        else:
+            # Progress frames are skipped by the pool
+            await websocket.send(json.dumps({"type": "token", "id": frame["id"], "text": "..."}))
+            await websocket.send(json.dumps({"id": frame["id"], "result": f"answer: {query}"}))
+
+    def run_pool(self, scenario, size=1, max_in_flight=8):
+        async def main():
+            async with serve(self.handler, "127.0.0.1", 0) as server:
+                port = server.sockets[0].getsockname()[1]
+                pool = RecommenderPool(f"ws://127.0.0.1:{port}", size, max_in_flight, _Stats())
+                try:
+                    return await scenario(pool)
+                finally:
+                    await pool.close()
+
+        return asyncio.run(main())
+
+    def test_connection_is_reused(self):
+        async def scenario(pool):
+            return [await pool.request("a"), await pool.request("b")], pool.stats.as_dict()
+
+        answers, stats = self.run_pool(scenario)
+        self.assertEqual(answers, ["answer: a", "answer: b"])
+        self.assertEqual(self.connections, 1)
+        self.assertEqual((stats["connects"], stats["requests"], stats["reused"]), (1, 2, 1))
+
+    def test_answers_are_matched_by_id(self):
+        async def scenario(pool):
+            return await asyncio.gather(pool.request("sleep 0.2 first"), pool.request("second"))
+
+        self.assertEqual(self.run_pool(scenario), ["answer: sleep 0.2 first", "answer: second"])
+        self.assertEqual(self.connections, 1)
+
+    def test_spreads_over_new_connections_up_to_size(self):
+        async def scenario(pool):
+            await asyncio.gather(*(pool.request(f"sleep 0.05 {n}") for n in range(4)))
+            return len(pool.connections)
+
+        self.assertEqual(self.run_pool(scenario, size=2), 2)
+        self.assertEqual(self.connections, 2)
+
+    def test_error_frame(self):
+        async def scenario(pool):
+            with self.assertRaisesMessage(RecommenderError, "RAG chain failed"):
+                await pool.request("fail")
+            # The connection stays usable
+            return await pool.request("ok"), pool.stats.as_dict()
+
+        answer, stats = self.run_pool(scenario)
+        self.assertEqual(answer, "answer: ok")
+        self.assertEqual((stats["errors"], stats["connects"]), (1, 1))
+
+    def test_timeout_cancels_on_the_server(self):
+        async def scenario(pool):
+            with self.assertRaises(TimeoutError):
+                await pool.request("sleep 1 slow", timeout=0.1)
+            await asyncio.sleep(0.05)
+            return pool.stats.as_dict()
+
+        stats = self.run_pool(scenario)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(self.received[-1], {"type": "cancel", "id": self.received[0]["id"]})
+
+    def test_caller_going_away_cancels_on_the_server(self):
+        async def scenario(pool):
+            task = asyncio.create_task(pool.request("sleep 1 slow"))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.05)
+            return pool.stats.as_dict()
+
+        self.assertEqual(self.run_pool(scenario)["cancelled"], 1)
+        self.assertEqual(self.received[-1]["type"], "cancel")
+
+    def test_closed_connection_fails_waiters_and_reconnects(self):
+        async def scenario(pool):
+            with self.assertRaisesMessage(RecommenderError, "1011"):
+                await pool.request("close")
+            return await pool.request("again"), pool.stats.as_dict()
+
+        answer, stats = self.run_pool(scenario)
+        self.assertEqual(answer, "answer: again")
+        self.assertEqual((stats["connects"], stats["dropped"], stats["reconnects"]), (1, 1, 1))
+
+    def test_unreachable_server(self):
+        async def main():
+            pool = RecommenderPool("ws://127.0.0.1:1", 1, 8, _Stats())
+            with self.assertRaisesMessage(RecommenderError, "Cannot connect"):
+                await pool.request("q")
+            return pool.stats.as_dict()
+
+        self.assertEqual(asyncio.run(main())["connect_errors"], 1)
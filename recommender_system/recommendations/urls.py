@@ -1,7 +1,8 @@
 # recommendations/urls.py
 from django.urls import path
-from .views import GenerateRecommendationView
+from .views import GenerateRecommendationView, RecommenderPoolView
 
 urlpatterns = [
     path("generate/", GenerateRecommendationView.as_view()),
+    path("pool/", RecommenderPoolView.as_view()),
 ]
\ No newline at end of file
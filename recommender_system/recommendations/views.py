@@ -2,24 +2,30 @@ import json
 import os
 import logging
 from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from recommender_system.async_views import AsyncAPIView, json_response, request_data
 from .services import generate_recommendation, calculate_dri
-from websockets.sync.client import connect
+from .ws_pool import RecommenderError, recommender_pools
+from websockets.asyncio.client import connect
 from websockets.exceptions import ConnectionClosedError
 
 logger = logging.getLogger(__name__)
 
+# RECOMMENDER_WS_POOL=0: one websocket connection per request, as before
+RECOMMENDER_WS_POOL = os.environ.get("RECOMMENDER_WS_POOL", "1") != "0"
+
 
 # Get output/response from RAG chain
-class GenerateRecommendationView(APIView):
-    def post(self, request):
+class GenerateRecommendationView(AsyncAPIView):
+    async def post(self, request):
         try:
-            data = request.data
+            data = request_data(request)
 
             # Validate request data is a dictionary
             if not isinstance(data, dict):
-                return Response({
+                return json_response({
                     "detail": "Invalid request format. Expected JSON object.",
                     "received_type": type(data).__name__
                 }, status=400)
@@ -28,7 +34,7 @@ class GenerateRecommendationView(APIView):
             required_fields = ["sex", "age", "height_cm", "weight_kg", "activity_level", "meal"]
             missing_fields = [field for field in required_fields if field not in data]
             if missing_fields:
-                return Response({
+                return json_response({
                     "detail": "Missing required fields",
                     "missing_fields": missing_fields
                 }, status=400)
@@ -45,7 +51,7 @@ class GenerateRecommendationView(APIView):
                 meal_name = data["meal"].get("meal_name")
                 intake_weight_g = data["meal"].get("consumed_weight_g")
             except (AttributeError, TypeError) as e:
-                return Response({
+                return json_response({
                     "detail": "Invalid meal data format",
                     "error": str(e)
                 }, status=400)
@@ -59,49 +65,70 @@ class GenerateRecommendationView(APIView):
             ws_url = getattr(settings, "RECOMMENDER_WS_URL", os.environ.get("RECOMMENDER_WS_URL", "ws://0.0.0.0:25002"))
 
             try:
-                with connect(ws_url, close_timeout=10) as websocket:
-                    websocket.send(question)
-                    message = websocket.recv()
-
-                    result = {
-                        "dri_results": dri_results,
-                        "recommendation": message
-                    }
-                    return Response(result, status=200)
-
+                # Awaited, so a pending recommendation does not hold a worker thread.
+                # Under ASGI the event loop lives as long as the process, so questions share
+                # the pool's persistent connections; under WSGI each request gets its own loop.
+                if RECOMMENDER_WS_POOL and isinstance(getattr(request, "_request", request), ASGIRequest):
+                    message = await recommender_pools.request(ws_url, question)
+                else:
+                    async with connect(ws_url, close_timeout=10) as websocket:
+                        await websocket.send(question)
+                        message = await websocket.recv()
+
+                result = {
+                    "dri_results": dri_results,
+                    "recommendation": message
+                }
+                return json_response(result, status=200)
+
+            except RecommenderError as e:
+                logger.error(f"Recommendation service error: {e}")
+                return json_response({
+                    "detail": "Recommendation service returned an error",
+                    "error": str(e)
+                }, status=503)
             except ConnectionClosedError as e:
                 logger.error(f"WebSocket connection closed: {e}")
-                return Response({
+                return json_response({
                     "detail": "Recommendation service returned an error",
                     "error": f"WebSocket closed: {e.rcvd.code if e.rcvd else 'unknown'} - {e.rcvd.reason if e.rcvd else 'no reason'}"
                 }, status=503)
             except TimeoutError as e:
                 logger.error(f"WebSocket connection timeout: {e}")
-                return Response({
+                return json_response({
                     "detail": "Recommendation service timeout",
                     "error": str(e)
                 }, status=504)
             except Exception as e:
                 logger.error(f"WebSocket error: {type(e).__name__}: {e}")
-                return Response({
+                return json_response({
                     "detail": "Recommendation service unreachable",
                     "error": f"{type(e).__name__}: {str(e)}"
                 }, status=503)
 
         except (KeyError, TypeError, ValueError) as e:
             logger.error(f"Request validation error: {e}")
-            return Response({
+            return json_response({
                 "detail": "Error processing request",
                 "error": str(e)
             }, status=400)
         except Exception as e:
             logger.error(f"Unexpected error: {type(e).__name__}: {e}")
-            return Response({
+            return json_response({
                 "detail": "Internal server error",
                 "error": str(e)
             }, status=500)
 
 
+class RecommenderPoolView(APIView):
+    """
+    GET /api/recommendations/pool/
+    Websocket pool to the recommender server: open connections, requests in flight, reuse.
+    """
+    def get(self, request):
+        return Response(recommender_pools.as_dict(), status=200)
+
+
 # class GenerateRecommendationView(APIView):
 #     """
 #     POST /api/recommendations/generate/
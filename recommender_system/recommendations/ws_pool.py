@@ -0,0 +1,257 @@
+# Process-wide pool of long-lived websocket connections to the recommender
+# server (start_server.py).
+#
+# Instead of a TCP + websocket handshake per HTTP request, questions are sent
+# as {"id": ..., "query": ...} frames over a few persistent connections, and
+# the {"id": ..., "result"/"error": ...} answers are matched back by id, so
+# one connection carries several questions at once. websockets' keepalive
+# pings are the health check: a connection that stops answering them is
+# closed, its waiting requests fail, and the next request opens a new one.
+# A request that times out or whose caller goes away is cancelled on the
+# server with a {"type": "cancel", "id": ...} frame.
+#
+# One pool per event loop (a websocket connection belongs to its loop); under
+# ASGI that is one pool for the process.
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+
+from websockets.asyncio.client import connect
+from websockets.exceptions import ConnectionClosed
+
+
+RECOMMENDER_WS_POOL_SIZE = int(os.environ.get("RECOMMENDER_WS_POOL_SIZE", "4"))
+# Questions in flight per connection; keep it <= start_server's WS_MAX_PENDING_PER_CONNECTION
+RECOMMENDER_WS_MAX_IN_FLIGHT = int(os.environ.get("RECOMMENDER_WS_MAX_IN_FLIGHT", "8"))
+RECOMMENDER_WS_TIMEOUT = float(os.environ.get("RECOMMENDER_WS_TIMEOUT", "300"))
+RECOMMENDER_WS_CONNECT_TIMEOUT = float(os.environ.get("RECOMMENDER_WS_CONNECT_TIMEOUT", "10"))
+RECOMMENDER_WS_PING_INTERVAL = float(os.environ.get("RECOMMENDER_WS_PING_INTERVAL", "20"))
+
+
+class RecommenderError(RuntimeError):
+    pass
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(
+            ("connects", "reconnects", "connect_errors", "dropped", "requests", "reused", "errors",
+             "timeouts", "cancelled", "stale_retries"), 0)
+        self.seconds = 0.0
+
+    def count(self, key, n=1):
+        with self._lock:
+            self.counts[key] += n
+
+    def record(self, seconds):
+        with self._lock:
+            self.seconds += seconds
+
+    def as_dict(self):
+        with self._lock:
+            done = self.counts["requests"] - self.counts["errors"] - self.counts["timeouts"] - self.counts["cancelled"]
+            return dict(
+                self.counts,
+                reuse_rate=round(self.counts["reused"] / self.counts["requests"], 4) if self.counts["requests"] else 0.0,
+                avg_ms=round(self.seconds / done * 1000, 2) if done > 0 else 0.0,
+            )
+
+
+class _Connection:
+    def __init__(self, pool, websocket, number):
+        self.pool = pool
+        self.websocket = websocket
+        self.number = number
+        self.pending = {}   # request id -> future
+        self.requests = 0
+        self.opened_at = time.time()
+        self.reader = asyncio.create_task(self._read())
+
+    @property
+    def alive(self):
+        return not self.reader.done()
+
+    async def _read(self):
+        try:
+            async for message in self.websocket:
+                try:
+                    frame = json.loads(message)
+                except ValueError:
+                    continue
+                if not isinstance(frame, dict) or frame.get("type") in ("token", "cancelled"):
+                    continue
+                future = self.pending.pop(frame.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in frame:
+                    future.set_exception(RecommenderError(frame["error"]))
+                else:
+                    future.set_result(frame.get("result"))
+        except ConnectionClosed:
+            pass
+        finally:
+            code, reason = self.websocket.close_code, self.websocket.close_reason
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(RecommenderError(f"WebSocket closed: {code} - {reason or 'no reason'}"))
+            self.pending.clear()
+            self.pool._dropped(self)
+
+    async def cancel(self, request_id):
+        self.pending.pop(request_id, None)
+        try:
+            await self.websocket.send(json.dumps({"type": "cancel", "id": request_id}))
+        except ConnectionClosed:
+            pass
+
+    def stats(self):
+        return {
+            "number": self.number,
+            "in_flight": len(self.pending),
+            "requests": self.requests,
+            "age_s": round(time.time() - self.opened_at, 1),
+            "ping_ms": round(self.websocket.latency * 1000, 2),
+        }
+
+
+class RecommenderPool:
+    def __init__(self, url, size, max_in_flight, stats):
+        self.url = url
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self.stats = stats
+        self.connections = []
+        self._numbers = 0
+        self._ever_dropped = False
+        self._connect_lock = asyncio.Lock()
+        # Beyond size x max_in_flight questions, requests wait here
+        self._capacity = asyncio.Semaphore(size * max_in_flight)
+
+    async def _open(self):
+        websocket = await connect(
+            self.url, open_timeout=RECOMMENDER_WS_CONNECT_TIMEOUT, close_timeout=10, max_size=None,
+            ping_interval=RECOMMENDER_WS_PING_INTERVAL or None, ping_timeout=RECOMMENDER_WS_PING_INTERVAL or None,
+        )
+        self._numbers += 1
+        connection = _Connection(self, websocket, self._numbers)
+        self.connections.append(connection)
+        self.stats.count("reconnects" if self._ever_dropped else "connects")
+        return connection
+
+    def _dropped(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+            self._ever_dropped = True
+            self.stats.count("dropped")
+
+    def _least_busy(self):
+        live = [c for c in self.connections if c.alive and len(c.pending) < self.max_in_flight]
+        return min(live, key=lambda c: len(c.pending), default=None)
+
+    async def _checkout(self):
+        best = self._least_busy()
+        # Spread load over new connections before stacking questions on a busy one
+        if best is None or (best.pending and len(self.connections) < self.size):
+            async with self._connect_lock:
+                if len(self.connections) < self.size:
+                    try:
+                        return await self._open()
+                    except (OSError, asyncio.TimeoutError, ConnectionClosed) as e:
+                        self.stats.count("connect_errors")
+                        if best is None:
+                            raise RecommenderError(f"Cannot connect to {self.url}: {type(e).__name__}: {e}")
+                else:
+                    # Other requests opened the last connections while this one waited for the lock
+                    best = self._least_busy() or best
+        if best is None or not best.alive:
+            raise RecommenderError("No recommender connection available")
+        return best
+
+    async def request(self, question, timeout=RECOMMENDER_WS_TIMEOUT):
+        async with self._capacity:
+            self.stats.count("requests")
+            started = time.perf_counter()
+            for attempt in range(2):
+                connection = await self._checkout()
+                request_id = uuid.uuid4().hex
+                future = asyncio.get_running_loop().create_future()
+                connection.pending[request_id] = future
+                try:
+                    await connection.websocket.send(json.dumps({"id": request_id, "query": question}, ensure_ascii=False))
+                except ConnectionClosed:
+                    # Closed while idle (server restart, failed ping): once more on a fresh connection
+                    connection.pending.pop(request_id, None)
+                    if attempt:
+                        self.stats.count("errors")
+                        raise RecommenderError("WebSocket closed before the question was sent")
+                    self.stats.count("stale_retries")
+                    continue
+                if connection.requests:
+                    self.stats.count("reused")
+                connection.requests += 1
+                break
+
+            try:
+                result = await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                self.stats.count("timeouts")
+                await connection.cancel(request_id)
+                raise TimeoutError(f"No answer from the recommender server within {timeout:g}s")
+            except asyncio.CancelledError:
+                # The HTTP client went away: stop the generation on the server too
+                self.stats.count("cancelled")
+                await asyncio.shield(connection.cancel(request_id))
+                raise
+            except RecommenderError:
+                self.stats.count("errors")
+                raise
+            finally:
+                connection.pending.pop(request_id, None)
+            self.stats.record(time.perf_counter() - started)
+            return result
+
+    async def close(self):
+        for connection in list(self.connections):
+            await connection.websocket.close()
+
+
+class RecommenderPools:
+    """The pool of the running event loop, created on first use; stats are shared."""
+
+    def __init__(self, size=RECOMMENDER_WS_POOL_SIZE, max_in_flight=RECOMMENDER_WS_MAX_IN_FLIGHT):
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self.stats = _Stats()
+        self._pools = weakref.WeakKeyDictionary()
+
+    def get(self, url):
+        pools = self._pools.setdefault(asyncio.get_running_loop(), {})
+        pool = pools.get(url)
+        if pool is None:
+            pool = pools[url] = RecommenderPool(url, self.size, self.max_in_flight, self.stats)
+        return pool
+
+    async def request(self, url, question, timeout=RECOMMENDER_WS_TIMEOUT):
+        return await self.get(url).request(question, timeout)
+
+    def as_dict(self):
+        connections = [
+            dict(connection.stats(), url=pool.url)
+            for pools in list(self._pools.values()) for pool in pools.values() for connection in pool.connections
+        ]
+        return {
+            "size": self.size,
+            "max_in_flight": self.max_in_flight,
+            "connections": connections,
+            "in_flight": sum(connection["in_flight"] for connection in connections),
+            **self.stats.as_dict(),
+        }
+
+
+# Process-wide pools
+recommender_pools = RecommenderPools()
@@ -0,0 +1,42 @@
+"""
+Async base view for the LLM-backed endpoints.
+
+DRF's APIView cannot have ``async def`` handlers, so these endpoints use a
+plain Django class-based view: every handler is a coroutine, and under the
+ASGI entry point (``recommender_system/asgi.py``) a request waiting on Ollama
+or the websocket recommender holds no worker thread. Requests and responses
+keep the JSON shapes of the former APIViews.
+"""
+import json
+
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+
+class AsyncAPIView(View):
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # APIView was csrf-exempt as well
+        return csrf_exempt(super().as_view(**initkwargs))
+
+
+class ParseError(ValueError):
+    pass
+
+
+def request_data(request):
+    """JSON body (like DRF's request.data), falling back to form fields."""
+    if request.content_type == "application/json":
+        if not request.body:
+            return {}
+        try:
+            return json.loads(request.body)
+        except ValueError as e:
+            raise ParseError(f"JSON parse error - {e}")
+    return request.POST.dict()
+
+
+def json_response(data, status=200):
+    return JsonResponse(data, status=status, safe=False, json_dumps_params={"ensure_ascii": False})
@@ -0,0 +1,51 @@
+"""
+LLM admission middleware.
+
+Puts each request in a scheduler lane (``X-LLM-Priority: batch`` for bulk
+jobs, interactive otherwise) and turns an ``OllamaBusy`` rejection from
+``ollama_llm.scheduler`` into a 429/503 response with a ``Retry-After``
+header, so clients back off instead of timing out and retrying.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import JsonResponse
+
+from ollama_llm.scheduler import LANES, OllamaBusy, use_lane
+
+
+PRIORITY_HEADER = "HTTP_X_LLM_PRIORITY"
+
+
+def request_lane(request):
+    lane = request.META.get(PRIORITY_HEADER, "").strip().lower()
+    return lane if lane in LANES else "interactive"
+
+
+class LLMAdmissionMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with use_lane(request_lane(request)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with use_lane(request_lane(request)):
+            return await self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, OllamaBusy):
+            return None
+        response = JsonResponse(
+            {"detail": "LLM service busy, retry later.", "error": str(exception), "retry_after": exception.retry_after},
+            status=exception.status,
+        )
+        response["Retry-After"] = str(exception.retry_after)
+        return response
@@ -85,6 +85,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # LLM priority lanes and 429/503 + Retry-After on rejection
+    'recommender_system.middleware.LLMAdmissionMiddleware',
 ]
 
 ROOT_URLCONF = 'recommender_system.urls'
@@ -0,0 +1,72 @@
+import json
+from unittest import mock
+
+from django.test import RequestFactory, SimpleTestCase
+
+from ollama_llm.client import OllamaError
+
+from .async_views import ParseError, json_response, request_data
+
+
+class RequestDataTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_json_body(self):
+        request = self.factory.post("/", data=json.dumps({"prompt": "hi"}), content_type="application/json")
+        self.assertEqual(request_data(request), {"prompt": "hi"})
+
+    def test_empty_json_body(self):
+        request = self.factory.post("/", data="", content_type="application/json")
+        self.assertEqual(request_data(request), {})
+
+    def test_invalid_json_raises_parse_error(self):
+        request = self.factory.post("/", data="{not json", content_type="application/json")
+        with self.assertRaisesMessage(ParseError, "JSON parse error"):
+            request_data(request)
+
+    def test_form_fields(self):
+        request = self.factory.post("/", data={"prompt": "hi"})
+        self.assertEqual(request_data(request), {"prompt": "hi"})
+
+    def test_json_response_keeps_non_ascii(self):
+        response = json_response({"answer": "摘要"}, status=201)
+        self.assertEqual(response.status_code, 201)
+        self.assertIn("摘要", response.content.decode("utf-8"))
+
+    def test_json_response_allows_lists(self):
+        self.assertEqual(json.loads(json_response([1, 2]).content), [1, 2])
+
+
+class AsyncPromptViewTests(SimpleTestCase):
+    url = "/api/ollama/chat/prompt/"
+
+    async def test_prompt(self):
+        generate = mock.AsyncMock(return_value={"response": "hello"})
+        with mock.patch("ollama_llm.views.async_ollama.generate", generate):
+            response = await self.async_client.post(self.url, {"prompt": "hi"}, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"response": "hello"})
+        generate.assert_awaited_once_with("hi")
+
+    async def test_missing_prompt(self):
+        response = await self.async_client.post(self.url, {}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Prompt is required."})
+
+    async def test_invalid_json(self):
+        response = await self.async_client.post(self.url, "{oops", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JSON parse error", response.json()["error"])
+
+    async def test_ollama_error(self):
+        generate = mock.AsyncMock(side_effect=OllamaError("Ollama request timed out"))
+        with mock.patch("ollama_llm.views.async_ollama.generate", generate):
+            response = await self.async_client.post(self.url, {"prompt": "hi"}, content_type="application/json")
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {"error": "Ollama request timed out"})
+
+    async def test_csrf_exempt(self):
+        client = self.async_client_class(enforce_csrf_checks=True)
+        response = await client.post(self.url, {}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
@@ -1,38 +1,29 @@
-# VECTOR STORE AND EMBEDDINGS
-from langchain_ollama import ChatOllama, OllamaEmbeddings
-import faiss
-from langchain_community.vectorstores import FAISS
-from langchain_community.docstore.in_memory import InMemoryDocstore
-
-# PROMPTING
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
-
 import asyncio
 from websockets.server import serve
+import contextlib
 import os
+import socket
+import sys
 import json
+import time
+import traceback
 
 import signal
 
+from websockets.exceptions import ConnectionClosed
 
-# Load local LLM model from Ollama server
-# LLM Model: deepseek-r1:8b
-#model = ChatOllama(model="deepseek-r1:8b", base_url="http://localhost:11434")
-model = ChatOllama(model="deepseek-r1:8b", base_url="http://localhost:11434")
+# Shared helpers live in the Django project's rag app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "recommender_system"))
+from rag.cache import cache_from_env, corpus_fingerprint, prompt_fingerprint
+from rag.provider import provider
+from rag.ws_protocol import PLAIN_OPTIONS, ProtocolError, parse_frame
+from ollama_llm.client import OLLAMA_CHAIN_TIMEOUT, async_ollama
+from ollama_llm.output import OutputBudget, aguarded_stream
+from ollama_llm.residency import residency
 
-# Initialize Ollama Embedding model
-embeddings = OllamaEmbeddings(model='nomic-embed-text:v1.5', base_url="http://localhost:11434")
-
-# Load vector database
-#BASE_DIR = "/home/rochefym/projects/11172025_ver2_websockets"
-BASE_DIR = "/home/k503/下載/20251124_Recommender_System-main/"
-db_path = os.path.join(BASE_DIR, "dietary_reference_intakes")
-new_vector_store = FAISS.load_local(db_path, embeddings=embeddings, allow_dangerous_deserialization=True)
 
 # Prompt Template
-prompt = ChatPromptTemplate.from_template("""
+PROMPT_TEMPLATE = """
 You are a professional clinical nutritionist specializing in elderly care in Taiwan.
 
 Use the retrieved context below to support your reasoning.
@@ -52,43 +43,381 @@ Based on this meal intake and his calculated daily DRIs, please provide:
 1. **Analysis** — summarize the nutritional content and adequacy.
 2. **Suggestions** — what can be improved or balanced .
 3. **Recommendations** — practical next steps for elderly dietary care.
-""")
-
-# Create a vector store Retriever
-retriever = new_vector_store.as_retriever(
-    search_type="mmr",
-    search_kwargs={
-        "k": 10,          # fewer but higher-quality chunks
-        "fetch_k": 50,   # how many to initially fetch before filtering
-        "lambda_mult": 1  # balance between diversity and relevance
-    }
+"""
+
+# Response cache in front of the generations, keyed on the normalized question; the
+# questions are patient queries, so similarity hits are never used here
+response_cache = cache_from_env(embed_fn=lambda text: provider.embeddings.embed_query(text))
+
+# Allow overriding host/port via environment variables
+WS_HOST = os.environ.get("WS_HOST", "0.0.0.0")
+WS_PORT = int(os.environ.get("WS_PORT", "25002"))
+# >1: a supervisor forks this many worker processes sharing the listening socket
+WS_WORKERS = int(os.environ.get("WS_WORKERS", "1"))
+# Seconds a stopping worker waits for its questions in flight before closing connections
+WS_DRAIN_TIMEOUT = float(os.environ.get("WS_DRAIN_TIMEOUT", "30"))
+# Workers dying sooner than this after starting are restarted with a growing delay
+WS_RESTART_MIN_UPTIME = float(os.environ.get("WS_RESTART_MIN_UPTIME", "10"))
+
+# Retrievals / prompt builds (CPU-side work) running at once per process; the
+# generations themselves are admitted by ollama_llm.scheduler (OLLAMA_MAX_CONCURRENCY)
+WS_MAX_CONCURRENCY = int(os.environ.get("WS_MAX_CONCURRENCY", "4"))
+# Questions one connection may have in flight; beyond that its socket is not read
+# (backpressure). Multiplexing clients (the Django recommendations pool) send up
+# to this many framed questions over one connection.
+WS_MAX_PENDING_PER_CONNECTION = int(os.environ.get("WS_MAX_PENDING_PER_CONNECTION", "8"))
+
+retrieval_slots = None   # asyncio.Semaphore(WS_MAX_CONCURRENCY), created in main()
+replies = set()      # reply tasks of all connections, waited for when draining
+server_stats = {"active": 0, "waiting": 0, "answered": 0, "failed": 0, "cancelled": 0}
+
+
+# Same prompt, answered directly in Traditional Chinese (single pass, no translation call)
+PROMPT_TEMPLATE_TR_CN = PROMPT_TEMPLATE.replace(
+    "- Give the response in English.", "- Give the entire response, headings included, in Traditional Chinese."
 )
 
-# Function to format Retrieved documents from the vector store
-def format_docs(docs):
-    return "\n\n".join([doc.page_content for doc in docs])
+SUMMARISE_PROMPT_TEMPLATE = """Summarize the answer below in 120 words or less.
+Keep its three numbered parts (Analysis, Suggestions, Recommendations) and write in the same language.
+Reply with the summary only.
+
+{text}"""
 
-# Define RAG chain
-rag_chain = (
-    {"context": retriever | format_docs, "question": RunnablePassthrough()}
-    | prompt
-    | model
-    | StrOutputParser()
+# Cached answers are only valid for the prompts that produced them
+prompt_version = prompt_fingerprint(
+    PROMPT_TEMPLATE, PROMPT_TEMPLATE_TR_CN, SUMMARISE_PROMPT_TEMPLATE, provider.context_fingerprint()
 )
 
+
+# ======= ANSWERS =======
+@contextlib.asynccontextmanager
+async def retrieval_slot():
+    # CPU-side work only (embedding, FAISS search, prompt formatting); awaited,
+    # so other connections (and their pings) are served meanwhile
+    server_stats["waiting"] += 1
+    try:
+        await retrieval_slots.acquire()
+    finally:
+        server_stats["waiting"] -= 1
+    server_stats["active"] += 1
+    try:
+        yield
+    finally:
+        server_stats["active"] -= 1
+        retrieval_slots.release()
+
+
+def build_prompt(question, template):
+    return template.format(question=question, context=provider.build_context(question))
+
+
+async def generate(prompt, budget, on_token):
+    """Streams one generation through the output guard; cancelling the caller closes the Ollama stream."""
+    text = ""
+    chunks = async_ollama.stream_text(prompt, options=budget.options(), timeout=OLLAMA_CHAIN_TIMEOUT)
+    async for chunk in aguarded_stream(chunks, "text", budget):
+        text += chunk
+        await on_token(chunk)
+    # Cut off inside the reasoning block: an error, not an empty answer to cache
+    if not text.strip():
+        raise RuntimeError("LLM returned no answer; the output budget ran out while reasoning")
+    return text.strip()
+
+
+async def answer_request(question, options, send_token=None):
+    """(answer, cached) for a "request" frame; tokens go to send_token(stage, text) as generated."""
+    namespace = "ws:{language}:{summarise}:{budget}".format(**options)
+    # The cache may embed the question (a blocking HTTP call): keep it off the loop
+    await asyncio.to_thread(response_cache.ensure_version, corpus_fingerprint(provider.db_path) + prompt_version)
+    cached = await asyncio.to_thread(response_cache.get, question, namespace)
+    if cached is not None:
+        return cached, True
+
+    def on_token(stage):
+        async def send(text):
+            if options["stream"]:
+                await send_token(stage, text)
+        return send
+
+    # Reasoning is dropped; "budget" caps the answer after it
+    budget = OutputBudget(answer_tokens=options["budget"], stop=None)
+    template = PROMPT_TEMPLATE_TR_CN if options["language"] == "tr-cn" else PROMPT_TEMPLATE
+    async with retrieval_slot():
+        prompt = await asyncio.to_thread(build_prompt, question, template)
+    # Each generation waits for its own scheduler slot, not a retrieval slot
+    results = await generate(prompt, budget, on_token("answer"))
+    if options["summarise"]:
+        results = await generate(
+            SUMMARISE_PROMPT_TEMPLATE.format(text=results), budget, on_token("summary")
+        )
+    await asyncio.to_thread(response_cache.set, question, results, namespace)
+    return results, False
+
+
+async def answer(question):
+    """Plain-text and untyped questions: same prompt, scheduler slot and output guard as a request frame."""
+    results, _ = await answer_request(question, PLAIN_OPTIONS)
+    return results
+
+
+# ======= CONNECTIONS =======
 async def echo(websocket):
-    async for message in websocket:        
-        results = rag_chain.invoke(message)
-        await websocket.send(results)
-
-async def main():
-    # Allow overriding host/port via environment variables
-    ws_address = os.environ.get("WS_HOST", "0.0.0.0")
-    ws_port = int(os.environ.get("WS_PORT", "25002"))
-    async with serve(echo, ws_address, ws_port):
-        print("[INFO] please connect to the WebSocket service:", f"ws://{ws_address}:{ws_port}")
-    
-        await asyncio.Future()  # run forever
+    pending = asyncio.Semaphore(WS_MAX_PENDING_PER_CONNECTION)
+    tasks = set()
+    running = {}        # request id -> task, for cancel frames
+    last_plain = None   # plain-text answers carry no id, so they are sent in order
+
+    async def send_frame(**frame):
+        await websocket.send(json.dumps(frame, ensure_ascii=False))
+
+    def answered(started):
+        server_stats["answered"] += 1
+        print(f"[INFO] answered in {time.perf_counter() - started:.2f}s {server_stats}")
+        print("[CACHE] embeddings:", provider.embedding_stats())
+
+    async def reply_plain(question, previous_plain):
+        started = time.perf_counter()
+        try:
+            try:
+                results = await answer(question)
+            except Exception as e:
+                server_stats["failed"] += 1
+                print(f"[WARN] RAG chain failed: {e}")
+                results = None
+            if previous_plain is not None:
+                await asyncio.wait([previous_plain])
+            if results is None:
+                await websocket.close(1011, "RAG chain failed")
+                return
+            await websocket.send(results)
+            answered(started)
+        except ConnectionClosed:
+            pass
+        finally:
+            pending.release()
+
+    async def reply_framed(frame):
+        request_id = frame["id"]
+        started = time.perf_counter()
+        first_token = None
+
+        async def send_token(stage, text):
+            nonlocal first_token
+            if first_token is None:
+                first_token = time.perf_counter()
+            await send_frame(type="token", id=request_id, stage=stage, text=text)
+
+        try:
+            try:
+                if frame["type"] == "untyped":
+                    results, cached = await answer(frame["query"]), None
+                else:
+                    results, cached = await answer_request(frame["query"], frame["options"], send_token)
+            except asyncio.CancelledError:
+                if not running.pop(request_id, None):
+                    raise   # the connection is gone
+                server_stats["cancelled"] += 1
+                print(f"[INFO] request {request_id!r} cancelled after {time.perf_counter() - started:.2f}s")
+                await send_frame(type="cancelled", id=request_id)
+                return
+            except Exception as e:
+                # A failed question must not take the other questions on this connection down
+                server_stats["failed"] += 1
+                print(f"[WARN] RAG chain failed: {e}")
+                running.pop(request_id, None)
+                await send_frame(type="error", id=request_id, error=str(e))
+                return
+            running.pop(request_id, None)
+            timings = {"total_ms": round((time.perf_counter() - started) * 1000, 1)}
+            if first_token is not None:
+                timings["first_token_ms"] = round((first_token - started) * 1000, 1)
+            await send_frame(type="final", id=request_id, result=results, cached=cached, timings=timings)
+            answered(started)
+        except ConnectionClosed:
+            pass
+        finally:
+            pending.release()
+
+    async def reject(request_id, error):
+        try:
+            await send_frame(type="error", id=request_id, error=error)
+        except ConnectionClosed:
+            pass
+        finally:
+            pending.release()
+
+    try:
+        while True:
+            await pending.acquire()
+            try:
+                message = await websocket.recv()
+            except ConnectionClosed:
+                break
+            try:
+                frame = parse_frame(message)
+            except ProtocolError as e:
+                task = asyncio.create_task(reject(e.request_id, str(e)))
+            else:
+                if frame["type"] == "cancel":
+                    # Unknown ids are ignored: the answer may already be on its way
+                    task = running.get(frame["id"])
+                    if task is not None:
+                        task.cancel()
+                    pending.release()
+                    continue
+                if frame["type"] == "plain":
+                    task = asyncio.create_task(reply_plain(frame["query"], last_plain))
+                    last_plain = task
+                elif frame["id"] in running:
+                    task = asyncio.create_task(reject(frame["id"], "a request with this id is already running"))
+                else:
+                    task = asyncio.create_task(reply_framed(frame))
+                    running[frame["id"]] = task
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            replies.add(task)
+            task.add_done_callback(replies.discard)
+    finally:
+        # The client is gone: free the slots its questions hold
+        running.clear()
+        for task in tasks:
+            task.cancel()
+
+# ======= WORKERS =======
+async def main(sock=None, worker=None):
+    # Workers of one supervisor memory-map the index read-only: one copy in the page cache
+    if sock is not None:
+        provider.mmap = True
+    # Load the embeddings client and vector store before accepting connections
+    print("[INFO] RAG components loaded:", provider.warmup())
+    if worker in (None, 0):
+        # Load both Ollama models before the first question, then keep them loaded
+        print("[INFO] Ollama models warmed (ms):", residency.warm())
+        residency.start(warm=False)
+
+    global retrieval_slots
+    retrieval_slots = asyncio.Semaphore(WS_MAX_CONCURRENCY)
+
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+
+    if sock is not None:
+        # Pre-forked: every worker accepts on the supervisor's listening socket
+        server = await serve(echo, sock=sock)
+        print(f"[INFO] worker {worker} (pid {os.getpid()}) accepting connections")
+    else:
+        server = await serve(echo, WS_HOST, WS_PORT)
+        print("[INFO] please connect to the WebSocket service:", f"ws://{WS_HOST}:{WS_PORT}")
+
+    await stop
+    await drain(server)
+
+
+async def drain(server):
+    """Stops accepting, lets questions in flight finish (up to WS_DRAIN_TIMEOUT), then closes with 1001."""
+    # Stop accepting; the listening socket stays open in the supervisor and the
+    # other workers. server.close() only acts once, so it is kept for the 1001s
+    server.server.close()
+    deadline = time.monotonic() + WS_DRAIN_TIMEOUT
+    print(f"[INFO] draining (pid {os.getpid()}): {len(replies)} questions in flight")
+    while replies and time.monotonic() < deadline:
+        await asyncio.wait(set(replies), timeout=deadline - time.monotonic())
+    if replies:
+        print(f"[WARN] drain timeout: cancelling {len(replies)} questions")
+    server.close()
+    await server.wait_closed()
+    residency.stop()
+
+
+def run_worker(sock, worker):
+    # Forked child: drop the supervisor's handlers, serve until SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    code = 0
+    try:
+        asyncio.run(main(sock, worker))
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def restart_delay(backoff, worker, uptime):
+    """Seconds before restarting `worker`: 1, 2, 4 ... up to 30 while it keeps dying within WS_RESTART_MIN_UPTIME."""
+    if uptime < WS_RESTART_MIN_UPTIME:
+        backoff[worker] = min(backoff.get(worker, 0.5) * 2, 30.0)
+        return backoff[worker]
+    backoff.pop(worker, None)
+    return 0.0
+
+
+def supervise(workers):
+    """Pre-fork: one listening socket, `workers` child processes accepting on it, restarted when they die."""
+    sock = socket.create_server((WS_HOST, WS_PORT), backlog=1024)
+    print(f"[INFO] supervisor (pid {os.getpid()}) starting {workers} workers; "
+          f"please connect to the WebSocket service: ws://{WS_HOST}:{WS_PORT}")
+
+    children = {}   # pid -> (worker number, started)
+    backoff = {}    # worker number -> seconds before the next restart
+    stopping = []
+
+    def spawn(worker):
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid == 0:
+            run_worker(sock, worker)
+        children[pid] = (worker, time.monotonic())
+
+    def on_signal(signum, frame):
+        if not stopping:
+            stopping.append(time.monotonic())
+            print(f"[INFO] supervisor: {signal.Signals(signum).name}, draining {len(children)} workers")
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    for worker in range(workers):
+        spawn(worker)
+
+    restarts = []   # (when, worker number)
+    killed = False
+    while children or (restarts and not stopping):
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0   # every worker is waiting for its restart
+        if pid == 0:
+            if stopping and not killed and time.monotonic() - stopping[0] > WS_DRAIN_TIMEOUT + 10:
+                print(f"[WARN] supervisor: killing {len(children)} workers that did not drain")
+                for pid in children:
+                    os.kill(pid, signal.SIGKILL)
+                killed = True
+            now = time.monotonic()
+            for when, worker in [item for item in restarts if item[0] <= now]:
+                restarts.remove((when, worker))
+                if not stopping:
+                    spawn(worker)
+            time.sleep(0.2)
+            continue
+        worker, started = children.pop(pid)
+        if stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        delay = restart_delay(backoff, worker, time.monotonic() - started)
+        print(f"[WARN] worker {worker} (pid {pid}) exited with {code}; restarting in {delay:.1f}s")
+        restarts.append((time.monotonic() + delay, worker))
+    sock.close()
+    print("[INFO] supervisor: all workers stopped")
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if WS_WORKERS > 1:
+        supervise(WS_WORKERS)
+    else:
+        asyncio.run(main())
@@ -1,15 +1,21 @@
 # Install websockets library if not already installed; Python 3.12 or lower is required
 # command: pip install websockets
 
+import os
+import sys
+
 # Import the connect function from websockets library:
 from websockets.sync.client import connect
 
+# Server address; e.g. ws://127.0.0.1:25002 for a local start_server.py or `manage.py mock_rag_server`
+WS_URL = os.environ.get("RECOMMENDER_WS_URL", "ws://120.117.116.47:25002")
+
 # get_rag_response: Function to get response from RAG chain
-def get_rag_response():
-    # Sample question:
-    question =  "A patient named Jackie Chan is a 76-year-old man. He is 175cms tall and weighs 71 kilos. He is having 320 grams of stir-fried seasonal vegetables and 220 grams of cabbage soup for his meal. Can you provide (1) an analysis, (2) suggestions, and (3) recommendations?"
+def get_rag_response(question=None):
+    # Sample question, unless one is given on the command line:
+    question = question or "A patient named Jackie Chan is a 76-year-old man. He is 175cms tall and weighs 71 kilos. He is having 320 grams of stir-fried seasonal vegetables and 220 grams of cabbage soup for his meal. Can you provide (1) an analysis, (2) suggestions, and (3) recommendations?"
 
-    with connect("ws://120.117.116.47:25002") as websocket:
+    with connect(WS_URL) as websocket:
         #Send question to RAG chain server:
         message = question
         print(f"Send: {message}")
@@ -22,4 +28,4 @@ def get_rag_response():
 
 
 # Function call to test the RAG response:
-get_rag_response()
+get_rag_response(" ".join(sys.argv[1:]))